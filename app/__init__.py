@@ -55,6 +55,10 @@ def create_app(config_name='default'):
     moment.init_app(app)
     csrf.init_app(app)
 
+    # resolved once here rather than on every call to Strava
+    from app.services import strava_client
+    app.extensions['strava_settings'] = strava_client.load_settings(app.config)
+
     oauth.init_app(app)
     oauth.register(
         'auth0',
@@ -98,6 +102,9 @@ def create_app(config_name='default'):
     # this filter allows environment variables to be read inside the jinja templates
     app.jinja_env.filters['get_os_env'] = utils.get_os_env
 
+    from app import cli
+    cli.register(app)
+
     return app
 
 
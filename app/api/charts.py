@@ -0,0 +1,101 @@
+from flask import request, jsonify, current_app, abort, make_response, url_for
+from flask_login import current_user, login_required
+
+from app.api import bp
+from app.services import charting, identity, rollup, week_calendar
+
+SUM_BY_OPTIONS = ('duration', 'distance')
+
+# the furthest back the exercise log pages through weeks
+MAX_WEEK_OFFSET = 13
+
+
+def week_links(offset: int, sum_by: str):
+    """
+    returns the exercise log page and the chart data of the week at offset
+    :param offset: number of weeks before the current week
+    :type offset: int
+    :param sum_by: whether the chart sums by duration or distance
+    :type sum_by: string
+    :return: the urls, None if the week can't be paged to
+    :rtype: dict
+    """
+    if not 0 <= offset <= MAX_WEEK_OFFSET:
+        return None
+    return {'page': url_for('main.exercise_log', offset=offset, sum_by=sum_by),
+            'chart': url_for('api.chart_week', offset=offset, sum_by=sum_by)}
+
+
+@bp.route('/chart/week/<int:offset>/<sum_by>', methods=['GET'])
+@login_required
+def chart_week(offset, sum_by):
+    """
+    returns the chart.js data sets of the daily totals of a week, as drawn on the exercise log, so paging through
+    the weeks doesn't render the whole page. The response carries an entity tag and last modified time
+    based on the latest change to the user's activities in the week, if neither has changed since the browser
+    last fetched it 304 Not Modified is returned
+    :param offset: number of weeks before the current week
+    :type offset: int
+    :param sum_by: whether to sum by duration or distance
+    :type sum_by: string
+    :return: the week and its data sets as json
+    :rtype:
+    """
+    if sum_by not in SUM_BY_OPTIONS or offset > MAX_WEEK_OFFSET:
+        abort(404)
+
+    calendar = week_calendar.get_calendar(identity.get_timezone_name(current_user))
+    _, start_week_date, end_week_date = calendar.bookends(offset)
+    version = rollup.get_week_version(current_user.get_id(), start_week_date)
+    etag = rollup.get_week_etag(current_user.get_id(), start_week_date, sum_by, version)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    week_rows = rollup.get_daily_rows(current_user.get_id(), start_week_date, end_week_date,
+                                      current_app.config['CHART_AGGREGATION_BACKEND'])
+    response = jsonify({'offset': offset,
+                        'sum_by': sum_by,
+                        'start_week': start_week_date.strftime("%b %d"),
+                        'end_week': end_week_date.strftime("%b %d"),
+                        'datasets': charting.get_chart_dataset_from_rows(week_rows, start_week_date, end_week_date,
+                                                                         sum_by=sum_by),
+                        'pages': {option: url_for('main.exercise_log', offset=offset, sum_by=option)
+                                  for option in SUM_BY_OPTIONS},
+                        'previous': week_links(offset + 1, sum_by),
+                        'next': week_links(offset - 1, sum_by)})
+    response.set_etag(etag)
+    if version[2]:
+        response.last_modified = version[2]
+    # the data is the user's own so must not be shared, and is checked with the etag before reuse
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@bp.route('/chart/trend/<sum_by>', methods=['GET'])
+@login_required
+def chart_trend(sum_by):
+    """
+    returns the weekly totals of each activity type over the last number of weeks, ending with the current week,
+    as chart.js data sets. The weeks query string parameter sets how many weeks, 12 by default.
+    The totals are read from the weekly rollups so the cost doesn't depend on the number of activities
+    :param sum_by: whether to sum by duration or distance
+    :type sum_by: string
+    :return: the week labels and data sets as json
+    :rtype:
+    """
+    number_weeks = request.args.get('weeks', 12, type=int)
+    if sum_by not in SUM_BY_OPTIONS or not 0 < number_weeks <= current_app.config['CHART_TREND_MAX_WEEKS']:
+        abort(404)
+
+    calendar = week_calendar.get_calendar(identity.get_timezone_name(current_user))
+    start_week = calendar.start_week(number_weeks - 1)
+    rollups = rollup.get_weekly_rollups(current_user.get_id(), start_week, calendar.start_week(0))
+    trend = charting.calc_weekly_trend(rollups, start_week, number_weeks, sum_by)
+
+    week_starts = [calendar.start_week(week_offset) for week_offset in reversed(range(number_weeks))]
+    return jsonify({'sum_by': sum_by,
+                    'weeks': [week_start.isoformat() for week_start in week_starts],
+                    'labels': [week_start.strftime("%b %d") for week_start in week_starts],
+                    'datasets': charting.build_chart_dataset(trend)})
@@ -0,0 +1,49 @@
+import hmac
+
+from flask import request, jsonify, current_app, abort
+from sqlalchemy import func
+
+from app import db
+from app.api import bp
+from app.models import StravaUploadJob
+from app.services import strava as ss
+from app.services import strava_rate_limit
+
+
+def is_authorised(my_request):
+    """
+    checks the request carries the metrics token as a bearer token. It isn't accepted as a parameter
+    as urls end up in access logs, and is compared in constant time so it can't be guessed from the timing
+    :param my_request: the request
+    :type my_request: Request
+    :return: True if the token matches METRICS_TOKEN, False otherwise or if no token is configured
+    :rtype: Boolean
+    """
+    metrics_token = current_app.config['METRICS_TOKEN']
+    if not metrics_token:
+        return False
+    auth_header = my_request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(auth_header[len('Bearer '):].encode('utf-8'), metrics_token.encode('utf-8'))
+
+
+@bp.route('/metrics/strava', methods=['GET'])
+def strava_metrics():
+    """
+    reports the app's usage of the Strava API: the rate limit budget, access token reuse
+    and the number of uploads in each state
+    :return: the metrics as json
+    :rtype:
+    """
+    if not is_authorised(request):
+        abort(404)
+
+    upload_counts = dict(db.session.query(StravaUploadJob.status, func.count(StravaUploadJob.id))
+                         .group_by(StravaUploadJob.status).all())
+    defer_until = strava_rate_limit.defer_until()
+
+    return jsonify({'rate_limit': strava_rate_limit.get_budget(),
+                    'uploads_deferred_until': defer_until.isoformat() if defer_until else None,
+                    'access_tokens': ss.get_token_counters(),
+                    'uploads': upload_counts})
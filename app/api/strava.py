@@ -3,7 +3,7 @@ import os
 from flask import request, jsonify, current_app
 
 from app.api import bp
-from app.services import strava as ss
+from app.services import strava_webhooks
 
 
 def is_valid_strava_challenge_params(mode, challenge, token):
@@ -58,12 +58,13 @@ def subscription_validation(my_request):
 def strava_callback():
     """
     callback function used by strava when an athlete deauthorizes the integration
+    or creates, updates or deletes an activity
     needs to be set-up in Strava as a hook
     :return:
     :rtype:
     """
-    # object_type = "athlete"
-    # object_id - the athlete's strava id
+    # object_type = "athlete" or "activity"
+    # object_id - the athlete's or activity's strava id
     # aspect_type - one of "create", "update" or "delete"
     # updates - is a hash -  for app deauthorizations, always an "authorized":"false"
     # owner_id - the athlete's ID
@@ -75,7 +76,7 @@ def strava_callback():
     # If your application needs to do more processing of the received information, it should do so asynchronously.
 
     # read the data from the POST form
-    # call a function to update the athlete
+    # store it for the strava-worker to update the athlete
     # return 200 status
 
     # if this method was called via a GET then Strava is validating the callback address
@@ -85,13 +86,13 @@ def strava_callback():
         status, response = subscription_validation(request)
         return response, status
 
-    # Strava is sending an update about an athlete
-    # We only care about deauthorisation
+    # Strava is sending an event, store it to be processed by the strava-worker
+    # and acknowledge it straight away
     data = request.get_json(force=True)
-    object_type = data['object_type']
-    athlete = int(data['owner_id'])
-    updates = data['updates']
-    subscription_id = data['subscription_id']
+    # Strava sends the subscription id as a number
+    subscription_id = data.get('subscription_id')
+    if subscription_id is not None:
+        subscription_id = str(subscription_id)
 
     current_app.logger.info('Strava callback data {}'.format(data))
 
@@ -100,15 +101,5 @@ def strava_callback():
         current_app.logger.error('Invalid subscription id {}'.format(subscription_id))
         return '', 200
 
-    if object_type and object_type == 'athlete' and updates \
-            and 'authorized' in updates:
-        # athlete has deauthorized the app
-        if updates['authorized'] == 'false':
-            status = ss.deauthorize_athlete(athlete)
-            if not status:
-                current_app.logger.error('Unable to deauthorize athlete')
-            return '', 200
-
-    # return something about badly formed response from Strava
-    current_app.logger.error('Strava error deauthorizing athlete: {}'.format(data))
+    strava_webhooks.receive_event(data)
     return '', 200
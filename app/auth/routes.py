@@ -6,6 +6,7 @@ from app import db, oauth
 from app.auth import bp
 from app.auth.forms import LoginForm
 from app.models import User
+from app.services import identity
 
 INDEX_PAGE = 'main.index'
 
@@ -112,6 +113,7 @@ def oauth_callback():
     if user.username != username or user.email != email or user.picture_url != picture_url:
         current_user.username, current_user.email, current_user.picture_url = username, email, picture_url
         db.session.commit()
+        identity.invalidate_user(user.id)
 
     return redirect(url_for(INDEX_PAGE))
 
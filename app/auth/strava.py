@@ -5,7 +5,9 @@ from flask_login import current_user, login_required
 from app import db, oauth
 from app.auth import bp
 from app.models import StravaAthlete
+from app.services import integration
 from app.services import strava as ss
+from app.services import strava_import
 
 
 @bp.route('/strava_authorize')
@@ -78,8 +80,13 @@ def strava_callback():
         flash('Please ensure you agree to sharing your data with LogMyExercise.')
         return redirect(url_for('main.user'))
 
-    flash('Thank you for granting access to your Strava details.')
+    # bring in the activities already in Strava, in the background as there may be years of them
+    strava_import.queue_import(current_user.get_id())
     ss.log_strava_event(strava_athlete.athlete_id, 'Authorize')
+    db.session.commit()
+    integration.invalidate_strava(current_user.get_id())
+
+    flash('Thank you for granting access to your Strava details.')
     return redirect(url_for('main.user'))
 
 
@@ -0,0 +1,98 @@
+import time
+
+import click
+
+
+def register(app):
+    """
+    Registers the application's command line commands with flask
+    :param app: the Flask app
+    :type app: Flask
+    :return:
+    :rtype:
+    """
+
+    @app.cli.command('backfill-rollups')
+    @click.option('--user-id', type=int, default=None, help='Only rebuild the rollups of this user')
+    def backfill_rollups(user_id):
+        """
+        Rebuilds the daily and weekly activity rollups from the activities table
+        """
+        from app.services import rollup
+        number_rollups = rollup.rebuild_rollups(user_id)
+        click.echo('Wrote {} daily activity rollups'.format(number_rollups))
+
+    @app.cli.command('strava-worker')
+    @click.option('--batch-size', type=int, default=10, help='Most uploads and webhook events to claim at a time')
+    @click.option('--poll-interval', type=float, default=5.0, help='Seconds to wait when the queues are empty')
+    @click.option('--once', is_flag=True, help='Process the due uploads and webhook events then exit')
+    def strava_worker(batch_size, poll_interval, once):
+        """
+        Processes the events Strava has sent to the webhook, uploads the queued activities to Strava,
+        retrying failed uploads with an exponential backoff, and runs the queued imports from Strava
+        """
+        from app import db
+        from app.services import strava, strava_upload, strava_webhooks, strava_import
+        while True:
+            events = processed = imports = 0
+            try:
+                events = strava_webhooks.run_pending(batch_size)
+                if events:
+                    click.echo('Processed {} Strava webhook events'.format(events))
+                processed = strava_upload.run_pending(batch_size)
+                if processed:
+                    click.echo('Processed {} Strava uploads'.format(processed))
+                imports = strava_import.run_pending()
+                if imports:
+                    click.echo('Ran {} Strava imports'.format(imports))
+                # write any events buffered by this process
+                strava.flush_strava_events()
+            except Exception:  # pylint: disable=broad-except
+                # keep working through the queues, anything claimed is picked up again once it goes stale
+                db.session.rollback()
+                app.logger.exception('Error in the strava-worker, carrying on')
+            if once:
+                break
+            if not events and not processed and not imports:
+                time.sleep(poll_interval)
+
+    @app.cli.command('og-worker')
+    @click.option('--batch-size', type=int, default=20, help='Most inspirations to fetch the previews of at a time')
+    @click.option('--poll-interval', type=float, default=30.0, help='Seconds to wait when there is nothing to fetch')
+    @click.option('--once', is_flag=True, help='Fetch the waiting previews then exit')
+    def og_worker(batch_size, poll_interval, once):
+        """
+        Fetches the Open Graph preview image and description of newly added or changed inspirations
+        """
+        from app import db
+        from app.services import open_graph
+        while True:
+            fetched = 0
+            try:
+                fetched = open_graph.run_pending(batch_size)
+                if fetched:
+                    click.echo('Fetched the previews of {} inspirations'.format(fetched))
+            except Exception:  # pylint: disable=broad-except
+                # keep fetching the other previews, the batch is tried again after the poll interval
+                db.session.rollback()
+                app.logger.exception('Error in the og-worker, carrying on')
+            if once:
+                break
+            if not fetched:
+                time.sleep(poll_interval)
+
+    @app.cli.command('strava-import')
+    @click.argument('user_id', type=int)
+    @click.option('--restart', is_flag=True, help='Start again from the oldest activity rather than the checkpoint')
+    def strava_import_command(user_id, restart):
+        """
+        Imports a user's activity history from Strava, carrying on from the last checkpoint
+        """
+        from app.services import strava_import
+        # claimed rather than queued so a strava-worker can't run the same import at the same time
+        finished_import = strava_import.import_activities(user_id, restart)
+        if finished_import is None:
+            click.echo('The Strava import is already running')
+            return
+        click.echo('Strava import {}, {} activities imported'.format(finished_import.status,
+                                                                    finished_import.imported))
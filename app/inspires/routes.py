@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from flask import render_template, flash, redirect, url_for
+from flask import abort, render_template, flash, redirect, url_for, request, session, current_app, make_response
 from flask_login import current_user, login_required
 
 from app import db
@@ -8,6 +8,7 @@ from app.inspires import bp
 from app.inspires.forms import InspiresForm
 from app.main import ICONS_LOOKUP
 from app.models import Inspiration, MyInspirationLikes
+from app.services import inspiration_feed, inspiration_likes, open_graph
 from app.services.charting import ACTIVITY_COLOR_LOOKUP
 from app.main import ACTIVITIES_LOOKUP
 
@@ -16,13 +17,38 @@ from app.main import ACTIVITIES_LOOKUP
 @login_required
 def view_inspirations():
     """
-    Shows the list of inspirations from others
+    Shows a page of the inspirations from others, newest or most liked first.
+    The sort query string parameter sets the order and the cursor parameter where the previous page ended.
+    The page is only rendered again when an inspiration has been added, changed or liked since
+    the browser last fetched it, otherwise 304 Not Modified is returned
     :return:
     :rtype:
     """
-    inspirations = Inspiration.query.all()
-    return render_template('inspires/inspirations.html', title='Inspire others', inspirations=inspirations,
-                           icons=ICONS_LOOKUP, colors=ACTIVITY_COLOR_LOOKUP)
+    sort = request.args.get('sort', inspiration_feed.SORT_NEWEST)
+    if sort not in inspiration_feed.SORT_OPTIONS:
+        sort = inspiration_feed.SORT_NEWEST
+    cursor = request.args.get('cursor')
+
+    version = inspiration_feed.get_feed_version()
+    etag = inspiration_feed.get_feed_etag(current_user.get_id(), sort, cursor, version)
+    # a pending flash message isn't part of the etag, so always render the page to show it
+    if not session.get('_flashes') and etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    inspirations, next_cursor = inspiration_feed.get_feed_page(sort, cursor,
+                                                               current_app.config['INSPIRATION_PAGE_SIZE'])
+    response = make_response(render_template('inspires/inspirations.html', title='Inspire others',
+                                             inspirations=inspirations, sort=sort, next_cursor=next_cursor,
+                                             icons=ICONS_LOOKUP, colors=ACTIVITY_COLOR_LOOKUP))
+    response.set_etag(etag)
+    last_modified = max((moment for moment in version[1:] if moment), default=None)
+    if last_modified:
+        response.last_modified = last_modified
+    # the page is for a logged in user so must not be shared, and is checked with the etag before reuse
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @bp.route('/detail_inspiration/<int:inspiration_id>', methods=['GET'])
@@ -61,6 +87,8 @@ def add_inspiration():
                                   instructor_sex=0,
                                   user_id=current_user.get_id())
         db.session.add(inspiration)
+        # flush to get the inspiration's id, the creator is counted as its first like
+        db.session.flush()
         likes_inspiration = MyInspirationLikes(user_id=current_user.get_id(), inspiration_id=inspiration.id)
         db.session.add(likes_inspiration)
         db.session.commit()
@@ -90,6 +118,9 @@ def edit_inspiration(inspiration_id):
         inspiration.why_loved = form.why_inspires.data
         inspiration.duration = form.duration.data
         inspiration.instructor = form.instructor.data
+        if inspiration.url != form.url.data:
+            # the og-worker fetches the new page's preview
+            open_graph.reset_metadata(inspiration)
         inspiration.url = form.url.data
         inspiration.workout_type = int(form.type.data)
         inspiration.last_updated = datetime.utcnow()
@@ -132,21 +163,13 @@ def delete_inspiration(inspiration_id):
 @login_required
 def like_inspiration(inspiration_id):
     """
-    likes an inspiration. A user cannot like an inspiration they've created
+    likes an inspiration. A user cannot like an inspiration they've created or like one twice
     :param inspiration_id: inspiration to like
     :type inspiration_id:
     :return:
     :rtype:
     """
-    inspiration = Inspiration.query.filter_by(id=inspiration_id).first_or_404()
-
-    # check to see if user has liked this previously
-    has_liked_before = MyInspirationLikes.query.filter_by(id=inspiration_id, user_id=current_user.get_id()).count()
-    if has_liked_before == 0:
-        inspiration.likes += 1
-        inspiration.last_updated = datetime.utcnow()
-        likes_inspiration = MyInspirationLikes(user_id=current_user.get_id(), inspiration_id=inspiration_id)
-        db.session.add(likes_inspiration)
-        db.session.commit()
+    if inspiration_likes.like_inspiration(current_user.get_id(), inspiration_id) is None:
+        abort(404)
 
     return redirect(url_for('inspires.view_inspirations'))
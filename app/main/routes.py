@@ -1,16 +1,16 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from flask import render_template, flash, redirect, url_for, current_app
 from flask import request
 from flask_login import current_user, login_required
-from sqlalchemy import desc
 
 from app import db
 from app.main import ACTIVITIES_LOOKUP, ICONS_LOOKUP
 from app.main import bp
 from app.main.forms import ActivityForm, CompletedActivity
-from app.models import Activity, RegularActivity, User, StravaAthlete, Goal
-from app.services import strava, charting, utils
+from app.models import Activity, RegularActivity, User, Goal
+from app.services import identity, integration, strava, strava_upload, charting, utils, rollup, last_seen, \
+    week_calendar, exercise_log as log_service
 from app.services.charting import ACTIVITY_COLOR_LOOKUP
 
 
@@ -22,8 +22,7 @@ def before_request():
     :rtype:
     """
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        last_seen.record_last_seen(current_user.get_id())
 
 
 @bp.route('/', methods=['GET', 'POST'])
@@ -39,7 +38,7 @@ def welcome():
 
 def save_completed_activity(activity, timestamp=None, tz='UTC'):
     """
-    Saves a completed activity. Will also sync to Strava if the user is set-up for this.
+    Saves a completed activity. Will also queue it to be synced to Strava if the user is set-up for this.
     :param activity: the activity to have taken place
     :type activity: activity
     :param timestamp: datetime the activity takes place
@@ -51,14 +50,20 @@ def save_completed_activity(activity, timestamp=None, tz='UTC'):
     """
     activity.set_local_time(timestamp, tz)
     db.session.add(activity)
-    db.session.commit()
-
+    rollup.add_activity(activity)
+    # the charts work out the user's week in the timezone their browser reports
+    timezone_changed = identity.record_timezone(current_user, tz)
 
     if current_app.config['CALL_STRAVA_API']:
         # first check to see if this user is integrated with strava or not
-        strava_athlete = StravaAthlete.query.filter_by(user_id=current_user.get_id(), is_active=1).first()
-        if strava_athlete:
-            strava.create_activity(activity.id)
+        if integration.is_strava_connected(current_user.get_id()):
+            # uploaded by the strava-worker rather than holding up the response
+            db.session.flush()
+            strava_upload.enqueue_upload(activity)
+
+    db.session.commit()
+    if timezone_changed:
+        identity.invalidate_user(int(current_user.get_id()))
 
 
 @bp.route('/index', methods=['GET', 'POST'])
@@ -103,10 +108,7 @@ def user():
     """
     my_user = User.query.filter_by(id=current_user.get_id()).first_or_404()
 
-    strava_athlete = StravaAthlete.query.filter_by(user_id=current_user.get_id(), is_active=1).first()
-    is_strava = True
-    if not strava_athlete:
-        is_strava = False
+    is_strava = integration.is_strava_connected(current_user.get_id())
 
     return render_template('auth/user.html', user=my_user, is_strava=is_strava)
 
@@ -210,7 +212,7 @@ def log_activity(activity_id):
     """
     regular_activity = RegularActivity.query.filter_by(user_id=current_user.get_id(), id=activity_id).first_or_404()
     activity = regular_activity.create_activity()
-    save_completed_activity(activity, None, request.args.get('tz'))
+    save_completed_activity(activity, None, request.args.get('tz') or identity.get_timezone_name(current_user))
     flash('Well done on completing {} today'.format(activity.title))
     return redirect(url_for('main.index'))
 
@@ -222,43 +224,60 @@ def log_activity(activity_id):
 def exercise_log(offset=0, sum_by='duration'):
     """
     shows the history of all activities performed by the user
-    newest activity is shown first
+    newest activity is shown first, only the first page of activities is shown, the rest
+    are loaded on request via exercise_log_more
     :return:
     :rtype:
     """
-    activities = Activity.query.filter_by(user_id=current_user.get_id()).order_by(desc(Activity.timestamp))
-    # get hold of the activities in the last week so they can be shown on the chart
-    start_week_date_before, start_week_date, end_week_date = charting.get_week_bookends(None, week_offset=offset)
-    # add on 2 days to the end of week as need to take into account activities
-    # on that date
-    activities_this_week = Activity.query.filter(Activity.timestamp >= start_week_date_before,
-                                                 Activity.timestamp <= (end_week_date + timedelta(days=2)),
-                                                 Activity.user_id == current_user.get_id()).all()
-
-
-    # need to consider this as want the actual date for Monday when we are charting it
-    # do need the UTC day before for getting the data to cover cases where the local time is ahead
-    # of UTC
-    chart_data = charting.get_chart_dataset(activities_this_week, start_week_date, sum_by=sum_by)
+    activities_page, next_cursor = log_service.get_activities_page(
+        current_user.get_id(), page_size=current_app.config['ACTIVITY_LOG_PAGE_SIZE'])
+    # the chart is drawn from daily totals of the week rather than the activities themselves
+    # these are already bucketed by the user's local date
+    backend = current_app.config['CHART_AGGREGATION_BACKEND']
+    calendar = week_calendar.get_calendar(identity.get_timezone_name(current_user))
+    _, start_week_date, end_week_date = calendar.bookends(offset)
+    week_rows = rollup.get_daily_rows(current_user.get_id(), start_week_date, end_week_date, backend)
+    chart_data = charting.get_chart_dataset_from_rows(week_rows, start_week_date, end_week_date, sum_by=sum_by)
 
     # look at goals and whether they are met this week
     goals = Goal.query.filter_by(user_id=current_user.get_id())
-    _, current_week_start_date, current_week_end_date = charting.get_week_bookends(None, 0)
-    goals_percentage_met = charting.compare_weekly_totals_to_goals(goals, activities, current_week_start_date,
-                                                                   current_week_end_date)
-
-    return render_template('activity/view_log.html',
-                           user=user, activities=activities,
-                           activities_lookup=ACTIVITIES_LOOKUP,
-                           icons=ICONS_LOOKUP,
-                           chart_data=str(chart_data),
-                           start_week=start_week_date.strftime("%b %d"),
-                           end_week=end_week_date.strftime("%b %d"),
-                           sum_by=sum_by,
-                           offset=offset,
-                           goals=goals,
-                           goals_percentage_met=goals_percentage_met,
-                           title="View Exercise Log")
+    _, current_week_start_date, current_week_end_date = calendar.bookends(0)
+    if offset != 0:
+        week_rows = rollup.get_daily_rows(current_user.get_id(), current_week_start_date, current_week_end_date,
+                                          backend)
+    goals_percentage_met = charting.compare_rows_to_goals(goals, week_rows, current_week_start_date)
+
+    return utils.stream_template('activity/view_log.html',
+                                 user=user, activities=activities_page,
+                                 next_cursor=next_cursor,
+                                 activities_lookup=ACTIVITIES_LOOKUP,
+                                 icons=ICONS_LOOKUP,
+                                 chart_data=chart_data,
+                                 start_week=start_week_date.strftime("%b %d"),
+                                 end_week=end_week_date.strftime("%b %d"),
+                                 sum_by=sum_by,
+                                 offset=offset,
+                                 goals=goals,
+                                 goals_percentage_met=goals_percentage_met,
+                                 title="View Exercise Log")
+
+
+@bp.route('/exercise_log/more', methods=['GET'])
+@login_required
+def exercise_log_more():
+    """
+    returns the next page of the exercise log as table rows to be appended to the log
+    the cursor query string parameter identifies where the previous page ended
+    the cursor for the following page is returned in the X-Next-Cursor header
+    :return:
+    :rtype:
+    """
+    activities_page, next_cursor = log_service.get_activities_page(
+        current_user.get_id(), cursor=request.args.get('cursor'),
+        page_size=current_app.config['ACTIVITY_LOG_PAGE_SIZE'])
+    response = utils.stream_template('activity/activity_rows.html', activities=activities_page, icons=ICONS_LOOKUP)
+    response.headers['X-Next-Cursor'] = next_cursor or ''
+    return response
 
 
 @bp.route('/delete_activity/<int:activity_id>', methods=['GET'])
@@ -272,6 +291,7 @@ def delete_activity(activity_id):
     :rtype:
     """
     activity = Activity.query.filter_by(user_id=current_user.get_id(), id=activity_id).first_or_404()
+    rollup.remove_activity(activity)
     db.session.delete(activity)
     db.session.commit()
     flash('Deleted the activity')
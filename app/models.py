@@ -11,7 +11,9 @@ from app.services import utils
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    # a cached snapshot of the user rather than loading the user on every request
+    from app.services import identity
+    return identity.get_user_snapshot(int(id))
 
 
 class User(UserMixin, db.Model):
@@ -27,6 +29,8 @@ class User(UserMixin, db.Model):
     regular_activities = db.relationship('RegularActivity', backref='regular_athlete', lazy='dynamic')
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
     picture_url = db.Column(db.String(200), nullable=True)
+    # the user's timezone name, e.g. Europe/London, as last reported by their browser
+    timezone = db.Column(db.String(50), nullable=True)
 
     def avatar(self, size):
         if self.picture_url:
@@ -63,10 +67,19 @@ class Activity(db.Model):
     local_timestamp = db.Column(db.DateTime)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     iso_timestamp = db.Column(db.String(50))
+    # the date of the activity in the user's timezone, saves parsing iso_timestamp
+    local_date = db.Column(db.Date)
+    # the activity's id in Strava, if it has been uploaded to or imported from Strava
+    strava_activity_id = db.Column(db.BigInteger, index=True, unique=True, nullable=True)
+
+    # supports the exercise log which pages through a user's activities newest first
+    # and the charts which select a user's activities by local date
+    __table_args__ = (db.Index('ix_activity_user_id_timestamp_id', user_id, timestamp.desc(), id),
+                      db.Index('ix_activity_user_id_local_date', user_id, local_date))
 
     def set_local_time(self, local_time=None, tz='UTC'):
         """
-        sets the local time and the iso timestamp of this activity
+        sets the local time, the iso timestamp and the local date of this activity
         :param local_time: the activity time according to the user's location
         :type local_time: string
         :param tz: the timezone of the user
@@ -78,8 +91,8 @@ class Activity(db.Model):
             self.local_timestamp = utils.localize_local_time(local_time, tz)
         else:
             self.local_timestamp = utils.get_local_time_from_utc(self.timestamp, tz)
-        print("self.local_timestamp", self.local_timestamp)
         self.iso_timestamp = utils.get_iso_from_local_time(self.local_timestamp)
+        self.local_date = self.local_timestamp.date()
 
     def __repr__(self):
         return '<Activity {} {} {} {} {} {} {} {} {}'.format(self.id, self.type, self.title,
@@ -94,6 +107,55 @@ class Activity(db.Model):
                                                                   self.iso_timestamp)
 
 
+class DailyActivityRollup(db.Model):
+    """
+    The totals of the activities of one type a user performed on a day in their local time.
+    Kept up to date as activities are saved and deleted so charts don't need to read every activity
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    local_date = db.Column(db.Date, primary_key=True)
+    type = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, default=0)
+    duration = db.Column(db.Integer, default=0)
+    distance = db.Column(db.Numeric(10, 2), default=0)
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<DailyActivityRollup: {} {} {} {} {} {}'.format(self.user_id, self.local_date, self.type,
+                                                               self.count, self.duration, self.distance)
+
+    def __str__(self):
+        return '<DailyActivityRollup: user={} date={} type={} count={} ' \
+               'duration={} distance={}'.format(self.user_id, self.local_date, self.type,
+                                                self.count, self.duration, self.distance)
+
+
+class WeeklyActivityRollup(db.Model):
+    """
+    The totals of the activities of one type a user performed in a week, Monday to Sunday in their local time.
+    The week is identified by the date of its Monday. Kept up to date along with the daily rollups
+    so a trend over many weeks is a single read of a few rows. changes counts every write to the row,
+    so the week's chart can tell it has changed even within the same second
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    week_start = db.Column(db.Date, primary_key=True)
+    type = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, default=0)
+    duration = db.Column(db.Integer, default=0)
+    distance = db.Column(db.Numeric(10, 2), default=0)
+    changes = db.Column(db.Integer, default=0)
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<WeeklyActivityRollup: {} {} {} {} {} {}'.format(self.user_id, self.week_start, self.type,
+                                                                self.count, self.duration, self.distance)
+
+    def __str__(self):
+        return '<WeeklyActivityRollup: user={} week={} type={} count={} ' \
+               'duration={} distance={}'.format(self.user_id, self.week_start, self.type,
+                                                self.count, self.duration, self.distance)
+
+
 class RegularActivity(db.Model):
     """
     Defines an activity that is performed on a regular basis
@@ -185,6 +247,126 @@ class StravaEvent(db.Model):
         return '<StravaEvent: {} {} {}'.format(self.athlete_id, self.action, self.timestamp)
 
 
+class StravaRateLimit(db.Model):
+    """
+        The app's usage of its Strava rate limits, from the headers of the latest response from Strava.
+        A single row shared by every process calling Strava
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    short_limit = db.Column(db.Integer)
+    short_usage = db.Column(db.Integer)
+    long_limit = db.Column(db.Integer)
+    long_usage = db.Column(db.Integer)
+    window_start = db.Column(db.DateTime)
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<StravaRateLimit: {}/{} {}/{} {}'.format(self.short_usage, self.short_limit, self.long_usage,
+                                                         self.long_limit, self.last_updated)
+
+    def __str__(self):
+        return '<StravaRateLimit: {}/{} {}/{} {}'.format(self.short_usage, self.short_limit, self.long_usage,
+                                                         self.long_limit, self.last_updated)
+
+
+class StravaUploadJob(db.Model):
+    """
+        An activity waiting to be uploaded to Strava. Saved in the same transaction as the activity
+        and worked through by the strava-worker command
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    activity_id = db.Column(db.Integer, db.ForeignKey('activity.id', ondelete='CASCADE'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    status = db.Column(db.String(10), default=PENDING)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(200), nullable=True)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_strava_upload_job_status_next_attempt_at', status, next_attempt_at),)
+
+    def __repr__(self):
+        return '<StravaUploadJob: {} {} {} {}'.format(self.activity_id, self.status, self.attempts,
+                                                      self.next_attempt_at)
+
+    def __str__(self):
+        return '<StravaUploadJob: {} {} {} {}'.format(self.activity_id, self.status, self.attempts,
+                                                      self.next_attempt_at)
+
+
+class StravaImport(db.Model):
+    """
+        The import of a user's activity history from Strava. The checkpoint is the start time of the
+        newest activity imported so far, so an interrupted import carries on from where it stopped
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    status = db.Column(db.String(10), default=PENDING)
+    # epoch seconds, activities starting after this are still to be imported
+    after = db.Column(db.Integer, default=0)
+    imported = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(200), nullable=True)
+    started = db.Column(db.DateTime, default=datetime.utcnow)
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<StravaImport: {} {} {} {}'.format(self.user_id, self.status, self.after, self.imported)
+
+    def __str__(self):
+        return '<StravaImport: {} {} {} {}'.format(self.user_id, self.status, self.after, self.imported)
+
+
+class StravaWebhookEvent(db.Model):
+    """
+        An event pushed by Strava to the webhook. Stored as it arrives so Strava gets its acknowledgement
+        straight away, then processed by the strava-worker
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.String(20))
+    object_type = db.Column(db.String(20))
+    object_id = db.Column(db.BigInteger)
+    aspect_type = db.Column(db.String(10))
+    owner_id = db.Column(db.Integer)
+    event_time = db.Column(db.Integer)
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(10), default=PENDING, index=True)
+    received = db.Column(db.DateTime, default=datetime.utcnow)
+    processed = db.Column(db.DateTime, nullable=True)
+    # an event that fails because Strava or the database is having problems is tried again later
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(200), nullable=True)
+
+    # Strava retries an event that isn't acknowledged in time, the retry has the same identity
+    __table_args__ = (db.UniqueConstraint('subscription_id', 'object_id', 'event_time',
+                                          name='uq_strava_webhook_event'),
+                      db.Index('ix_strava_webhook_event_status_next_attempt_at', status, next_attempt_at))
+
+    def __repr__(self):
+        return '<StravaWebhookEvent: {} {} {} {} {}'.format(self.object_type, self.object_id, self.aspect_type,
+                                                            self.event_time, self.status)
+
+    def __str__(self):
+        return '<StravaWebhookEvent: {} {} {} {} {}'.format(self.object_type, self.object_id, self.aspect_type,
+                                                            self.event_time, self.status)
+
+
 class Inspiration(db.Model):
     """
     Defines a workout that inspires
@@ -198,7 +380,7 @@ class Inspiration(db.Model):
     description = db.Column(db.String(200))
     duration = db.Column(db.Integer)
     why_loved = db.Column(db.String(200))
-    likes = db.Column(db.Integer)
+    likes = db.Column(db.Integer, default=0)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -206,6 +388,12 @@ class Inspiration(db.Model):
     meta_og_height = db.Column(db.Integer)
     meta_og_width = db.Column(db.Integer)
     meta_og_description = db.Column(db.String(200))
+    # when the og-worker fetched the meta_og details from the url, None until then
+    meta_og_fetched = db.Column(db.DateTime, nullable=True, index=True)
+
+    # supports the inspiration feed which pages through the newest or the most liked first
+    __table_args__ = (db.Index('ix_inspiration_likes_last_updated_id', likes.desc(), last_updated.desc(), id),
+                      db.Index('ix_inspiration_last_updated_id', last_updated.desc(), id))
 
     def __repr__(self):
         return '<Inspiration: {} {} {} {} {} {} {} {} {} {}'.format(self.title, self.workout_type, self.url,
@@ -230,6 +418,10 @@ class MyInspirationLikes(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     inspiration_id = db.Column(db.Integer, db.ForeignKey('inspiration.id'))
 
+    # a user can only like an inspiration once
+    __table_args__ = (db.Index('ix_my_inspiration_likes_user_id_inspiration_id', user_id, inspiration_id,
+                               unique=True),)
+
     def __repr__(self):
         return '<MyInspirationLikes: {} {} {}'.format(self.id, self.user_id, self.inspiration_id)
 
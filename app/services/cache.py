@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A thread safe least recently used cache whose entries expire ttl seconds after they are set
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300, timer=time.monotonic):
+        """
+        :param maxsize: the most entries kept, the least recently used is dropped to make room
+        :type maxsize: int
+        :param ttl: seconds an entry is kept for
+        :type ttl: float
+        :param timer: returns the current time in seconds, replaced in tests
+        :type timer: function
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        returns the value cached for the key
+        :param key: the key
+        :type key: hashable
+        :param default: returned if the key isn't cached or has expired
+        :type default:
+        :return: the cached value or the default
+        :rtype:
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self.timer():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """
+        caches the value for the key
+        :param key: the key
+        :type key: hashable
+        :param value: the value
+        :type value:
+        :return:
+        :rtype:
+        """
+        with self._lock:
+            self._entries[key] = (value, self.timer() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        removes the key from the cache, if it's there
+        :param key: the key
+        :type key: hashable
+        :return:
+        :rtype:
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
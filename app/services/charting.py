@@ -1,10 +1,14 @@
+from collections import namedtuple
 from datetime import datetime, timedelta, date
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Tuple
 
 from pytz import timezone
+from sqlalchemy import func
 
-from app.models import Activity, Goal
+from app import db
+from app.models import Activity, Goal, DailyActivityRollup, WeeklyActivityRollup
 from app.main import ACTIVITIES_LOOKUP
+from app.services import week_calendar
 
 # use this  color map to display the different types of activities
 # be consistent and use for charts and for regular activities
@@ -12,73 +16,97 @@ from app.main import ACTIVITIES_LOOKUP
 # key corresponds to activity_type and value is the color hex code
 ACTIVITY_COLOR_LOOKUP = {1: '#7fc97f', 2: '#beaed4', 3: '#fdc086', 4: '#ffff99', 5: '#386cb0', 6: '#f0027f'}
 
+# the daily count, duration and distance of each activity type over a week
+# each is a dictionary keyed by activity type with a list of 7 daily values starting on Monday
+WeekMatrices = namedtuple('WeekMatrices', ['count', 'duration', 'distance'])
 
-def get_start_week_date(input_date: date, week_offset: int = 0) -> date:
+
+def get_local_today(user_tz: str = 'UTC') -> date:
+    """
+    returns today's date in the user's timezone
+    :param user_tz: name of the user's timezone
+    :type user_tz: str
+    :return: the user's date today
+    :rtype: date
+    """
+    return week_calendar.get_calendar(user_tz).today
+
+
+def get_start_week_date(input_date: date, week_offset: int = 0, user_tz: str = 'UTC') -> date:
     """
     calculates the date at the start of the week based on the provided date
     :param input_date: date to base the start of week on, defaults to current date if None
     :type input_date: datetime
     :param week_offset: number of weeks prior to the input_date to offset the start of week by
     :type week_offset: int
+    :param user_tz: timezone the current date is taken in when no input_date is provided
+    :type user_tz: str
     :return: midnight at the date at the start of the week
     :rtype:
     """
-    calc_date = input_date
     if not input_date:
-        calc_date = datetime.now(timezone('UTC')).date()
-    date_start_week = calc_date - timedelta(days=calc_date.weekday() + (7 * week_offset))
+        return week_calendar.get_calendar(user_tz).start_week(week_offset)
+    date_start_week = input_date - timedelta(days=input_date.weekday() + (7 * week_offset))
 
     return date_start_week
 
 
-def get_start_week_date_before(input_date: date, week_offset: int = 0) -> date:
+def get_start_week_date_before(input_date: date, week_offset: int = 0, user_tz: str = 'UTC') -> date:
     """
     calculates the date at the day before the start of the week based on the provided date
     :param input_date: date to base the start of week on, defaults to current date if None
     :type input_date: datetime
     :param week_offset: number of weeks prior to the input_date to offset the start of week by
     :type week_offset: int
+    :param user_tz: timezone the current date is taken in when no input_date is provided
+    :type user_tz: str
     :return: midnight at the date at the day before the start of the week
     :rtype:
     """
 
-    date_start_week = get_start_week_date(input_date, week_offset) - timedelta(days=1)
+    date_start_week = get_start_week_date(input_date, week_offset, user_tz) - timedelta(days=1)
 
     return date_start_week
 
 
-def get_week_bookends(input_date: date, week_offset: int = 0) -> (date, date, date):
+def get_week_bookends(input_date: date, week_offset: int = 0, user_tz: str = 'UTC') -> (date, date, date):
     """
     returns a tuple representing the start of the week -1, start of week and end of week
     :param input_date: the date used to determine the start and end of the week
     :type input_date:
     :param week_offset: number of weeks prior to the input_date to offset the start of week by
     :type week_offset: int
+    :param user_tz: timezone the current date is taken in when no input_date is provided
+    :type user_tz: str
     :return: (start_date-1, start_date, end date) all in UTC timezone with hour, minutes
     seconds, microseconds set to midnight (start of week dates) or just before midnight (end date)
     :rtype: a tuple of dates (start_date-1, start_date, end date)
     """
 
-    date_start_week = get_start_week_date(input_date, week_offset)
-    date_start_week_day_before = get_start_week_date_before(input_date, week_offset)
+    date_start_week = get_start_week_date(input_date, week_offset, user_tz)
+    date_start_week_day_before = date_start_week - timedelta(days=1)
     date_end_week = date_start_week + timedelta(days=6)
     return (date_start_week_day_before,
             date_start_week,
             date_end_week)
 
 
-def get_12_week_bookends(input_date: date) -> (date, date, date):
+def get_12_week_bookends(input_date: date, user_tz: str = 'UTC') -> (date, date, date):
     """
     Calculates a 12 week window using the input_date as a start point.
     Calculates the date for the Monday of the current week,
     the Monday of the week 12 weeks prior
     the Sunday of the week 12 weeks prior
 
-    :param input_date: current date to base calculations off
+    :param input_date: current date to base calculations off, defaults to the current date if None
     :type input_date: date
+    :param user_tz: timezone the current date is taken in when no input_date is provided
+    :type user_tz: str
     :return: (start_historic_week_date_day_before, start_historic_week_date, start_current_week_date)
     :rtype: a tuple of dates
     """
+    if not input_date:
+        return week_calendar.get_calendar(user_tz).weeks_bookends(12)
     start_current_week_date = get_start_week_date(input_date, 0)
     start_historic_week_date = get_start_week_date(input_date, 12)
     start_historic_week_date_day_before = start_historic_week_date + timedelta(days=-1)
@@ -96,7 +124,8 @@ def get_date_from_isotimestamp(iso_timestamp: str, timestamp: timezone) -> date:
     :rtype: date
     """
     if iso_timestamp:
-        local_date = datetime.strptime(iso_timestamp, '%Y-%m-%dT%H:%M:%S.%f%z').date()
+        # fromisoformat copes with timestamps that have no microseconds, isoformat() leaves them out when zero
+        local_date = datetime.fromisoformat(iso_timestamp).date()
     else:
         # if the local time as a iso string isn't available use the timestamp and assume UTC
         my_utc = timezone('UTC')
@@ -105,39 +134,147 @@ def get_date_from_isotimestamp(iso_timestamp: str, timestamp: timezone) -> date:
     return local_date
 
 
-def determine_value_to_add(activity: Activity, local_date: date, start_date: date, end_date: date = None,
-                           sum_by: str = 'duration') -> (bool, int):
+def new_week_matrix() -> Dict[int, List]:
+    """
+    returns an empty week of daily totals for each activity type
+    :return: a dictionary with the key representing the activity type and an array of 7 zeros, one per day
+    :rtype: Dictionary
+    """
+    return {1: [0, 0, 0, 0, 0, 0, 0], 2: [0, 0, 0, 0, 0, 0, 0], 3: [0, 0, 0, 0, 0, 0, 0],
+            4: [0, 0, 0, 0, 0, 0, 0], 5: [0, 0, 0, 0, 0, 0, 0], 6: [0, 0, 0, 0, 0, 0, 0]}
+
+
+def activity_rows(activities: Iterable[Activity]) -> Iterator[Tuple]:
+    """
+    turns activities into the daily rows understood by aggregate_daily_rows
+    :param activities: activities to aggregate
+    :type activities: a list of Activity objects
+    :return: a tuple of (activity type, local date, count, duration, distance) for each activity
+    :rtype: iterator
+    """
+    for activity in activities:
+        yield activity.type, get_activity_local_date(activity), 1, activity.duration, activity.distance
+
+
+def get_activity_local_date(activity: Activity) -> date:
+    """
+    returns the date the activity took place in the user's local time, using the stored local date
+    and only falling back to parsing the iso timestamp if it hasn't been set
+    :param activity: the activity
+    :type activity: Activity
+    :return: the local date of the activity
+    :rtype: date
+    """
+    if activity.local_date:
+        return activity.local_date
+    return get_date_from_isotimestamp(activity.iso_timestamp, activity.timestamp)
+
+
+def rollup_rows(rollups: Iterable[DailyActivityRollup]) -> Iterator[Tuple]:
+    """
+    turns daily rollups into the daily rows understood by aggregate_daily_rows
+    :param rollups: daily rollups to aggregate
+    :type rollups: a list of DailyActivityRollup objects
+    :return: a tuple of (activity type, local date, count, duration, distance) for each rollup
+    :rtype: iterator
     """
-    Determines whether the activity falls in the date range indicated by [start_date, end_date].
-    If it does, then determines how much activity to count and whether it is duration or distance being measured.
+    for rollup in rollups:
+        yield rollup.type, rollup.local_date, rollup.count, rollup.duration, rollup.distance
 
-    :param activity: activity taken place
-    :type activity: activity
-    :param local_date: the date the activity took place in local time, could be different to the UTC date
-    :type local_date: date
-    :param start_date: the start of the time period in consideration
+
+def query_activities(user_id: int, start_date: date, end_date: date) -> List[Activity]:
+    """
+    returns the user's activities with a local date in [start_date, end_date]
+    :param user_id: the user
+    :type user_id: int
+    :param start_date: first local date to include
     :type start_date: date
-    :param end_date: the end of the time period in consideration
+    :param end_date: last local date to include
     :type end_date: date
-    :param sum_by: whether to sum by distance or duration
-    :type sum_by: string
-    :return: a tuple where first value is whether activity should be added, second is the value to be added
-    :rtype: a tuple (boolean, int)
+    :return: the activities
+    :rtype: a list of Activity objects
     """
-    to_add = 0
-    if sum_by == 'duration':
-        to_add = activity.duration if activity.duration else 0
-    elif activity.distance:
-        to_add = round(float(activity.distance), 2)
+    return Activity.query.filter(Activity.user_id == user_id,
+                                 Activity.local_date >= start_date,
+                                 Activity.local_date <= end_date).all()
+
+
+def query_daily_rows(user_id: int, start_date: date, end_date: date) -> List[Tuple]:
+    """
+    Sums the user's activities with a local date in [start_date, end_date] inside the database,
+    grouped by activity type and local date.
+    SUM returns a decimal on MySQL so the durations are turned back into integers
+    :param user_id: the user
+    :type user_id: int
+    :param start_date: first local date to include
+    :type start_date: date
+    :param end_date: last local date to include
+    :type end_date: date
+    :return: tuples of (activity type, local date, count, duration, distance)
+    :rtype: a list of tuples
+    """
+    rows = db.session.query(Activity.type, Activity.local_date, func.count(Activity.id),
+                            func.sum(Activity.duration), func.sum(Activity.distance)) \
+        .filter(Activity.user_id == user_id,
+                Activity.local_date >= start_date,
+                Activity.local_date <= end_date) \
+        .group_by(Activity.type, Activity.local_date).all()
+
+    return [(activity_type, local_date, int(count), int(duration or 0), distance)
+            for activity_type, local_date, count, duration, distance in rows]
+
+
+def aggregate_daily_rows(rows: Iterable[Tuple], start_date: date, end_date: date = None) -> WeekMatrices:
+    """
+    Buckets daily rows into the count, duration and distance for each activity type on each day of the week,
+    in a single pass over the rows.
+    The first item of each array represents the start date (Monday), the second is Tuesday and so on.
+    Rows outside of [start_date, end_date] are ignored
+
+    :param rows: tuples of (activity type, local date, count, duration, distance)
+    :type rows: iterable of tuples
+    :param start_date: Monday's date
+    :type start_date: date
+    :param end_date: Sunday's date, defaults to 6 days after start_date if None
+    :type end_date: date
+    :return: the count, duration and distance matrices for the week
+    :rtype: WeekMatrices
+    """
+    counts, durations, distances = new_week_matrix(), new_week_matrix(), new_week_matrix()
+    last_day = (end_date - start_date).days if end_date else 6
+
+    for activity_type, local_date, count, duration, distance in rows:
+        day = (local_date - start_date).days
+        if count and 0 <= day <= last_day:
+            counts[activity_type][day] += count
+            if duration:
+                durations[activity_type][day] += duration
+            if distance:
+                distances[activity_type][day] += round(float(distance), 2)
 
-    add_it = False
-    if not end_date:
-        if local_date >= start_date:
-            add_it = True
-    elif start_date <= local_date <= end_date:
-        add_it = True
+    # round away any floating point error from the additions so each source of rows gives the same totals
+    for activity_type, days in distances.items():
+        distances[activity_type] = [round(distance, 2) for distance in days]
 
-    return add_it, to_add
+    return WeekMatrices(counts, durations, distances)
+
+
+def calc_daily_matrices(activities: Iterable[Activity], start_date: date, end_date: date = None) -> WeekMatrices:
+    """
+    Calculates the count, duration and distance of each activity type on each day of the week in one pass
+    over the activities. Each activity's local date is worked out once.
+    The activities should already be limited to the week being calculated.
+
+    :param activities: a list of Activity
+    :type activities: a list of Activity objects
+    :param start_date: Monday's date
+    :type start_date: date
+    :param end_date: Sunday's date, defaults to 6 days after start_date if None
+    :type end_date: date
+    :return: the count, duration and distance matrices for the week
+    :rtype: WeekMatrices
+    """
+    return aggregate_daily_rows(activity_rows(activities), start_date, end_date)
 
 
 def calc_daily_duration_per_exercise_type(activities: List[Activity], start_date: date, end_date: date = None,
@@ -161,20 +298,8 @@ def calc_daily_duration_per_exercise_type(activities: List[Activity], start_date
     performed each day of the week (7 entries)
     :rtype: Dictionary
     """
-    exercise_dict = {1: [0, 0, 0, 0, 0, 0, 0], 2: [0, 0, 0, 0, 0, 0, 0], 3: [0, 0, 0, 0, 0, 0, 0],
-                     4: [0, 0, 0, 0, 0, 0, 0], 5: [0, 0, 0, 0, 0, 0, 0], 6: [0, 0, 0, 0, 0, 0, 0]}
-
-    # need to consider this in local time to the user, not UTC time
-    for activity in activities:
-        local_date = get_date_from_isotimestamp(activity.iso_timestamp, activity.timestamp)
-
-        # add up the data, determine what to add by and whether the localised date is in the date range
-        add_it, to_add = determine_value_to_add(activity, local_date, start_date, end_date, sum_by)
-
-        if add_it:
-            exercise_dict[activity.type][local_date.weekday()] += to_add
-
-    return exercise_dict
+    matrices = calc_daily_matrices(activities, start_date, end_date)
+    return matrices.duration if sum_by == 'duration' else matrices.distance
 
 
 def get_chart_dataset(activities: List[Activity], start_date: date, end_date: date = None, sum_by: str = 'duration'):
@@ -194,6 +319,70 @@ def get_chart_dataset(activities: List[Activity], start_date: date, end_date: da
     :rtype: a list
     """
     exercise_dict = calc_daily_duration_per_exercise_type(activities, start_date, end_date, sum_by)
+    return build_chart_dataset(exercise_dict)
+
+
+def calc_daily_totals_from_rollups(rollups: List[DailyActivityRollup], start_date: date, sum_by: str = 'duration'):
+    """
+    Puts a week of daily rollups into the same dictionary of arrays as calc_daily_duration_per_exercise_type,
+    the key represents the activity type, the array represents the minutes/kms for each day of the week
+    :param rollups: the daily rollups for the week starting at start_date
+    :type rollups: a list of DailyActivityRollup objects
+    :param start_date: Monday's date
+    :type start_date: date
+    :param sum_by: whether to sum by duration or distance, defaults to duration
+    :type sum_by: a String either 'duration' or 'distance'
+    :return: a dictionary with the key representing the activity type and an array representing minutes/kms
+    of that activity performed each day of the week (7 entries)
+    :rtype: Dictionary
+    """
+    matrices = aggregate_daily_rows(rollup_rows(rollups), start_date)
+    return matrices.duration if sum_by == 'duration' else matrices.distance
+
+
+def get_chart_dataset_from_rollups(rollups: List[DailyActivityRollup], start_date: date, sum_by: str = 'duration'):
+    """
+    returns the chart.js data sets for a week of daily rollups, see get_chart_dataset
+    :param rollups: the daily rollups for the week starting at start_date
+    :type rollups: a list of DailyActivityRollup objects
+    :param start_date: Monday's date
+    :type start_date: date
+    :param sum_by: whether to sum by distance or duration
+    :type sum_by: string
+    :return: a list of dicts where the keys are label, backgroundColor, data
+    :rtype: a list
+    """
+    return get_chart_dataset_from_rows(rollup_rows(rollups), start_date, sum_by=sum_by)
+
+
+def get_chart_dataset_from_rows(rows: Iterable[Tuple], start_date: date, end_date: date = None,
+                                sum_by: str = 'duration'):
+    """
+    returns the chart.js data sets for a week of daily rows, see get_chart_dataset
+    :param rows: tuples of (activity type, local date, count, duration, distance)
+    :type rows: iterable of tuples
+    :param start_date: Monday's date
+    :type start_date: date
+    :param end_date: Sunday's date, defaults to 6 days after start_date if None
+    :type end_date: date
+    :param sum_by: whether to sum by distance or duration
+    :type sum_by: string
+    :return: a list of dicts where the keys are label, backgroundColor, data
+    :rtype: a list
+    """
+    matrices = aggregate_daily_rows(rows, start_date, end_date)
+    return build_chart_dataset(matrices.duration if sum_by == 'duration' else matrices.distance)
+
+
+def build_chart_dataset(exercise_dict: Dict[int, List[int]]):
+    """
+    turns a dictionary of daily totals by exercise type into chart.js data sets,
+    exercise types with nothing to show are left out
+    :param exercise_dict: a dictionary where key is exercise_type and value is a list of daily totals
+    :type exercise_dict: Dictionary
+    :return: a list of dicts where the keys are label, backgroundColor, data
+    :rtype: a list
+    """
     display_data = []
     for key in sorted(exercise_dict):
         if sum(exercise_dict[key]) > 0:
@@ -205,6 +394,34 @@ def get_chart_dataset(activities: List[Activity], start_date: date, end_date: da
     return display_data
 
 
+def calc_weekly_trend(rollups: Iterable[WeeklyActivityRollup], start_week: date, number_weeks: int = 12,
+                      sum_by: str = 'duration') -> Dict[int, List]:
+    """
+    buckets weekly rollups into the total of each activity type for each of number_weeks weeks,
+    the first item of each list being the week starting on start_week. Rollups outside of the weeks are ignored
+    :param rollups: weekly rollups
+    :type rollups: iterable of WeeklyActivityRollup
+    :param start_week: Monday of the first week
+    :type start_week: date
+    :param number_weeks: number of weeks in the trend
+    :type number_weeks: int
+    :param sum_by: whether to sum by duration or distance
+    :type sum_by: string
+    :return: a dictionary where key is exercise_type and value is a list of weekly totals
+    :rtype: Dictionary
+    """
+    trend = {activity_type: [0] * number_weeks for activity_type in ACTIVITY_COLOR_LOOKUP}
+    for rollup in rollups:
+        week = (rollup.week_start - start_week).days // 7
+        if rollup.count and 0 <= week < number_weeks:
+            if sum_by == 'duration':
+                trend[rollup.type][week] += rollup.duration or 0
+            else:
+                trend[rollup.type][week] = round(trend[rollup.type][week] + float(rollup.distance or 0), 2)
+
+    return trend
+
+
 def calc_week_totals_by_exercise_type(exercise_dict: Dict[int, List[int]]):
     """
     calculates the total number of exercises performed irrespective of exercise_type in a week,
@@ -247,13 +464,25 @@ def calc_weekly_totals(activities: List[Activity], start_date: date, end_date: d
     weekly total of exercise distance, weekly total of exercise distance by exercise_type,
     :rtype: a tuple with 6 elements
     """
-    dict_by_duration = calc_daily_duration_per_exercise_type(activities, start_date, end_date, 'duration')
-    dict_by_distance = calc_daily_duration_per_exercise_type(activities, start_date, end_date, 'distance')
+    return calc_weekly_totals_from_matrices(calc_daily_matrices(activities, start_date, end_date))
 
-    total_count_all_activities, total_count_by_exercise_type, total_duration_all_activities, \
-        total_duration_by_exercise_type = calc_week_totals_by_exercise_type(dict_by_duration)
+
+def calc_weekly_totals_from_matrices(matrices: WeekMatrices):
+    """
+    Calculates the weekly grand totals for duration and distance and number of exercises performed
+    from the daily matrices of a week.
+    The number of exercises of a type counts the days on which that exercise was performed
+    :param matrices: the count, duration and distance matrices for the week
+    :type matrices: WeekMatrices
+    :return: the same 6 totals as calc_weekly_totals
+    :rtype: a tuple with 6 elements
+    """
+    total_count_all_activities, total_count_by_exercise_type, _, _ = calc_week_totals_by_exercise_type(
+        matrices.count)
+    _, _, total_duration_all_activities, total_duration_by_exercise_type = calc_week_totals_by_exercise_type(
+        matrices.duration)
     _, _, total_distance_all_activities, total_distance_by_exercise_type = calc_week_totals_by_exercise_type(
-        dict_by_distance)
+        matrices.distance)
 
     return total_count_all_activities, total_count_by_exercise_type, total_duration_all_activities, \
         total_duration_by_exercise_type, total_distance_all_activities, total_distance_by_exercise_type
@@ -280,10 +509,123 @@ def compare_weekly_totals_to_goals(goals: List[Goal], activities: List[Activity]
     %age met of total duration goal, %age met of total distance goal)
     :rtype: tuple
     """
+    return compare_totals_to_goals(goals, calc_weekly_totals(activities, start_date, end_date))
+
+
+def get_chart_dataset_sql(user_id: int, start_date: date, end_date: date = None, sum_by: str = 'duration'):
+    """
+    returns the same chart.js data sets as get_chart_dataset with the activities summed by the database
+    rather than loaded and summed in Python
+    :param user_id: the user whose activities to chart
+    :type user_id: int
+    :param start_date: the start of the week date from which the activities should be bucketed
+    :type start_date: date
+    :param end_date: the end of the week date, defaults to 6 days after start_date if None
+    :type end_date: date
+    :param sum_by: whether to sum by distance or duration
+    :type sum_by: string
+    :return: a list of dicts where the keys are label, backgroundColor, data
+    :rtype: a list
+    """
+    end_date = end_date or start_date + timedelta(days=6)
+    return get_chart_dataset_from_rows(query_daily_rows(user_id, start_date, end_date), start_date, end_date, sum_by)
+
+
+def calc_weekly_totals_sql(user_id: int, start_date: date, end_date: date = None):
+    """
+    returns the same weekly totals as calc_weekly_totals with the activities summed by the database
+    rather than loaded and summed in Python
+    :param user_id: the user whose activities to total
+    :type user_id: int
+    :param start_date: the start date of the week
+    :type start_date: Date
+    :param end_date: the end date of the week, defaults to 6 days after start_date if None
+    :type end_date: Date
+    :return: the same 6 totals as calc_weekly_totals
+    :rtype: a tuple with 6 elements
+    """
+    end_date = end_date or start_date + timedelta(days=6)
+    return calc_weekly_totals_from_rows(query_daily_rows(user_id, start_date, end_date), start_date, end_date)
+
+
+def calc_weekly_totals_from_rollups(rollups: List[DailyActivityRollup], start_date: date):
+    """
+    Calculates the weekly grand totals for duration and distance and number of exercises performed
+    from a week of daily rollups, see calc_weekly_totals
+    :param rollups: the daily rollups for the week starting at start_date
+    :type rollups: a list of DailyActivityRollup objects
+    :param start_date: the start date of the week
+    :type start_date: Date
+    :return: the same 6 totals as calc_weekly_totals
+    :rtype: a tuple with 6 elements
+    """
+    return calc_weekly_totals_from_rows(rollup_rows(rollups), start_date)
+
+
+def calc_weekly_totals_from_rows(rows: Iterable[Tuple], start_date: date, end_date: date = None):
+    """
+    Calculates the weekly grand totals for duration and distance and number of exercises performed
+    from a week of daily rows, see calc_weekly_totals
+    :param rows: tuples of (activity type, local date, count, duration, distance)
+    :type rows: iterable of tuples
+    :param start_date: the start date of the week
+    :type start_date: Date
+    :param end_date: the end date of the week
+    :type end_date: Date
+    :return: the same 6 totals as calc_weekly_totals
+    :rtype: a tuple with 6 elements
+    """
+    return calc_weekly_totals_from_matrices(aggregate_daily_rows(rows, start_date, end_date))
+
+
+def compare_rollups_to_goals(goals: List[Goal], rollups: List[DailyActivityRollup], start_date: date):
+    """
+    Compares a week of daily rollups against goals in order to calculate %age of the goal,
+    see compare_weekly_totals_to_goals
+    :param goals: a list of user Goal
+    :type goals: List
+    :param rollups: the daily rollups for the week starting at start_date
+    :type rollups: a list of DailyActivityRollup objects
+    :param start_date: the start date of the week
+    :type start_date: Date
+    :return: A list of tuples where each tuple contains (%age met of total activities goal,
+    %age met of total duration goal, %age met of total distance goal)
+    :rtype: list
+    """
+    return compare_rows_to_goals(goals, rollup_rows(rollups), start_date)
+
+
+def compare_rows_to_goals(goals: List[Goal], rows: Iterable[Tuple], start_date: date):
+    """
+    Compares a week of daily rows against goals in order to calculate %age of the goal,
+    see compare_weekly_totals_to_goals
+    :param goals: a list of user Goal
+    :type goals: List
+    :param rows: tuples of (activity type, local date, count, duration, distance)
+    :type rows: iterable of tuples
+    :param start_date: the start date of the week
+    :type start_date: Date
+    :return: A list of tuples where each tuple contains (%age met of total activities goal,
+    %age met of total duration goal, %age met of total distance goal)
+    :rtype: list
+    """
+    return compare_totals_to_goals(goals, calc_weekly_totals_from_rows(rows, start_date))
+
+
+def compare_totals_to_goals(goals: List[Goal], weekly_totals: tuple):
+    """
+    Compares the weekly frequency, duration, distance totals against goals in order to calculate %age of the goal
+    :param goals: a list of user Goal
+    :type goals: List
+    :param weekly_totals: the 6 weekly totals as returned by calc_weekly_totals
+    :type weekly_totals: tuple
+    :return: A list of tuples where each tuple contains (%age met of total activities goal,
+    %age met of total duration goal, %age met of total distance goal)
+    :rtype: list
+    """
     total_count_all_activities, total_count_by_exercise_type, \
         total_duration_all_activities, total_duration_by_exercise_type, \
-        total_distance_all_activities, total_distance_by_exercise_type = \
-        calc_weekly_totals(activities, start_date, end_date)
+        total_distance_all_activities, total_distance_by_exercise_type = weekly_totals
 
     percentages = []
     for goal in goals:
@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+from app.models import Activity
+
+# format of the timestamp part of a page cursor
+CURSOR_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+CURSOR_SEPARATOR = '_'
+
+
+def encode_cursor(activity: Activity) -> str:
+    """
+    creates the cursor pointing just past the provided activity
+    :param activity: the last activity shown on a page of the exercise log
+    :type activity: Activity
+    :return: a cursor combining the activity's timestamp and id
+    :rtype: string
+    """
+    return '{}{}{}'.format(activity.timestamp.strftime(CURSOR_TIMESTAMP_FORMAT), CURSOR_SEPARATOR, activity.id)
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """
+    splits a cursor back into the timestamp and id of the activity it points past
+    :param cursor: cursor created by encode_cursor
+    :type cursor: string
+    :return: a tuple of (timestamp, activity id) or None if the cursor is missing or badly formed
+    :rtype: tuple
+    """
+    if not cursor:
+        return None
+    try:
+        timestamp, activity_id = cursor.rsplit(CURSOR_SEPARATOR, 1)
+        return datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT), int(activity_id)
+    except ValueError:
+        return None
+
+
+def get_activities_page(user_id: int, cursor: str = None, page_size: int = 25) -> Tuple[List[Activity], str]:
+    """
+    returns a page of the user's activities, newest first, using keyset pagination on (timestamp, id)
+    so the cost of a page is the same no matter how far into the history it is
+    :param user_id: the user whose activities to return
+    :type user_id: int
+    :param cursor: cursor returned with the previous page, None for the first page
+    :type cursor: string
+    :param page_size: maximum number of activities to return
+    :type page_size: int
+    :return: a tuple of the activities on this page and the cursor for the next page, the cursor
+    is None when there are no more activities
+    :rtype: tuple
+    """
+    query = Activity.query.filter(Activity.user_id == user_id)
+
+    position = decode_cursor(cursor)
+    if position:
+        timestamp, activity_id = position
+        query = query.filter(or_(Activity.timestamp < timestamp,
+                                 and_(Activity.timestamp == timestamp, Activity.id > activity_id)))
+
+    # fetch one extra row to find out if there is another page without a count query
+    activities = query.order_by(Activity.timestamp.desc(), Activity.id).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(activities) > page_size:
+        activities = activities[:page_size]
+        next_cursor = encode_cursor(activities[-1])
+
+    return activities, next_cursor
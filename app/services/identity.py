@@ -0,0 +1,105 @@
+import pytz
+from flask import current_app
+from flask_login import UserMixin
+
+from app.models import User
+from app.services.cache import TTLCache
+
+
+class UserSnapshot(UserMixin):
+    """
+    The parts of a user needed on every page, cached so the user isn't loaded from the database
+    on each request. Used as the logged in user in place of User
+    """
+
+    def __init__(self, id, username, email, picture_url, timezone=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.picture_url = picture_url
+        self.timezone = timezone
+
+    def avatar(self, size):
+        return User.avatar(self, size)
+
+    def __repr__(self):
+        return '<UserSnapshot: {} {}>'.format(self.id, self.username)
+
+
+def get_cache() -> TTLCache:
+    """
+    returns the app's cache of user snapshots, creating it on first use
+    :return: the cache
+    :rtype: TTLCache
+    """
+    cache = current_app.extensions.get('identity_cache')
+    if cache is None:
+        cache = TTLCache(maxsize=current_app.config['IDENTITY_CACHE_SIZE'],
+                         ttl=current_app.config['IDENTITY_CACHE_TTL'])
+        current_app.extensions['identity_cache'] = cache
+    return cache
+
+
+def get_user_snapshot(user_id: int):
+    """
+    returns a snapshot of the user, from the cache if it's there
+    :param user_id: the user
+    :type user_id: int
+    :return: the snapshot, None if there is no such user
+    :rtype: UserSnapshot
+    """
+    cache = get_cache()
+    snapshot = cache.get(user_id)
+    if snapshot is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot(user.id, user.username, user.email, user.picture_url, user.timezone)
+        cache.set(user_id, snapshot)
+    return snapshot
+
+
+def invalidate_user(user_id: int):
+    """
+    drops the user's snapshot from this process's cache once their profile has changed.
+    Other processes see the change when their snapshot expires after IDENTITY_CACHE_TTL seconds
+    :param user_id: the user
+    :type user_id: int
+    :return:
+    :rtype:
+    """
+    get_cache().delete(user_id)
+
+
+def get_timezone_name(user) -> str:
+    """
+    returns the name of the user's timezone
+    :param user: the user or their snapshot
+    :type user: UserSnapshot
+    :return: the timezone name, UTC if the user's timezone isn't known
+    :rtype: str
+    """
+    user_tz = getattr(user, 'timezone', None)
+    return user_tz if isinstance(user_tz, str) and user_tz else 'UTC'
+
+
+def record_timezone(user, user_tz: str) -> bool:
+    """
+    stores the timezone reported by the user's browser, if it's a valid timezone
+    and not the one already stored, so usually nothing is written.
+    Does not commit, the caller commits along with the rest of the request's changes
+    and then calls invalidate_user if the timezone was stored, so the cache isn't
+    refilled with the old timezone before the commit
+    :param user: the user or their snapshot
+    :type user: UserSnapshot
+    :param user_tz: name of the timezone
+    :type user_tz: str
+    :return: True if the timezone was stored
+    :rtype: bool
+    """
+    if user_tz not in pytz.all_timezones_set or getattr(user, 'timezone', None) == user_tz:
+        return False
+
+    user_id = int(user.get_id())
+    User.query.filter(User.id == user_id).update({User.timezone: user_tz}, synchronize_session=False)
+    return True
@@ -0,0 +1,134 @@
+import hashlib
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_, func
+
+from app import db
+from app.models import Inspiration
+
+# the orders the feed can be shown in
+SORT_NEWEST = 'newest'
+SORT_LIKED = 'liked'
+SORT_OPTIONS = (SORT_NEWEST, SORT_LIKED)
+
+# format of the timestamp part of a page cursor
+CURSOR_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+CURSOR_SEPARATOR = '_'
+
+
+def encode_cursor(inspiration: Inspiration, sort: str = SORT_NEWEST) -> str:
+    """
+    creates the cursor pointing just past the provided inspiration
+    :param inspiration: the last inspiration shown on a page of the feed
+    :type inspiration: Inspiration
+    :param sort: the order of the feed
+    :type sort: string
+    :return: a cursor combining the inspiration's likes, when sorted by likes, last updated time and id
+    :rtype: string
+    """
+    parts = [inspiration.last_updated.strftime(CURSOR_TIMESTAMP_FORMAT), str(inspiration.id)]
+    if sort == SORT_LIKED:
+        parts.insert(0, str(inspiration.likes))
+    return CURSOR_SEPARATOR.join(parts)
+
+
+def decode_cursor(cursor: str, sort: str = SORT_NEWEST) -> Optional[Tuple]:
+    """
+    splits a cursor back into the position of the inspiration it points past
+    :param cursor: cursor created by encode_cursor
+    :type cursor: string
+    :param sort: the order of the feed
+    :type sort: string
+    :return: a tuple of (likes, last updated, inspiration id) when sorted by likes, otherwise
+    (last updated, inspiration id). None if the cursor is missing or badly formed
+    :rtype: tuple
+    """
+    if not cursor:
+        return None
+    try:
+        if sort == SORT_LIKED:
+            likes, last_updated, inspiration_id = cursor.split(CURSOR_SEPARATOR)
+            return int(likes), datetime.strptime(last_updated, CURSOR_TIMESTAMP_FORMAT), int(inspiration_id)
+        last_updated, inspiration_id = cursor.split(CURSOR_SEPARATOR)
+        return datetime.strptime(last_updated, CURSOR_TIMESTAMP_FORMAT), int(inspiration_id)
+    except ValueError:
+        return None
+
+
+def get_feed_page(sort: str = SORT_NEWEST, cursor: str = None,
+                  page_size: int = 24) -> Tuple[List[Inspiration], str]:
+    """
+    returns a page of the inspiration feed, either the most recently added or updated first
+    or the most liked first. Uses keyset pagination on the indexed (likes, last_updated, id)
+    or (last_updated, id) so the cost of a page doesn't grow with the number of inspirations
+    :param sort: SORT_NEWEST or SORT_LIKED
+    :type sort: string
+    :param cursor: cursor returned with the previous page, None for the first page
+    :type cursor: string
+    :param page_size: maximum number of inspirations to return
+    :type page_size: int
+    :return: a tuple of the inspirations on this page and the cursor for the next page, the cursor
+    is None when there are no more inspirations
+    :rtype: tuple
+    """
+    query = Inspiration.query
+
+    position = decode_cursor(cursor, sort)
+    if sort == SORT_LIKED:
+        if position:
+            likes, last_updated, inspiration_id = position
+            query = query.filter(or_(Inspiration.likes < likes,
+                                     and_(Inspiration.likes == likes, Inspiration.last_updated < last_updated),
+                                     and_(Inspiration.likes == likes, Inspiration.last_updated == last_updated,
+                                          Inspiration.id > inspiration_id)))
+        query = query.order_by(Inspiration.likes.desc(), Inspiration.last_updated.desc(), Inspiration.id)
+    else:
+        if position:
+            last_updated, inspiration_id = position
+            query = query.filter(or_(Inspiration.last_updated < last_updated,
+                                     and_(Inspiration.last_updated == last_updated, Inspiration.id > inspiration_id)))
+        query = query.order_by(Inspiration.last_updated.desc(), Inspiration.id)
+
+    # fetch one extra row to find out if there is another page without a count query
+    inspirations = query.limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(inspirations) > page_size:
+        inspirations = inspirations[:page_size]
+        next_cursor = encode_cursor(inspirations[-1], sort)
+
+    return inspirations, next_cursor
+
+
+def get_feed_version() -> Tuple[int, Optional[datetime], Optional[datetime]]:
+    """
+    returns what identifies the current state of the feed: the number of inspirations, which changes
+    when one is added or deleted, the latest last updated time, which changes when one is edited or liked,
+    and the latest time an inspiration's Open Graph metadata was fetched
+    :return: a tuple of (count, latest last updated time, latest metadata fetch)
+    :rtype: tuple
+    """
+    return db.session.query(func.count(Inspiration.id), func.max(Inspiration.last_updated),
+                            func.max(Inspiration.meta_og_fetched)).one()
+
+
+def get_feed_etag(user_id, sort: str, cursor: str, version: Tuple) -> str:
+    """
+    creates the entity tag for a page of the feed
+    :param user_id: the user viewing the feed, as pages show the user's own details
+    :type user_id: int
+    :param sort: the order of the feed
+    :type sort: string
+    :param cursor: the cursor of the page
+    :type cursor: string
+    :param version: returned by get_feed_version
+    :type version: tuple
+    :return: the entity tag
+    :rtype: string
+    """
+    count, last_updated, og_fetched = version
+    last_updated, og_fetched = [moment.strftime(CURSOR_TIMESTAMP_FORMAT) if moment else ''
+                                for moment in (last_updated, og_fetched)]
+    key = '{}|{}|{}|{}|{}|{}'.format(user_id, sort, cursor or '', count, last_updated, og_fetched)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from flask import current_app
+from sqlalchemy import select, literal
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Inspiration, MyInspirationLikes
+
+# likes waiting to be added to the inspirations' counters when INSPIRATION_LIKE_COUNTER is 'buffered'
+_pending_likes = Counter()
+_pending_likes_lock = threading.Lock()
+_pending_likes_flushed = [time.monotonic()]
+
+
+def record_like(user_id: int, inspiration_id: int) -> bool:
+    """
+    inserts the user's like of the inspiration, unless they have already liked it or it doesn't exist.
+    Relies on the unique (user_id, inspiration_id) index rather than checking first, so two
+    concurrent likes by the same user can't both be recorded. Does not commit
+    :param user_id: the user liking the inspiration
+    :type user_id: int
+    :param inspiration_id: the inspiration
+    :type inspiration_id: int
+    :return: True if the like was recorded
+    :rtype: bool
+    """
+    insert = MyInspirationLikes.__table__.insert() \
+        .prefix_with('OR IGNORE', dialect='sqlite') \
+        .prefix_with('IGNORE', dialect='mysql') \
+        .from_select(['user_id', 'inspiration_id'],
+                     select([literal(user_id), Inspiration.id]).where(Inspiration.id == inspiration_id))
+    return db.session.execute(insert).rowcount > 0
+
+
+def add_likes(inspiration_id: int, count: int = 1, connection=None) -> int:
+    """
+    adds to the inspiration's like counter inside the database so concurrent likes aren't lost
+    :param inspiration_id: the inspiration
+    :type inspiration_id: int
+    :param count: the number of likes to add
+    :type count: int
+    :param connection: the connection to use, the session's if None
+    :type connection: Connection
+    :return: the number of inspirations updated
+    :rtype: int
+    """
+    update = Inspiration.__table__.update().where(Inspiration.id == inspiration_id) \
+        .values(likes=Inspiration.likes + count, last_updated=datetime.utcnow())
+    return (connection or db.session).execute(update).rowcount
+
+
+def like_inspiration(user_id, inspiration_id: int) -> Optional[bool]:
+    """
+    likes the inspiration on behalf of the user and commits.
+    How the like counter is updated depends on INSPIRATION_LIKE_COUNTER:
+    'immediate' adds to it in the same transaction as the like,
+    'buffered' keeps the count in memory and adds it with other likes of the inspiration,
+    see flush_likes. Buffered likes not yet written are lost if the process dies
+    :param user_id: the user liking the inspiration
+    :type user_id: int
+    :param inspiration_id: the inspiration
+    :type inspiration_id: int
+    :return: True if the inspiration was liked, False if the user had already liked it
+    and None if there is no such inspiration
+    :rtype: bool
+    """
+    try:
+        liked = record_like(int(user_id), inspiration_id)
+    except IntegrityError:
+        # databases without insert or ignore report the duplicate instead
+        liked = False
+    if not liked:
+        db.session.rollback()
+        if Inspiration.query.filter_by(id=inspiration_id).count() == 0:
+            return None
+        return False
+
+    if current_app.config['INSPIRATION_LIKE_COUNTER'] == 'buffered':
+        db.session.commit()
+        with _pending_likes_lock:
+            _pending_likes[inspiration_id] += 1
+            is_due = sum(_pending_likes.values()) >= current_app.config['INSPIRATION_LIKE_BUFFER_SIZE'] or \
+                time.monotonic() - _pending_likes_flushed[0] >= current_app.config['INSPIRATION_LIKE_FLUSH_SECONDS']
+        if is_due:
+            flush_likes()
+        return True
+
+    add_likes(inspiration_id)
+    db.session.commit()
+    return True
+
+
+def flush_likes() -> int:
+    """
+    adds the buffered likes to the inspirations' counters, one update per inspiration,
+    on its own connection so it doesn't commit the caller's unit of work
+    :return: the number of likes written
+    :rtype: int
+    """
+    with _pending_likes_lock:
+        pending = dict(_pending_likes)
+        _pending_likes.clear()
+        _pending_likes_flushed[0] = time.monotonic()
+
+    if pending:
+        with db.engine.begin() as connection:
+            for inspiration_id, count in pending.items():
+                add_likes(inspiration_id, count, connection)
+    return sum(pending.values())
@@ -0,0 +1,50 @@
+from flask import current_app
+
+from app.models import StravaAthlete
+from app.services.cache import TTLCache
+
+
+def get_cache() -> TTLCache:
+    """
+    returns the app's cache of users' integration status, creating it on first use.
+    The cache belongs to this process, so its entries only live for INTEGRATION_CACHE_TTL seconds
+    as changes made by other processes aren't seen until they expire
+    :return: the cache
+    :rtype: TTLCache
+    """
+    cache = current_app.extensions.get('integration_cache')
+    if cache is None:
+        cache = TTLCache(maxsize=current_app.config['INTEGRATION_CACHE_SIZE'],
+                         ttl=current_app.config['INTEGRATION_CACHE_TTL'])
+        current_app.extensions['integration_cache'] = cache
+    return cache
+
+
+def is_strava_connected(user_id) -> bool:
+    """
+    returns whether the user has an active Strava integration, from the cache if it's there
+    :param user_id: the user
+    :type user_id: int
+    :return: True if the user is connected to Strava
+    :rtype: bool
+    """
+    user_id = int(user_id)
+    cache = get_cache()
+    connected = cache.get(user_id)
+    if connected is None:
+        connected = StravaAthlete.query.filter_by(user_id=user_id, is_active=1).first() is not None
+        cache.set(user_id, connected)
+    return connected
+
+
+def invalidate_strava(user_id):
+    """
+    drops the user's cached Strava status from this process's cache once it has changed.
+    Other processes, such as the web processes when the strava-worker makes the change, see it
+    when their entry expires after INTEGRATION_CACHE_TTL seconds
+    :param user_id: the user
+    :type user_id: int
+    :return:
+    :rtype:
+    """
+    get_cache().delete(int(user_id))
@@ -0,0 +1,43 @@
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_
+
+from app import db
+from app.models import User
+
+# when this process last wrote each user's last seen time
+_last_written = {}
+_last_written_lock = threading.Lock()
+
+
+def record_last_seen(user_id, now: datetime = None) -> bool:
+    """
+    records the user has used the application. The last seen time is written at most once every
+    LAST_SEEN_INTERVAL seconds, so most requests don't write to the database at all.
+    The update only matches if the stored time is older than the interval so other processes
+    don't repeat a write that has just been made
+    :param user_id: the user
+    :type user_id: int
+    :param now: the time the user was seen, defaults to now
+    :type now: datetime
+    :return: True if the last seen time was written
+    :rtype: bool
+    """
+    now = now or datetime.utcnow()
+    interval = timedelta(seconds=current_app.config['LAST_SEEN_INTERVAL'])
+    with _last_written_lock:
+        last_written = _last_written.get(user_id)
+        if last_written and now - last_written < interval:
+            return False
+        if len(_last_written) >= current_app.config['LAST_SEEN_MAX_USERS']:
+            # forget the users who haven't been seen within the interval
+            for stale_user_id in [key for key, value in _last_written.items() if now - value >= interval]:
+                del _last_written[stale_user_id]
+        _last_written[user_id] = now
+
+    User.query.filter(User.id == user_id, or_(User.last_seen.is_(None), User.last_seen <= now - interval)) \
+        .update({User.last_seen: now}, synchronize_session=False)
+    db.session.commit()
+    return True
@@ -0,0 +1,417 @@
+import ipaddress
+import socket
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urljoin, urlparse
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from app import db
+from app.models import Inspiration
+from app.services.cache import TTLCache
+
+OpenGraph = namedtuple('OpenGraph', ['image', 'width', 'height', 'description'])
+
+# the longest values the inspiration's meta_og columns hold
+MAX_IMAGE_LENGTH = 200
+MAX_DESCRIPTION_LENGTH = 200
+
+USER_AGENT = 'LogMyExercise/1.0 (link preview)'
+
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+
+class OpenGraphParser(HTMLParser):
+    """
+    Collects the og: meta tags in a page's head
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.properties = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'meta':
+            return
+        attrs = dict(attrs)
+        name = attrs.get('property') or attrs.get('name') or ''
+        if name.startswith('og:') and attrs.get('content') and name not in self.properties:
+            self.properties[name] = attrs['content'].strip()
+
+
+def to_int(value):
+    """
+    converts a dimension from a meta tag to an int
+    :param value: the meta tag's content
+    :type value: str
+    :return: the value as an int, None if missing or not a number
+    :rtype: int
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_open_graph(html: str, page_url: str = '') -> Optional[OpenGraph]:
+    """
+    extracts the Open Graph image and description from a page
+    :param html: the page
+    :type html: str
+    :param page_url: where the page was fetched from, relative image urls are resolved against it
+    :type page_url: str
+    :return: the metadata, None if the page has no og:image or og:description
+    :rtype: OpenGraph
+    """
+    parser = OpenGraphParser()
+    parser.feed(html)
+    properties = parser.properties
+
+    image = properties.get('og:image:secure_url') or properties.get('og:image')
+    if image:
+        image = urljoin(page_url, image)
+        if urlparse(image).scheme not in ('http', 'https') or len(image) > MAX_IMAGE_LENGTH:
+            image = None
+    description = properties.get('og:description')
+    if description:
+        description = description[:MAX_DESCRIPTION_LENGTH]
+    if not image and not description:
+        return None
+
+    return OpenGraph(image=image,
+                     width=to_int(properties.get('og:image:width')) if image else None,
+                     height=to_int(properties.get('og:image:height')) if image else None,
+                     description=description)
+
+
+def get_public_addresses(host: str, port: int) -> List[str]:
+    """
+    resolves the host, as long as every address it resolves to is on the public internet, so fetching a page
+    from it can't reach the instance metadata service, the database or other hosts inside the network
+    :param host: the host name or address
+    :type host: str
+    :param port: the port the page is fetched from
+    :type port: int
+    :return: the host's addresses, empty if the host doesn't resolve or any of its addresses is private,
+    loopback, link-local, multicast or reserved
+    :rtype: list of str
+    """
+    try:
+        addresses = list(dict.fromkeys(info[4][0] for info in
+                                       socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)))
+    except (socket.gaierror, UnicodeError):
+        return []
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            return []
+    return addresses
+
+
+def is_public_host(host: str, port: int) -> bool:
+    """
+    whether every address the host resolves to is on the public internet, see get_public_addresses
+    :param host: the host name or address
+    :type host: str
+    :param port: the port the page is fetched from
+    :type port: int
+    :return: False if the host doesn't resolve or any of its addresses isn't public
+    :rtype: bool
+    """
+    return bool(get_public_addresses(host, port))
+
+
+class PublicAddressConnection:
+    """
+    Resolves and checks the host again as it connects and then connects to the address that was checked,
+    so a host whose DNS answer changes after the page's url was checked can't reach a private address
+    """
+
+    def _new_conn(self):
+        addresses = get_public_addresses(self.host, self.port)
+        if not addresses:
+            raise NewConnectionError(self, 'Not connecting to {}, it is not a public address'.format(self.host))
+        # the host name is still used for the Host header, SNI and checking the certificate
+        self._dns_host = addresses[0]
+        return super()._new_conn()
+
+
+class PublicHTTPConnection(PublicAddressConnection, HTTPConnection):
+    pass
+
+
+class PublicHTTPSConnection(PublicAddressConnection, HTTPSConnection):
+    pass
+
+
+class PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = PublicHTTPConnection
+
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PublicHTTPSConnection
+
+
+class PublicAddressAdapter(HTTPAdapter):
+    """
+    An adapter that only connects to public addresses, see PublicAddressConnection
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': PublicHTTPConnectionPool,
+                                                   'https': PublicHTTPSConnectionPool}
+
+
+class OpenGraphFetcher:
+    """
+    Fetches the Open Graph metadata of pages using a bounded pool of threads, limiting how many pages
+    are fetched from the same host at once and caching what is parsed by url
+    """
+
+    def __init__(self, max_workers: int = 4, per_host: int = 2, timeout=(3.05, 5), max_bytes: int = 512 * 1024,
+                 cache: TTLCache = None, max_redirects: int = 3, allow_private_addresses: bool = False):
+        """
+        :param max_workers: the most pages fetched at once
+        :type max_workers: int
+        :param per_host: the most pages fetched at once from a single host
+        :type per_host: int
+        :param timeout: the connect and read timeouts in seconds
+        :type timeout: tuple
+        :param max_bytes: the most of a page read, the og tags are in the head
+        :type max_bytes: int
+        :param cache: metadata already parsed, by url
+        :type cache: TTLCache
+        :param max_redirects: the most redirects followed to reach a page
+        :type max_redirects: int
+        :param allow_private_addresses: whether pages can be fetched from private addresses, for testing
+        :type allow_private_addresses: bool
+        """
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.cache = cache if cache is not None else TTLCache()
+        self.max_redirects = max_redirects
+        self.allow_private_addresses = allow_private_addresses
+        self.session = requests.Session()
+        adapter_class = HTTPAdapter if allow_private_addresses else PublicAddressAdapter
+        adapter = adapter_class(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # a proxy from the environment would resolve the host itself, past the check on the address
+        self.session.trust_env = allow_private_addresses
+        self.session.headers['User-Agent'] = USER_AGENT
+        # the semaphore of each host pages are being fetched from and the number of fetches using it,
+        # a host is forgotten once nothing is fetched from it so this only holds the hosts in use
+        self._host_limits = {}
+        self._host_limits_lock = threading.Lock()
+
+    @contextmanager
+    def host_limit(self, host: str):
+        """
+        waits until fewer than per_host pages are being fetched from the host, then holds one of its places
+        :param host: the host
+        :type host: str
+        :return:
+        :rtype:
+        """
+        with self._host_limits_lock:
+            semaphore, users = self._host_limits.get(host) or (threading.BoundedSemaphore(self.per_host), 0)
+            self._host_limits[host] = (semaphore, users + 1)
+        try:
+            with semaphore:
+                yield
+        finally:
+            with self._host_limits_lock:
+                semaphore, users = self._host_limits[host]
+                if users > 1:
+                    self._host_limits[host] = (semaphore, users - 1)
+                else:
+                    del self._host_limits[host]
+
+    def is_allowed(self, url: str) -> bool:
+        """
+        whether a page can be fetched from the url: it must be http or https on a public address
+        :param url: the page
+        :type url: str
+        :return: True if the page can be fetched
+        :rtype: bool
+        """
+        parts = urlparse(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return False
+        try:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+        except ValueError:
+            return False
+        return self.allow_private_addresses or is_public_host(parts.hostname, port)
+
+    def get_page(self, url: str):
+        """
+        reads the start of the page, following redirects only to urls that can be fetched too
+        :param url: the page
+        :type url: str
+        :return: the start of the page, the url it was read from and its encoding, None if it isn't an html page
+        :rtype: tuple
+        """
+        for _ in range(self.max_redirects + 1):
+            if not self.is_allowed(url):
+                current_app.logger.info('Not fetching {} for its Open Graph metadata'.format(url))
+                return None
+            with self.host_limit(urlparse(url).netloc):
+                with self.session.get(url, timeout=self.timeout, stream=True, allow_redirects=False) as response:
+                    if response.status_code in REDIRECT_STATUS_CODES and response.headers.get('Location'):
+                        url = urljoin(url, response.headers['Location'])
+                        continue
+                    if response.status_code != 200 or 'html' not in response.headers.get('Content-Type', 'html'):
+                        return None
+                    chunks = []
+                    size = 0
+                    for chunk in response.iter_content(16 * 1024):
+                        chunks.append(chunk)
+                        size += len(chunk)
+                        if size >= self.max_bytes:
+                            break
+                    return b''.join(chunks)[:self.max_bytes], response.url, response.encoding or 'utf-8'
+        current_app.logger.info('Too many redirects fetching {} for its Open Graph metadata'.format(url))
+        return None
+
+    def fetch(self, url: str) -> Optional[OpenGraph]:
+        """
+        fetches the page and parses its Open Graph metadata, from the cache if the page has been parsed before
+        :param url: the page
+        :type url: str
+        :return: the metadata, None if the page couldn't be fetched or has none
+        :rtype: OpenGraph
+        """
+        if not url or urlparse(url).scheme not in ('http', 'https'):
+            return None
+        metadata = self.cache.get(url)
+        if metadata is not None:
+            return metadata
+
+        try:
+            page = self.get_page(url)
+        except requests.RequestException as e:
+            current_app.logger.info('Unable to fetch {} for its Open Graph metadata: {}'.format(url, e))
+            return None
+        if page is None:
+            return None
+
+        content, page_url, encoding = page
+        try:
+            html = content.decode(encoding, errors='replace')
+        except LookupError:
+            # the page's charset isn't one Python knows
+            html = content.decode('utf-8', errors='replace')
+        metadata = parse_open_graph(html, page_url)
+        if metadata is not None:
+            self.cache.set(url, metadata)
+        return metadata
+
+    def fetch_all(self, urls: Iterable[str]) -> Dict[str, Optional[OpenGraph]]:
+        """
+        fetches the metadata of the pages in parallel, each page is only fetched once
+        :param urls: the pages
+        :type urls: iterable of str
+        :return: the metadata of each url
+        :rtype: dict
+        """
+        urls = list(dict.fromkeys(url for url in urls if url))
+        app = current_app._get_current_object()
+
+        def fetch_in_app(url):
+            with app.app_context():
+                return self.fetch(url)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(urls, executor.map(fetch_in_app, urls)))
+
+    def close(self):
+        self.session.close()
+
+
+def get_fetcher() -> OpenGraphFetcher:
+    """
+    returns the app's Open Graph fetcher, creating it on first use
+    :return: the fetcher
+    :rtype: OpenGraphFetcher
+    """
+    fetcher = current_app.extensions.get('open_graph_fetcher')
+    if fetcher is None:
+        config = current_app.config
+        fetcher = OpenGraphFetcher(max_workers=config['OG_MAX_WORKERS'],
+                                   per_host=config['OG_PER_HOST_LIMIT'],
+                                   timeout=(config['OG_CONNECT_TIMEOUT'], config['OG_READ_TIMEOUT']),
+                                   max_bytes=config['OG_MAX_BYTES'],
+                                   cache=TTLCache(maxsize=config['OG_CACHE_SIZE'], ttl=config['OG_CACHE_TTL']),
+                                   max_redirects=config['OG_MAX_REDIRECTS'],
+                                   allow_private_addresses=config['OG_ALLOW_PRIVATE_ADDRESSES'])
+        current_app.extensions['open_graph_fetcher'] = fetcher
+    return fetcher
+
+
+def get_pending(limit: int = 20) -> List[Inspiration]:
+    """
+    returns the inspirations whose metadata hasn't been fetched yet, oldest first
+    :param limit: the most inspirations to return
+    :type limit: int
+    :return: the inspirations
+    :rtype: list of Inspiration
+    """
+    return Inspiration.query.filter(Inspiration.meta_og_fetched.is_(None)) \
+        .order_by(Inspiration.id).limit(limit).all()
+
+
+def reset_metadata(inspiration: Inspiration):
+    """
+    clears the inspiration's metadata so it's fetched again, e.g. when its url has changed. Does not commit
+    :param inspiration: the inspiration
+    :type inspiration: Inspiration
+    :return:
+    :rtype:
+    """
+    inspiration.meta_og_image = None
+    inspiration.meta_og_width = None
+    inspiration.meta_og_height = None
+    inspiration.meta_og_description = None
+    inspiration.meta_og_fetched = None
+
+
+def run_pending(limit: int = 20) -> int:
+    """
+    fetches the metadata of the inspirations waiting for it. The pages are fetched in parallel and
+    the inspirations then updated in a single commit. An inspiration whose page can't be fetched
+    is marked as fetched too so it isn't tried again
+    :param limit: the most inspirations to fetch the metadata of
+    :type limit: int
+    :return: the number of inspirations processed
+    :rtype: int
+    """
+    inspirations = get_pending(limit)
+    if not inspirations:
+        return 0
+
+    metadata = get_fetcher().fetch_all(inspiration.url for inspiration in inspirations)
+    now = datetime.utcnow()
+    for inspiration in inspirations:
+        page_metadata = metadata.get(inspiration.url)
+        if page_metadata is not None:
+            inspiration.meta_og_image = page_metadata.image
+            inspiration.meta_og_width = page_metadata.width
+            inspiration.meta_og_height = page_metadata.height
+            inspiration.meta_og_description = page_metadata.description
+        inspiration.meta_og_fetched = now
+    db.session.commit()
+    return len(inspirations)
@@ -0,0 +1,277 @@
+import hashlib
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Activity, DailyActivityRollup, WeeklyActivityRollup
+from app.services import charting
+
+
+def get_week_start(local_date: date) -> date:
+    """
+    returns the Monday of the ISO week the date falls in, which identifies the week's rollup
+    :param local_date: the date
+    :type local_date: date
+    :return: the Monday on or before the date
+    :rtype: date
+    """
+    return local_date - timedelta(days=local_date.weekday())
+
+
+def update_totals(model, keys: Dict, sign: int, duration: int, distance: Decimal, now: datetime):
+    """
+    adds to the totals of the rollup identified by keys inside the database, creating it if it doesn't exist yet.
+    The row is created in a savepoint, so if a concurrent writer creates it first only the savepoint is rolled back
+    and the totals are added to that writer's row instead
+    :param model: DailyActivityRollup or WeeklyActivityRollup
+    :type model: a model class
+    :param keys: the rollup's primary key columns and values
+    :type keys: dict
+    :param sign: 1 when an activity is being added, -1 when it is being removed
+    :type sign: int
+    :param duration: the duration to add
+    :type duration: int
+    :param distance: the distance to add
+    :type distance: Decimal
+    :param now: when the rollup is updated
+    :type now: datetime
+    :return:
+    :rtype:
+    """
+    values = {model.count: model.count + sign,
+              model.duration: model.duration + duration,
+              model.distance: model.distance + distance,
+              model.last_updated: now}
+    if model is WeeklyActivityRollup:
+        values[model.changes] = model.changes + 1
+    updated = model.query.filter_by(**keys).update(values, synchronize_session=False)
+
+    if not updated:
+        row = model(count=sign, duration=duration, distance=distance, last_updated=now, **keys)
+        if model is WeeklyActivityRollup:
+            row.changes = 1
+        try:
+            # flushed when the savepoint is released, so a later activity for the same rollup
+            # in this unit of work updates this row
+            with db.session.begin_nested():
+                db.session.add(row)
+        except IntegrityError:
+            model.query.filter_by(**keys).update(values, synchronize_session=False)
+
+
+def apply_activity(activity: Activity, sign: int = 1):
+    """
+    adds the activity to, or removes it from, the rollups for the day and the week it took place in.
+    The totals are updated inside the database so concurrent writes for the same day aren't lost.
+    Does not commit, the caller commits along with the activity itself
+    :param activity: activity being saved or deleted
+    :type activity: Activity
+    :param sign: 1 when the activity is being saved, -1 when it is being deleted
+    :type sign: int
+    :return:
+    :rtype:
+    """
+    local_date = charting.get_activity_local_date(activity)
+    duration = sign * (activity.duration or 0)
+    distance = sign * Decimal(str(activity.distance or 0))
+    now = datetime.utcnow()
+
+    update_totals(DailyActivityRollup, {'user_id': activity.user_id, 'local_date': local_date,
+                                        'type': activity.type}, sign, duration, distance, now)
+    update_totals(WeeklyActivityRollup, {'user_id': activity.user_id, 'week_start': get_week_start(local_date),
+                                         'type': activity.type}, sign, duration, distance, now)
+
+
+def add_activity(activity: Activity):
+    """
+    adds a newly saved activity to its day's and week's rollups
+    :param activity: the saved activity
+    :type activity: Activity
+    :return:
+    :rtype:
+    """
+    apply_activity(activity, 1)
+
+
+def remove_activity(activity: Activity):
+    """
+    removes an activity that is being deleted from its day's and week's rollups
+    :param activity: the activity being deleted
+    :type activity: Activity
+    :return:
+    :rtype:
+    """
+    apply_activity(activity, -1)
+
+
+def get_rollups(user_id: int, start_date: date, end_date: date) -> List[DailyActivityRollup]:
+    """
+    returns the user's rollups for the days in [start_date, end_date]
+    :param user_id: the user
+    :type user_id: int
+    :param start_date: first local date to include
+    :type start_date: date
+    :param end_date: last local date to include
+    :type end_date: date
+    :return: at most one rollup per day and activity type
+    :rtype: list of DailyActivityRollup
+    """
+    return DailyActivityRollup.query.filter(DailyActivityRollup.user_id == user_id,
+                                            DailyActivityRollup.local_date >= start_date,
+                                            DailyActivityRollup.local_date <= end_date).all()
+
+
+def get_weekly_rollups(user_id: int, start_week: date, end_week: date) -> List[WeeklyActivityRollup]:
+    """
+    returns the user's weekly rollups for the weeks starting in [start_week, end_week],
+    a single read of the rollups' primary key
+    :param user_id: the user
+    :type user_id: int
+    :param start_week: Monday of the first week to include
+    :type start_week: date
+    :param end_week: Monday of the last week to include
+    :type end_week: date
+    :return: at most one rollup per week and activity type
+    :rtype: list of WeeklyActivityRollup
+    """
+    return WeeklyActivityRollup.query.filter(WeeklyActivityRollup.user_id == user_id,
+                                             WeeklyActivityRollup.week_start >= start_week,
+                                             WeeklyActivityRollup.week_start <= end_week).all()
+
+
+def get_week_version(user_id: int, week_start: date) -> Tuple[int, int, Optional[datetime]]:
+    """
+    returns what identifies the current state of the user's activities in a week: the number of weekly rollups,
+    which changes when an activity type is first logged in the week or is no longer in it after a rebuild,
+    the total of their change counters, which goes up whenever an activity in the week is saved or deleted
+    or the rollups are rebuilt, and their latest last updated time. The time alone isn't enough as MySQL
+    stores it to the second
+    :param user_id: the user
+    :type user_id: int
+    :param week_start: Monday of the week
+    :type week_start: date
+    :return: a tuple of (number of rollups, total changes, latest last updated time)
+    :rtype: tuple
+    """
+    count, changes, last_updated = db.session.query(
+        func.count(WeeklyActivityRollup.type), func.sum(WeeklyActivityRollup.changes),
+        func.max(WeeklyActivityRollup.last_updated)) \
+        .filter(WeeklyActivityRollup.user_id == user_id, WeeklyActivityRollup.week_start == week_start).one()
+    return count, int(changes or 0), last_updated
+
+
+def get_week_etag(user_id: int, week_start: date, sum_by: str, version: Tuple) -> str:
+    """
+    creates the entity tag for the chart of a week
+    :param user_id: the user
+    :type user_id: int
+    :param week_start: Monday of the week
+    :type week_start: date
+    :param sum_by: whether the chart sums by duration or distance
+    :type sum_by: string
+    :param version: returned by get_week_version
+    :type version: tuple
+    :return: the entity tag
+    :rtype: string
+    """
+    count, changes, last_updated = version
+    key = '{}|{}|{}|{}|{}|{}'.format(user_id, week_start.isoformat(), sum_by, count, changes,
+                                     last_updated.strftime('%Y-%m-%dT%H:%M:%S.%f') if last_updated else '')
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def rebuild_rollups(user_id: int = None) -> int:
+    """
+    recalculates the daily and weekly rollups from the activities table, for a single user or for everyone.
+    Used to backfill the rollups for activities saved before they existed
+    :param user_id: the user to rebuild, all users if None
+    :type user_id: int
+    :return: the number of daily rollups written
+    :rtype: int
+    """
+    # the weekly change counters carry on from the rollups being replaced so a rebuilt week has a new version
+    changes_query = db.session.query(WeeklyActivityRollup.user_id, WeeklyActivityRollup.week_start,
+                                     WeeklyActivityRollup.type, WeeklyActivityRollup.changes)
+    if user_id is not None:
+        changes_query = changes_query.filter(WeeklyActivityRollup.user_id == user_id)
+    previous_changes = {(row_user_id, week_start, activity_type): changes or 0
+                        for row_user_id, week_start, activity_type, changes in changes_query}
+
+    for model in (DailyActivityRollup, WeeklyActivityRollup):
+        rollup_query = model.query
+        if user_id is not None:
+            rollup_query = rollup_query.filter_by(user_id=user_id)
+        rollup_query.delete(synchronize_session=False)
+
+    # the local date is stored on each activity so the totals can be summed by the database
+    totals_query = db.session.query(Activity.user_id, Activity.local_date, Activity.type, func.count(Activity.id),
+                                    func.sum(Activity.duration), func.sum(Activity.distance)) \
+        .filter(Activity.local_date.isnot(None))
+    if user_id is not None:
+        totals_query = totals_query.filter(Activity.user_id == user_id)
+    daily_totals = defaultdict(lambda: [0, 0, Decimal(0)])
+    for total_user_id, local_date, activity_type, count, duration, distance in \
+            totals_query.group_by(Activity.user_id, Activity.local_date, Activity.type):
+        daily_totals[(total_user_id, local_date, activity_type)] = [count, int(duration or 0),
+                                                                    Decimal(str(distance or 0))]
+
+    # activities saved before the local date was stored have it worked out from their timestamps
+    legacy_query = Activity.query.filter(Activity.local_date.is_(None))
+    if user_id is not None:
+        legacy_query = legacy_query.filter(Activity.user_id == user_id)
+    for activity in legacy_query:
+        daily_total = daily_totals[(activity.user_id, charting.get_activity_local_date(activity), activity.type)]
+        daily_total[0] += 1
+        daily_total[1] += activity.duration or 0
+        daily_total[2] += Decimal(str(activity.distance or 0))
+
+    # the weeks are summed from the daily totals as grouping by week isn't portable across databases
+    weekly_totals = defaultdict(lambda: [0, 0, Decimal(0)])
+    for (total_user_id, local_date, activity_type), (count, duration, distance) in daily_totals.items():
+        weekly_total = weekly_totals[(total_user_id, get_week_start(local_date), activity_type)]
+        weekly_total[0] += count
+        weekly_total[1] += duration
+        weekly_total[2] += distance
+
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(DailyActivityRollup, [
+        {'user_id': total_user_id, 'local_date': local_date, 'type': activity_type, 'count': count,
+         'duration': duration, 'distance': distance, 'last_updated': now}
+        for (total_user_id, local_date, activity_type), (count, duration, distance) in daily_totals.items()])
+    db.session.bulk_insert_mappings(WeeklyActivityRollup, [
+        {'user_id': total_user_id, 'week_start': week_start, 'type': activity_type, 'count': count,
+         'duration': duration, 'distance': distance, 'last_updated': now,
+         'changes': previous_changes.get((total_user_id, week_start, activity_type), 0) + 1}
+        for (total_user_id, week_start, activity_type), (count, duration, distance) in weekly_totals.items()])
+    db.session.commit()
+
+    return len(daily_totals)
+
+
+def get_daily_rows(user_id: int, start_date: date, end_date: date, backend: str = 'rollup') -> List[Tuple]:
+    """
+    returns the user's daily totals for [start_date, end_date] as rows of
+    (activity type, local date, count, duration, distance) from the configured backend.
+    'rollup' reads the precomputed daily rollups, 'sql' groups the activities in the database
+    and 'python' loads the activities and sums them in Python
+    :param user_id: the user
+    :type user_id: int
+    :param start_date: first local date to include
+    :type start_date: date
+    :param end_date: last local date to include
+    :type end_date: date
+    :param backend: one of 'rollup', 'sql' or 'python'
+    :type backend: str
+    :return: the daily rows
+    :rtype: list of tuples
+    """
+    if backend == 'sql':
+        return charting.query_daily_rows(user_id, start_date, end_date)
+    if backend == 'python':
+        return list(charting.activity_rows(charting.query_activities(user_id, start_date, end_date)))
+    return list(charting.rollup_rows(get_rollups(user_id, start_date, end_date)))
@@ -1,16 +1,39 @@
-import os
+import atexit
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
 from datetime import datetime
 
-import requests
 from authlib.integrations.requests_client import OAuth2Session
 from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
 
 from app import db
 from app.main import routes
 from app.models import StravaAthlete, Activity, StravaEvent
-from config import app_config
+from app.services import integration, strava_client, rollup
 
 STRAVA_ACTIVITIES_LOOKUP = {1: 'Workout', 2: 'Yoga', 3: 'Ride', 4: 'Run', 5: 'Walk', 6: 'Swim'}
+# the app's activity type for each Strava type, other Strava types are saved as a Workout
+APP_ACTIVITIES_LOOKUP = {strava_type: activity_type for activity_type, strava_type in STRAVA_ACTIVITIES_LOOKUP.items()}
+DEFAULT_APP_ACTIVITY_TYPE = 1
+
+# per athlete locks around refreshing an access token with how many threads hold or wait for each, and how
+# often a token was reused or refreshed
+_token_locks = {}
+_token_locks_lock = threading.Lock()
+_token_counters = Counter()
+
+# Strava events waiting to be written when STRAVA_EVENT_DURABILITY is buffered, when the buffer was last
+# written, how many of the oldest events were dropped because the buffer filled up since then, and the
+# thread that writes the buffer every STRAVA_EVENT_FLUSH_SECONDS
+_event_buffer = deque()
+_event_buffer_lock = threading.Lock()
+_event_buffer_flushed = [time.monotonic()]
+_event_buffer_dropped = [0]
+_event_flusher = [None]
+
 
 def create_strava_athlete(authorize_details, user_id, scope):
     """
@@ -36,9 +59,58 @@ def create_strava_athlete(authorize_details, user_id, scope):
     return strava_athlete
 
 
+@contextmanager
+def token_lock(athlete_id):
+    """
+    holds the lock around refreshing the athlete's access token, so concurrent uploads in this
+    process don't each refresh the same token. The lock is forgotten once no thread holds or
+    waits for it, so there is only one for each athlete whose token is being refreshed
+    :param athlete_id: strava athlete_id
+    :type athlete_id: int
+    :return:
+    :rtype:
+    """
+    with _token_locks_lock:
+        lock, users = _token_locks.get(athlete_id) or (threading.Lock(), 0)
+        _token_locks[athlete_id] = (lock, users + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _token_locks_lock:
+            lock, users = _token_locks[athlete_id]
+            if users > 1:
+                _token_locks[athlete_id] = (lock, users - 1)
+            else:
+                del _token_locks[athlete_id]
+
+
+def get_token_counters():
+    """
+    returns how often a still valid access token was reused (hits) and how often one was refreshed
+    :return: the counts keyed by hits and refreshes
+    :rtype: dict
+    """
+    return {'hits': _token_counters['hits'], 'refreshes': _token_counters['refreshes']}
+
+
+def is_access_token_valid(strava_athlete):
+    """
+    whether the athlete's access token can still be used, it is treated as expired
+    STRAVA_TOKEN_EXPIRY_MARGIN seconds early so it doesn't expire mid request
+    :param strava_athlete: the strava athlete
+    :type strava_athlete: StravaAthlete
+    :return: True if the token is valid for at least the margin
+    :rtype: boolean
+    """
+    if not strava_athlete.access_token or not strava_athlete.access_token_expires_at:
+        return False
+    return strava_athlete.access_token_expires_at - strava_client.get_settings().token_expiry_margin > time.time()
+
+
 def refresh_access_token(user_id):
     """
-    Refreshes the strava API access token if it's expired
+    Refreshes the strava API access token if it's expired or about to, otherwise returns the current one
     :param user_id: identifier for the user
     :type user_id: int
     :return: a valid access token
@@ -63,33 +135,52 @@ def refresh_access_token(user_id):
     # otherwise, use the current one
     # return the token
     strava_athlete = StravaAthlete.query.filter_by(user_id=user_id).first()
-    my_token = {'refresh_token': strava_athlete.refresh_token,
-                'access_token': strava_athlete.access_token,
-                'expires_at': strava_athlete.access_token_expires_at,
-                'expires_in': strava_athlete.access_token_expires_in}
-
-    my_config = app_config[os.getenv('FLASK_CONFIG')]()
-
-    oauth_session = OAuth2Session(my_config.STRAVA_CLIENT_ID,
-                                  my_config.STRAVA_CLIENT_SECRET,
-                                  authorization_endpoint=my_config.STRAVA_CLIENT_DOMAIN + '/oauth/authorize',
-                                  token_endpoint=my_config.STRAVA_CLIENT_DOMAIN + '/oauth/token',
-                                  token=my_token,
-                                  grant_type='refresh_token')
-    new_token = oauth_session.refresh_token(
-        url=my_config.STRAVA_CLIENT_DOMAIN + '/oauth/token',
-        client_id=my_config.STRAVA_CLIENT_ID,
-        client_secret=my_config.STRAVA_CLIENT_SECRET)
-
-    # save it to the database assuming there is no error
-    if new_token is not None:
-        strava_athlete.access_token = new_token['access_token']
-        strava_athlete.access_token_expires_at = int(new_token['expires_at'])
-        strava_athlete.access_token_expires_in = int(new_token['expires_in'])
-        strava_athlete.refresh_token = new_token['refresh_token']
-        strava_athlete.last_updated = datetime.utcnow()
-        db.session.commit()
-        return new_token['access_token']
+    if is_access_token_valid(strava_athlete):
+        _token_counters['hits'] += 1
+        return strava_athlete.access_token
+
+    with token_lock(strava_athlete.athlete_id):
+        # another upload, in this process or another, may have refreshed the token while this one waited.
+        # A locking read sees the latest committed row even in a REPEATABLE READ transaction that has already
+        # read it, and holds the row until this refresh commits so other processes wait for it too
+        strava_athlete = StravaAthlete.query.filter_by(athlete_id=strava_athlete.athlete_id) \
+            .with_for_update().populate_existing().first()
+        if is_access_token_valid(strava_athlete):
+            _token_counters['hits'] += 1
+            return strava_athlete.access_token
+
+        my_token = {'refresh_token': strava_athlete.refresh_token,
+                    'access_token': strava_athlete.access_token,
+                    'expires_at': strava_athlete.access_token_expires_at,
+                    'expires_in': strava_athlete.access_token_expires_in}
+
+        settings = strava_client.get_settings()
+
+        oauth_session = OAuth2Session(settings.client_id,
+                                      settings.client_secret,
+                                      authorization_endpoint=settings.client_domain + '/oauth/authorize',
+                                      token_endpoint=settings.client_domain + '/oauth/token',
+                                      token=my_token,
+                                      grant_type='refresh_token')
+        # reuse the pooled connections to Strava rather than opening new ones
+        client = strava_client.get_client()
+        client.mount_on(oauth_session)
+        new_token = oauth_session.refresh_token(
+            url=settings.client_domain + '/oauth/token',
+            client_id=settings.client_id,
+            client_secret=settings.client_secret,
+            timeout=client.timeout)
+
+        # save it to the database assuming there is no error
+        if new_token is not None:
+            _token_counters['refreshes'] += 1
+            strava_athlete.access_token = new_token['access_token']
+            strava_athlete.access_token_expires_at = int(new_token['expires_at'])
+            strava_athlete.access_token_expires_in = int(new_token['expires_in'])
+            strava_athlete.refresh_token = new_token['refresh_token']
+            strava_athlete.last_updated = datetime.utcnow()
+            db.session.commit()
+            return new_token['access_token']
 
     # must be an error to log this
     current_app.logger.error('Failed to refresh the token')
@@ -144,16 +235,19 @@ def create_activity(activity_id):
             # let the app continue on as error has been logged
             return 200
 
-        url = 'https://www.strava.com/api/v3/activities'
         headers = {'Authorization': 'Bearer {}'.format(access_token)}
 
         data = construct_strava_activity_data(activity)
-        response = requests.post(url, headers=headers, data=data)
+        response = strava_client.get_client().post('/api/v3/activities', headers=headers, data=data)
+        if response.status_code == 201:
+            # keep Strava's id so the webhook event for the new activity updates it rather than importing a copy
+            activity.strava_activity_id = int(response.json()['id'])
         strava_athlete = StravaAthlete.query.filter_by(user_id=activity.user_id).first()
         log_strava_event(strava_athlete.athlete_id, "Activity")
+        db.session.commit()
 
         # check the response, if there has been an error then need to log this
-        if response.status_code != 200:
+        if response.status_code not in (200, 201):
             current_app.logger.error('Strava Status code: {}'.format(response.status_code))
             current_app.logger.error('Strava Response: {}'.format(response.json))
         return response.status_code
@@ -162,6 +256,106 @@ def create_activity(activity_id):
     return 200
 
 
+def get_strava_activity(user_id, strava_activity_id):
+    """
+    fetches a single activity from Strava
+    :param user_id: the user whose athlete owns the activity
+    :type user_id: int
+    :param strava_activity_id: Strava's id for the activity
+    :type strava_activity_id: int
+    :return: the activity as returned by the Strava API, None if it couldn't be fetched
+    :rtype: dict
+    :raises requests.HTTPError: if Strava is rate limiting or having problems
+    """
+    access_token = refresh_access_token(user_id=user_id)
+    if access_token is None:
+        current_app.logger.error('Cannot fetch Strava activity {} as unable to refresh token'
+                                 .format(strava_activity_id))
+        return None
+
+    headers = {'Authorization': 'Bearer {}'.format(access_token)}
+    response = strava_client.get_client().get('/api/v3/activities/{}'.format(strava_activity_id), headers=headers)
+    if response.status_code in strava_client.RETRY_STATUS_CODES:
+        # Strava is rate limiting or having problems even after the client's retries, the caller can try later
+        response.raise_for_status()
+    if response.status_code != 200:
+        current_app.logger.error('Strava Status code: {}'.format(response.status_code))
+        current_app.logger.error('Strava Response: {}'.format(response.json))
+        return None
+    return response.json()
+
+
+def update_activity_from_strava(activity, data):
+    """
+    sets the fields of an activity from an activity returned by the Strava API,
+    the reverse of construct_strava_activity_data
+    :param activity: the activity to update
+    :type activity: Activity
+    :param data: the activity from the Strava API
+    :type data: dict
+    :return:
+    :rtype:
+    """
+    activity.strava_activity_id = int(data['id'])
+    activity.type = APP_ACTIVITIES_LOOKUP.get(data.get('type'), DEFAULT_APP_ACTIVITY_TYPE)
+    activity.title = (data.get('name') or '')[:50]
+    activity.description = (data.get('description') or '')[:300]
+    activity.duration = int(round(data.get('elapsed_time', 0) / 60))  # stored in db as minutes
+    distance = data.get('distance')
+    activity.distance = round(distance / 1000, 2) if distance else None  # stored in db as km
+
+    # start_date is in UTC, start_date_local is the same time in the athlete's timezone
+    # and the timezone is given as e.g. "(GMT-08:00) America/Los_Angeles"
+    activity.timestamp = datetime.strptime(data['start_date'], '%Y-%m-%dT%H:%M:%SZ')
+    local_time = datetime.strptime(data['start_date_local'], '%Y-%m-%dT%H:%M:%SZ')
+    tz = (data.get('timezone') or 'UTC').split(' ')[-1]
+    activity.set_local_time(local_time, tz)
+
+
+def upsert_strava_activity(strava_athlete, strava_activity_id):
+    """
+    imports a Strava activity that has been created or updated, fetching only that activity.
+    The daily rollups are updated for the activity's old and new day
+    :param strava_athlete: the athlete owning the activity
+    :type strava_athlete: StravaAthlete
+    :param strava_activity_id: Strava's id for the activity
+    :type strava_activity_id: int
+    :return: the saved activity, None if it couldn't be fetched from Strava
+    :rtype: Activity
+    """
+    data = get_strava_activity(strava_athlete.user_id, strava_activity_id)
+    if data is None:
+        return None
+
+    activity = Activity.query.filter_by(strava_activity_id=strava_activity_id).first()
+    if activity:
+        rollup.remove_activity(activity)
+    else:
+        activity = Activity(user_id=strava_athlete.user_id)
+        db.session.add(activity)
+    update_activity_from_strava(activity, data)
+    rollup.add_activity(activity)
+    db.session.commit()
+    return activity
+
+
+def delete_strava_activity(strava_activity_id):
+    """
+    deletes an activity that has been deleted in Strava
+    :param strava_activity_id: Strava's id for the activity
+    :type strava_activity_id: int
+    :return: True if there was an activity to delete
+    :rtype: boolean
+    """
+    activity = Activity.query.filter_by(strava_activity_id=strava_activity_id).first()
+    if activity is None:
+        return False
+    rollup.remove_activity(activity)
+    db.session.delete(activity)
+    db.session.commit()
+    return True
+
+
 def deauthorize_athlete(athlete_id):
     """
     deauthorize the strava athlete so the integration won't be used
@@ -176,8 +370,9 @@ def deauthorize_athlete(athlete_id):
     if athlete:
         athlete.is_active = 0
         athlete.last_updated = datetime.utcnow()
-        db.session.commit()
         log_strava_event(athlete_id, "Deauthorize")
+        db.session.commit()
+        integration.invalidate_strava(athlete.user_id)
         return True
 
     current_app.logger.error('Athlete {} does not exist'.format(athlete_id))
@@ -187,6 +382,11 @@ def deauthorize_athlete(athlete_id):
 def log_strava_event(athlete_id, action):
     """
     Logs that the Strava API is called for this athlete in some way.
+    How durable the log is depends on STRAVA_EVENT_DURABILITY:
+    'commit' commits the event straight away,
+    'transaction' adds it to the current unit of work for the caller to commit,
+    'buffered' keeps it in memory and writes it with other events in a single insert,
+    see flush_strava_events
     :param athlete_id: strava athlete_id
     :type athlete_id: int
     :param event: one of 'Deauthorize', 'Authorize', 'Activity'
@@ -194,9 +394,100 @@ def log_strava_event(athlete_id, action):
     :return:
     :rtype:
     """
+    durability = current_app.config['STRAVA_EVENT_DURABILITY']
+    if durability == 'buffered':
+        start_event_flusher(current_app._get_current_object())  # pylint: disable=protected-access
+        with _event_buffer_lock:
+            if len(_event_buffer) >= current_app.config['STRAVA_EVENT_BUFFER_LIMIT']:
+                _event_buffer.popleft()
+                _event_buffer_dropped[0] += 1
+                if _event_buffer_dropped[0] == 1:
+                    current_app.logger.warning('The Strava event buffer is full, dropping the oldest events')
+            _event_buffer.append({'athlete_id': athlete_id, 'action': action, 'timestamp': datetime.utcnow()})
+            is_due = len(_event_buffer) >= current_app.config['STRAVA_EVENT_BUFFER_SIZE'] or \
+                time.monotonic() - _event_buffer_flushed[0] >= current_app.config['STRAVA_EVENT_FLUSH_SECONDS']
+        if is_due:
+            flush_strava_events()
+        return
+
     strava_event = StravaEvent(athlete_id=athlete_id, action=action, timestamp=datetime.utcnow())
     db.session.add(strava_event)
-    db.session.commit()
+    if durability == 'commit':
+        db.session.commit()
+
+
+def flush_strava_events():
+    """
+    writes the buffered Strava events in a single insert, on its own connection
+    so it doesn't commit the caller's unit of work. If the insert fails the events
+    are put back in the buffer to be written next time
+    :return: the number of events written
+    :rtype: int
+    """
+    with _event_buffer_lock:
+        events = list(_event_buffer)
+        _event_buffer.clear()
+        _event_buffer_flushed[0] = time.monotonic()
+        dropped = _event_buffer_dropped[0]
+        _event_buffer_dropped[0] = 0
+    if dropped:
+        current_app.logger.warning('Dropped {} Strava events as the buffer was full'.format(dropped))
+    if not events:
+        return 0
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(StravaEvent.__table__.insert(), events)
+    except SQLAlchemyError as e:
+        current_app.logger.error('Failed to write {} Strava events: {}'.format(len(events), e))
+        with _event_buffer_lock:
+            room = max(current_app.config['STRAVA_EVENT_BUFFER_LIMIT'] - len(_event_buffer), 0)
+            kept = events[max(len(events) - room, 0):]
+            _event_buffer.extendleft(reversed(kept))
+            _event_buffer_dropped[0] += len(events) - len(kept)
+        return 0
+    return len(events)
+
+
+def start_event_flusher(app):
+    """
+    starts the thread that writes the buffered Strava events every STRAVA_EVENT_FLUSH_SECONDS,
+    so they are written even when no more events arrive, and writes whatever is left when
+    the process exits. Does nothing if this process already has one
+    :param app: the flask app the events are written with
+    :type app: Flask
+    """
+    with _event_buffer_lock:
+        if _event_flusher[0] is not None and _event_flusher[0].is_alive():
+            return
+        first = _event_flusher[0] is None
+        _event_flusher[0] = threading.Thread(target=run_event_flusher, args=(app,), name='strava-event-flusher',
+                                             daemon=True)
+        _event_flusher[0].start()
+    if first:
+        atexit.register(flush_event_buffer, app)
+
+
+def run_event_flusher(app):
+    """
+    writes the buffered Strava events every STRAVA_EVENT_FLUSH_SECONDS, runs in the flusher thread
+    :param app: the flask app the events are written with
+    :type app: Flask
+    """
+    while True:
+        time.sleep(app.config['STRAVA_EVENT_FLUSH_SECONDS'])
+        flush_event_buffer(app)
+
+
+def flush_event_buffer(app):
+    """
+    writes the buffered Strava events outside of a request
+    :param app: the flask app the events are written with
+    :type app: Flask
+    :return: the number of events written
+    :rtype: int
+    """
+    with app.app_context():
+        return flush_strava_events()
 
 
 def tell_strava_deauth(strava_athlete):
@@ -209,10 +500,9 @@ def tell_strava_deauth(strava_athlete):
     """
     access_token = refresh_access_token(user_id=strava_athlete.user_id)
 
-    url = 'https://www.strava.com/oauth/deauthorize'
     params = {'access_token': access_token}
 
-    response = requests.post(url, params=params)
+    response = strava_client.get_client().post('/oauth/deauthorize', params=params)
 
     if response.status_code == 200:
         # all okay
@@ -0,0 +1,250 @@
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# responses worth trying again, Strava is rate limiting or having problems
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# calls that can be repeated without changing the outcome, others such as creating an activity are only
+# retried when Strava can't have acted on them: it rate limited the call or the connection was never made
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# Strava's short term rate limit is reset every 15 minutes
+RATE_LIMIT_WINDOW_SECONDS = 15 * 60
+
+_client_lock = threading.Lock()
+
+# the Strava settings are read from the config once, when the app is created
+StravaSettings = namedtuple('StravaSettings', ['client_id', 'client_secret', 'client_domain', 'api_url',
+                                               'connect_timeout', 'read_timeout', 'max_retries', 'pool_size',
+                                               'token_expiry_margin'])
+
+
+class StravaClient:
+    """
+    A client for the Strava API that keeps a pool of keep-alive connections shared by all threads,
+    applies a timeout to every call and retries calls that are rate limited or fail on Strava's side
+    """
+
+    def __init__(self, base_url: str, timeout=(3.05, 10), max_retries: int = 2, backoff_factor: float = 0.5,
+                 max_backoff: float = 10, pool_size: int = 10, sleep=time.sleep, on_response=None):
+        """
+        :param base_url: scheme and host of the Strava API, e.g. https://www.strava.com
+        :type base_url: str
+        :param timeout: the connect and read timeouts in seconds
+        :type timeout: tuple
+        :param max_retries: the most times a call is retried
+        :type max_retries: int
+        :param backoff_factor: seconds to wait before the first retry, doubled for each retry after that
+        :type backoff_factor: float
+        :param max_backoff: calls that would need a longer wait are not retried but returned to the caller
+        :type max_backoff: float
+        :param pool_size: the most connections kept open to Strava
+        :type pool_size: int
+        :param sleep: waits between retries, replaced in tests
+        :type sleep: function
+        :param on_response: called with every response from Strava, e.g. to track the rate limits
+        :type on_response: function
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.on_response = on_response
+        # retries are done by request so they can take account of Strava's rate limit headers
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.mount_on(self.session)
+
+    def mount_on(self, session: requests.Session):
+        """
+        makes another session, such as an OAuth2Session, use this client's connection pool
+        :param session: the session
+        :type session: requests.Session
+        :return:
+        :rtype:
+        """
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+
+    def get_retry_delay(self, response: Optional[requests.Response], attempt: int) -> Optional[float]:
+        """
+        how long to wait before retrying a call.
+        Uses the Retry-After header if there is one, if the 15 minute rate limit has been used up
+        waits until it resets, otherwise backs off exponentially
+        :param response: the failed response, None if the call raised a connection error or timed out
+        :type response: Response
+        :param attempt: the number of retries so far
+        :type attempt: int
+        :return: the seconds to wait, None if the wait is longer than max_backoff or the daily limit is used up
+        :rtype: float
+        """
+        delay = self.backoff_factor * 2 ** attempt
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                delay = int(retry_after)
+            elif response.status_code == 429:
+                usage = parse_rate_limit(response.headers.get('X-RateLimit-Usage'))
+                limit = parse_rate_limit(response.headers.get('X-RateLimit-Limit'))
+                if usage and limit:
+                    if usage[1] >= limit[1]:
+                        return None
+                    if usage[0] >= limit[0]:
+                        delay = RATE_LIMIT_WINDOW_SECONDS - time.time() % RATE_LIMIT_WINDOW_SECONDS
+        return delay if delay <= self.max_backoff else None
+
+    def request(self, method: str, path: str, idempotent: bool = None, **kwargs) -> requests.Response:
+        """
+        calls the Strava API, retrying connection errors, timeouts, rate limiting and server errors.
+        A call that isn't idempotent is only retried if it was rate limited or couldn't connect,
+        as after a timeout or server error Strava may already have acted on it
+        :param method: the HTTP method
+        :type method: str
+        :param path: the path of the endpoint, e.g. /api/v3/activities, or a full URL
+        :type path: str
+        :param idempotent: whether the call can safely be repeated, by default whether the method is
+        :type idempotent: bool
+        :param kwargs: passed on to requests
+        :type kwargs:
+        :return: the last response from Strava
+        :rtype: Response
+        """
+        url = path if path.startswith('http') else self.base_url + path
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else (429,)
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self.get_retry_delay(None, attempt)
+                if attempt >= self.max_retries or delay is None or not (idempotent or is_connect_error(e)):
+                    raise
+            else:
+                if self.on_response:
+                    self.on_response(response)
+                if response.status_code not in retry_status_codes:
+                    return response
+                delay = self.get_retry_delay(response, attempt)
+                if attempt >= self.max_retries or delay is None:
+                    return response
+                response.close()
+            self.sleep(delay)
+            attempt += 1
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def is_connect_error(error: requests.RequestException) -> bool:
+    """
+    whether the call failed before a connection to Strava was made, so Strava can't have received it
+    :param error: the error raised by requests
+    :type error: RequestException
+    :return: True if connecting failed or timed out
+    :rtype: bool
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', error.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def may_have_reached_strava(error: requests.RequestException) -> bool:
+    """
+    whether a call that failed and isn't idempotent may still have been acted on by Strava,
+    in which case repeating it could e.g. create an activity twice
+    :param error: the error raised by requests
+    :type error: RequestException
+    :return: True if the call shouldn't be repeated
+    :rtype: bool
+    """
+    request = getattr(error, 'request', None)
+    if request is None or (request.method or '').upper() in IDEMPOTENT_METHODS:
+        return False
+    return not is_connect_error(error)
+
+
+def parse_rate_limit(header: Optional[str]):
+    """
+    parses one of Strava's rate limit headers, these are the 15 minute then the daily figure, e.g. "600,30000"
+    :param header: value of the X-RateLimit-Limit or X-RateLimit-Usage header
+    :type header: str
+    :return: the 15 minute and daily figures, None if the header is missing or malformed
+    :rtype: tuple of ints
+    """
+    try:
+        short_term, long_term = (int(value) for value in header.split(','))
+    except (AttributeError, ValueError):
+        return None
+    return short_term, long_term
+
+
+def load_settings(config) -> StravaSettings:
+    """
+    reads the Strava settings from the app's config
+    :param config: the app's config
+    :type config: Config
+    :return: the settings
+    :rtype: StravaSettings
+    """
+    return StravaSettings(client_id=config['STRAVA_CLIENT_ID'],
+                          client_secret=config['STRAVA_CLIENT_SECRET'],
+                          client_domain=config['STRAVA_CLIENT_DOMAIN'],
+                          api_url=config['STRAVA_API_URL'],
+                          connect_timeout=config['STRAVA_CONNECT_TIMEOUT'],
+                          read_timeout=config['STRAVA_READ_TIMEOUT'],
+                          max_retries=config['STRAVA_MAX_RETRIES'],
+                          pool_size=config['STRAVA_POOL_SIZE'],
+                          token_expiry_margin=config['STRAVA_TOKEN_EXPIRY_MARGIN'])
+
+
+def get_settings() -> StravaSettings:
+    """
+    returns the Strava settings loaded when the app was created
+    :return: the settings
+    :rtype: StravaSettings
+    """
+    return current_app.extensions['strava_settings']
+
+
+def get_client() -> StravaClient:
+    """
+    returns the app's Strava client, creating it from the settings on first use
+    :return: the shared client
+    :rtype: StravaClient
+    """
+    app = current_app._get_current_object()
+    client = app.extensions.get('strava_client')
+    if client is None:
+        with _client_lock:
+            client = app.extensions.get('strava_client')
+            if client is None:
+                from app.services import strava_rate_limit
+                settings = app.extensions['strava_settings']
+                client = StravaClient(settings.api_url,
+                                      timeout=(settings.connect_timeout, settings.read_timeout),
+                                      max_retries=settings.max_retries,
+                                      pool_size=settings.pool_size,
+                                      on_response=strava_rate_limit.record_response)
+                app.extensions['strava_client'] = client
+    return client
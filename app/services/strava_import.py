@@ -0,0 +1,275 @@
+import calendar
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import requests
+from authlib.common.errors import AuthlibBaseError
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import db
+from app.models import Activity, StravaAthlete, StravaImport
+from app.services import strava, strava_client, strava_rate_limit, rollup
+
+# the most activities Strava returns in a page
+MAX_PAGE_SIZE = 200
+
+
+def queue_import(user_id: int) -> StravaImport:
+    """
+    queues the import of the user's Strava history for the strava-worker.
+    If the user has been imported before only activities newer than the checkpoint are imported.
+    Does not commit, the caller commits
+    :param user_id: the user
+    :type user_id: int
+    :return: the queued import
+    :rtype: StravaImport
+    """
+    now = datetime.utcnow()
+    strava_import = StravaImport.query.get(user_id)
+    if strava_import is None:
+        strava_import = StravaImport(user_id=user_id, after=0, imported=0)
+        db.session.add(strava_import)
+    strava_import.status = StravaImport.PENDING
+    strava_import.next_attempt_at = now
+    strava_import.started = now
+    strava_import.last_updated = now
+    return strava_import
+
+
+def get_epoch(strava_time: str) -> int:
+    """
+    converts a UTC time from the Strava API, e.g. 2020-06-16T05:30:00Z, to epoch seconds
+    :param strava_time: the time
+    :type strava_time: str
+    :return: seconds since the epoch
+    :rtype: int
+    """
+    return calendar.timegm(datetime.strptime(strava_time, '%Y-%m-%dT%H:%M:%SZ').timetuple())
+
+
+def fetch_activities_page(user_id: int, after: int, page_size: int):
+    """
+    fetches the athlete's activities that started after the given time, oldest first
+    :param user_id: the user whose athlete's activities to fetch
+    :type user_id: int
+    :param after: epoch seconds
+    :type after: int
+    :param page_size: the most activities to fetch
+    :type page_size: int
+    :return: the activities as returned by the Strava API, None if they couldn't be fetched
+    :rtype: list of dicts
+    """
+    access_token = strava.refresh_access_token(user_id=user_id)
+    if access_token is None:
+        return None
+
+    headers = {'Authorization': 'Bearer {}'.format(access_token)}
+    params = {'after': after, 'per_page': page_size}
+    response = strava_client.get_client().get('/api/v3/athlete/activities', headers=headers, params=params)
+    if response.status_code != 200:
+        current_app.logger.error('Strava Status code: {}'.format(response.status_code))
+        return None
+    return response.json()
+
+
+def get_activity_mapping(user_id: int, data: dict) -> dict:
+    """
+    the column values of an activity imported from Strava, for bulk_insert_mappings
+    :param user_id: the user importing the activity
+    :type user_id: int
+    :param data: the activity from the Strava API
+    :type data: dict
+    :return: the activity's columns
+    :rtype: dict
+    """
+    activity = Activity(user_id=user_id)
+    strava.update_activity_from_strava(activity, data)
+    return {column.key: getattr(activity, column.key) for column in Activity.__table__.columns if column.key != 'id'}
+
+
+def save_activities(user_id: int, activities: List[dict]) -> int:
+    """
+    saves a page of activities from Strava in a single insert.
+    Activities that have already been imported are skipped, activities logged in LogMyExercise and
+    uploaded to Strava before their Strava id was kept are matched on their start time and type.
+    Strava keeps start times to the second, so the app's start times are matched without their microseconds
+    :param user_id: the user importing the activities
+    :type user_id: int
+    :param activities: the activities from the Strava API
+    :type activities: list of dicts
+    :return: the number of activities inserted
+    :rtype: int
+    """
+    mappings = [get_activity_mapping(user_id, data) for data in activities]
+    strava_ids = [mapping['strava_activity_id'] for mapping in mappings]
+    imported_ids = {strava_id for strava_id, in db.session.query(Activity.strava_activity_id)
+                    .filter(Activity.strava_activity_id.in_(strava_ids))}
+
+    timestamps = [mapping['timestamp'] for mapping in mappings]
+    uploaded = {(activity.timestamp.replace(microsecond=0), activity.type): activity.id for activity in
+                Activity.query.filter(Activity.user_id == user_id, Activity.strava_activity_id.is_(None),
+                                      Activity.timestamp >= min(timestamps),
+                                      Activity.timestamp < max(timestamps) + timedelta(seconds=1))}
+
+    new_mappings = []
+    links = []
+    for mapping in mappings:
+        if mapping['strava_activity_id'] in imported_ids:
+            continue
+        activity_id = uploaded.pop((mapping['timestamp'].replace(microsecond=0), mapping['type']), None)
+        if activity_id:
+            links.append({'id': activity_id, 'strava_activity_id': mapping['strava_activity_id']})
+        else:
+            new_mappings.append(mapping)
+
+    db.session.bulk_update_mappings(Activity, links)
+    db.session.bulk_insert_mappings(Activity, new_mappings)
+    return len(new_mappings)
+
+
+def claim_import(user_id: int, restart: bool = False) -> Optional[StravaImport]:
+    """
+    claims the user's import so this process runs it, creating it if the user hasn't been imported before.
+    An import that is already running is only claimed once it hasn't been updated for
+    STRAVA_IMPORT_RUNNING_TIMEOUT_SECONDS, as the worker running it must have died.
+    The import is only claimed if it is unchanged since it was read, so two workers can't both run it
+    :param user_id: the user
+    :type user_id: int
+    :param restart: whether to start again from the oldest activity rather than the checkpoint
+    :type restart: bool
+    :return: the claimed import, None if another worker is running it
+    :rtype: StravaImport
+    """
+    now = datetime.utcnow()
+    strava_import = StravaImport.query.get(user_id)
+    if strava_import is None:
+        db.session.add(StravaImport(user_id=user_id, status=StravaImport.RUNNING, after=0, imported=0,
+                                    next_attempt_at=now, started=now, last_updated=now))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another worker created it first
+            db.session.rollback()
+            return None
+        return StravaImport.query.get(user_id)
+
+    stale_before = now - timedelta(seconds=current_app.config['STRAVA_IMPORT_RUNNING_TIMEOUT_SECONDS'])
+    if strava_import.status == StravaImport.RUNNING and strava_import.last_updated >= stale_before:
+        return None
+
+    values = {StravaImport.status: StravaImport.RUNNING, StravaImport.last_updated: now}
+    if strava_import.status in (StravaImport.DONE, StravaImport.FAILED):
+        values[StravaImport.started] = now
+    if restart:
+        values[StravaImport.after] = 0
+    claimed = StravaImport.query.filter_by(user_id=user_id, status=strava_import.status,
+                                           last_updated=strava_import.last_updated) \
+        .update(values, synchronize_session=False)
+    db.session.commit()
+    return StravaImport.query.get(user_id) if claimed else None
+
+
+def run_import(strava_import: StravaImport) -> StravaImport:
+    """
+    runs a claimed import, a page at a time, each page is saved with a single insert and
+    committed along with the checkpoint. The daily rollups are rebuilt once at the end.
+    Stops early, to carry on later, if the Strava rate limits are nearly used up.
+    If Strava or the database fails part way through the import goes back to pending, to carry on from
+    the checkpoint after STRAVA_IMPORT_RETRY_SECONDS, any other error fails it
+    :param strava_import: the import claimed by this worker
+    :type strava_import: StravaImport
+    :return: the state of the import afterwards
+    :rtype: StravaImport
+    """
+    user_id = strava_import.user_id
+    page_size = min(current_app.config['STRAVA_IMPORT_BATCH_SIZE'], MAX_PAGE_SIZE)
+    try:
+        while True:
+            # the import can wait, leave what's left of the rate limits for users of the site
+            defer_until = strava_rate_limit.defer_until()
+            if defer_until:
+                strava_import.status = StravaImport.PENDING
+                strava_import.next_attempt_at = defer_until
+                break
+
+            activities = fetch_activities_page(user_id, strava_import.after, page_size)
+            if activities is None:
+                strava_import.status = StravaImport.FAILED
+                strava_import.last_error = 'Unable to fetch activities after {}'.format(strava_import.after)
+                break
+            if not activities:
+                strava_import.status = StravaImport.DONE
+                strava_import.last_error = None
+                break
+
+            strava_import.imported += save_activities(user_id, activities)
+            strava_import.after = max(get_epoch(data['start_date']) for data in activities)
+            strava_import.last_updated = datetime.utcnow()
+            db.session.commit()
+    except (requests.RequestException, SQLAlchemyError) as e:
+        # the pages committed so far are kept, the page that failed is fetched again
+        db.session.rollback()
+        current_app.logger.exception('Strava import of user {} interrupted'.format(user_id))
+        strava_import.status = StravaImport.PENDING
+        strava_import.next_attempt_at = datetime.utcnow() + \
+            timedelta(seconds=current_app.config['STRAVA_IMPORT_RETRY_SECONDS'])
+        strava_import.last_error = 'Import interrupted: {!r}'.format(e)[:200]
+    except (AuthlibBaseError, KeyError, ValueError) as e:
+        db.session.rollback()
+        current_app.logger.exception('Strava import of user {} failed'.format(user_id))
+        strava_import.status = StravaImport.FAILED
+        strava_import.last_error = 'Import failed: {!r}'.format(e)[:200]
+
+    strava_import.last_updated = datetime.utcnow()
+    db.session.commit()
+    # the activities were inserted without updating the rollups
+    rollup.rebuild_rollups(user_id)
+    return strava_import
+
+
+def import_activities(user_id: int, restart: bool = False) -> Optional[StravaImport]:
+    """
+    claims and runs the user's import straight away, carrying on from the checkpoint
+    :param user_id: the user
+    :type user_id: int
+    :param restart: whether to start again from the oldest activity rather than the checkpoint
+    :type restart: bool
+    :return: the state of the import afterwards, None if another worker is already running it
+    :rtype: StravaImport
+    """
+    strava_import = claim_import(user_id, restart)
+    if strava_import is None:
+        return None
+    return run_import(strava_import)
+
+
+def run_pending() -> int:
+    """
+    claims and runs the imports that are due, one at a time, along with running imports
+    that haven't been updated for STRAVA_IMPORT_RUNNING_TIMEOUT_SECONDS
+    :return: the number of imports run
+    :rtype: int
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config['STRAVA_IMPORT_RUNNING_TIMEOUT_SECONDS'])
+    due_imports = StravaImport.query.filter(or_(and_(StravaImport.status == StravaImport.PENDING,
+                                                     StravaImport.next_attempt_at <= now),
+                                                and_(StravaImport.status == StravaImport.RUNNING,
+                                                     StravaImport.last_updated < stale_before))).all()
+    number_run = 0
+    for due_import in due_imports:
+        user_id = due_import.user_id
+        # only one worker gets to run each import
+        strava_import = claim_import(user_id)
+        if strava_import is None:
+            continue
+        if StravaAthlete.query.filter_by(user_id=user_id, is_active=1).first() is None:
+            strava_import.status = StravaImport.FAILED
+            strava_import.last_error = 'Not connected to Strava'
+            db.session.commit()
+            continue
+        run_import(strava_import)
+        number_run += 1
+    return number_run
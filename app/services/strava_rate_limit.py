@@ -0,0 +1,149 @@
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import db
+from app.models import StravaRateLimit
+from app.services.strava_client import parse_rate_limit, RATE_LIMIT_WINDOW_SECONDS
+
+# the single row holding the app's usage
+RATE_LIMIT_ID = 1
+
+# when this process last wrote the usage
+_last_recorded = [None]
+_last_recorded_lock = threading.Lock()
+
+
+def get_window_start(now: datetime) -> datetime:
+    """
+    returns the start of the 15 minute rate limit window now falls in, Strava resets them on the quarter hour
+    :param now: a UTC time
+    :type now: datetime
+    :return: the start of its window
+    :rtype: datetime
+    """
+    return now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+
+
+def is_due(now: datetime, remaining: float) -> bool:
+    """
+    whether this process should write the usage now. Writes are spaced STRAVA_RATE_LIMIT_RECORD_SECONDS apart
+    so every call to Strava isn't a write to the same row, but are always made in a new 15 minute window
+    or once the limits are close to being used up, when the usage decides whether calls are put off
+    :param now: when the response was received
+    :type now: datetime
+    :param remaining: the smaller share of the 15 minute and daily limits left
+    :type remaining: float
+    :return: True if the usage should be written
+    :rtype: bool
+    """
+    interval = timedelta(seconds=current_app.config['STRAVA_RATE_LIMIT_RECORD_SECONDS'])
+    with _last_recorded_lock:
+        last_recorded = _last_recorded[0]
+        if last_recorded is not None and get_window_start(last_recorded) == get_window_start(now) and \
+                now - last_recorded < interval and \
+                remaining > 2 * current_app.config['STRAVA_RATE_LIMIT_RESERVE']:
+            return False
+        _last_recorded[0] = now
+        return True
+
+
+def record_response(response, now: datetime = None) -> bool:
+    """
+    stores the usage from the rate limit headers of a response from Strava so every process sees it.
+    Strava returns the usage so far, so the latest response overwrites the previous one.
+    Called by the Strava client with every response, so the usage is written on its own connection
+    rather than committing whatever the caller has pending in the session. Failing to write it, e.g. as the
+    caller's session holds SQLite's write lock, is only logged, the call to Strava has already been made
+    and must not look as if it failed
+    :param response: a response from Strava
+    :type response: Response
+    :param now: when the response was received, defaults to now
+    :type now: datetime
+    :return: True if the usage was written
+    :rtype: bool
+    """
+    limit = parse_rate_limit(response.headers.get('X-RateLimit-Limit'))
+    usage = parse_rate_limit(response.headers.get('X-RateLimit-Usage'))
+    if not limit or not usage:
+        return False
+
+    now = now or datetime.utcnow()
+    remaining = min((limit[0] - usage[0]) / limit[0] if limit[0] else 0,
+                    (limit[1] - usage[1]) / limit[1] if limit[1] else 0)
+    if response.status_code != 429 and not is_due(now, remaining):
+        return False
+
+    values = {'short_limit': limit[0], 'short_usage': usage[0], 'long_limit': limit[1], 'long_usage': usage[1],
+              'window_start': get_window_start(now), 'last_updated': now}
+    table = StravaRateLimit.__table__
+    update = table.update().where(table.c.id == RATE_LIMIT_ID).values(**values)
+    try:
+        try:
+            with db.engine.begin() as connection:
+                if not connection.execute(update).rowcount:
+                    connection.execute(table.insert().values(id=RATE_LIMIT_ID, **values))
+        except IntegrityError:
+            # another process wrote the first usage at the same time
+            with db.engine.begin() as connection:
+                connection.execute(update)
+    except SQLAlchemyError as e:
+        current_app.logger.warning('Unable to record the Strava rate limit usage: {}'.format(e))
+        # the next response writes it instead
+        with _last_recorded_lock:
+            _last_recorded[0] = None
+        return False
+    return True
+
+
+def get_budget(now: datetime = None) -> dict:
+    """
+    returns the app's current usage of its Strava rate limits.
+    Usage recorded in an earlier 15 minute window or on an earlier day has since been reset by Strava
+    :param now: the time to work out the budget at, defaults to now
+    :type now: datetime
+    :return: the limits, usage and remaining calls for the 15 minute window and the day,
+    None if nothing has been recorded yet
+    :rtype: dict
+    """
+    rate_limit = StravaRateLimit.query.get(RATE_LIMIT_ID)
+    if rate_limit is None:
+        return None
+
+    now = now or datetime.utcnow()
+    window_start = get_window_start(now)
+    short_usage = rate_limit.short_usage if rate_limit.window_start == window_start else 0
+    long_usage = rate_limit.long_usage if rate_limit.window_start.date() == now.date() else 0
+    return {'short_limit': rate_limit.short_limit,
+            'short_usage': short_usage,
+            'short_remaining': max(rate_limit.short_limit - short_usage, 0),
+            'long_limit': rate_limit.long_limit,
+            'long_usage': long_usage,
+            'long_remaining': max(rate_limit.long_limit - long_usage, 0),
+            'window_start': window_start.isoformat(),
+            'last_updated': rate_limit.last_updated.isoformat()}
+
+
+def defer_until(now: datetime = None):
+    """
+    whether a call to Strava that can wait, such as a queued upload, should be put off.
+    STRAVA_RATE_LIMIT_RESERVE of each limit is kept back for calls made while a user waits
+    :param now: the time of the call, defaults to now
+    :type now: datetime
+    :return: when the call can be made, None if it can be made now
+    :rtype: datetime
+    """
+    now = now or datetime.utcnow()
+    budget = get_budget(now)
+    if budget is None:
+        return None
+
+    reserve = current_app.config['STRAVA_RATE_LIMIT_RESERVE']
+    if budget['long_remaining'] <= budget['long_limit'] * reserve:
+        # the daily limit resets at midnight UTC
+        return datetime(now.year, now.month, now.day) + timedelta(days=1)
+    if budget['short_remaining'] <= budget['short_limit'] * reserve:
+        return get_window_start(now) + timedelta(seconds=RATE_LIMIT_WINDOW_SECONDS)
+    return None
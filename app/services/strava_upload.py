@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+from typing import List
+
+import requests
+from authlib.common.errors import AuthlibBaseError
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models import Activity, StravaUploadJob
+from app.services import strava, strava_client, strava_rate_limit
+
+
+def enqueue_upload(activity: Activity) -> StravaUploadJob:
+    """
+    queues the activity to be uploaded to Strava by the strava-worker.
+    Does not commit, the caller commits along with the activity itself so the job
+    is only there if the activity is
+    :param activity: the activity being saved, flushed so it has an id
+    :type activity: Activity
+    :return: the queued job
+    :rtype: StravaUploadJob
+    """
+    now = datetime.utcnow()
+    job = StravaUploadJob(activity_id=activity.id, user_id=activity.user_id, status=StravaUploadJob.PENDING,
+                          attempts=0, next_attempt_at=now, created=now, last_updated=now)
+    db.session.add(job)
+    return job
+
+
+def calc_backoff(attempts: int) -> timedelta:
+    """
+    how long to wait before trying a failed upload again, doubling with every attempt
+    :param attempts: the number of attempts made so far
+    :type attempts: int
+    :return: the delay before the next attempt
+    :rtype: timedelta
+    """
+    base = current_app.config['STRAVA_UPLOAD_BACKOFF_SECONDS']
+    maximum = current_app.config['STRAVA_UPLOAD_MAX_BACKOFF_SECONDS']
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), maximum))
+
+
+def claim_due_jobs(limit: int = 10) -> List[StravaUploadJob]:
+    """
+    claims up to limit pending jobs that are due to be attempted.
+    A job is only claimed if it is unchanged since it was read when it is marked as running
+    so several workers can drain the queue without uploading an activity twice.
+    Running jobs that haven't been updated for STRAVA_UPLOAD_RUNNING_TIMEOUT_SECONDS belong to a worker
+    that died, possibly after Strava created the activity, so they are failed rather than uploaded again
+    :param limit: the most jobs to claim
+    :type limit: int
+    :return: the jobs claimed by this worker
+    :rtype: list of StravaUploadJob
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config['STRAVA_UPLOAD_RUNNING_TIMEOUT_SECONDS'])
+    interrupted = StravaUploadJob.query.filter(StravaUploadJob.status == StravaUploadJob.RUNNING,
+                                               StravaUploadJob.last_updated < stale_before) \
+        .update({StravaUploadJob.status: StravaUploadJob.FAILED,
+                 StravaUploadJob.last_error: 'Upload interrupted, the activity may already be on Strava',
+                 StravaUploadJob.last_updated: now}, synchronize_session=False)
+    if interrupted:
+        current_app.logger.error('Failed {} interrupted Strava uploads'.format(interrupted))
+
+    due_jobs = StravaUploadJob.query.filter(StravaUploadJob.status == StravaUploadJob.PENDING,
+                                            StravaUploadJob.next_attempt_at <= now) \
+        .order_by(StravaUploadJob.next_attempt_at).limit(limit).all()
+
+    claimed = []
+    for job in due_jobs:
+        updated = StravaUploadJob.query.filter_by(id=job.id, status=job.status, last_updated=job.last_updated) \
+            .update({StravaUploadJob.status: StravaUploadJob.RUNNING, StravaUploadJob.last_updated: now},
+                    synchronize_session=False)
+        if updated:
+            claimed.append(job)
+    db.session.commit()
+    return claimed
+
+
+def process_job(job: StravaUploadJob) -> str:
+    """
+    uploads the job's activity to Strava, unless the rate limits are nearly used up when it's put off
+    until they reset.
+    Network errors, rate limiting and server errors are retried with an exponential backoff, apart from
+    errors after the upload may have reached Strava
+    until STRAVA_UPLOAD_MAX_ATTEMPTS is reached, as are failures to refresh the access token and database errors
+    once the upload's unit of work has been rolled back. Any other error from Strava fails the job straight away
+    :param job: a job claimed by this worker
+    :type job: StravaUploadJob
+    :return: the status of the job afterwards
+    :rtype: str
+    """
+    # uploads can wait, leave what's left of the rate limits for users of the site
+    defer_until = strava_rate_limit.defer_until()
+    if defer_until:
+        job.status = StravaUploadJob.PENDING
+        job.next_attempt_at = defer_until
+        job.last_updated = datetime.utcnow()
+        db.session.commit()
+        return job.status
+
+    attempts = (job.attempts or 0) + 1
+    job.attempts = attempts
+    try:
+        status_code = strava.create_activity(job.activity_id)
+        error = None if 200 <= status_code < 300 else 'Strava status code {}'.format(status_code)
+        retry = status_code == 429 or status_code >= 500
+    except requests.RequestException as e:
+        error = 'Strava request failed: {}'.format(e)[:200]
+        # a timed out upload may still have created the activity, trying again could create it twice
+        retry = not strava_client.may_have_reached_strava(e)
+    except (AuthlibBaseError, SQLAlchemyError, KeyError, ValueError) as e:
+        # whatever the upload left in the session can't be committed, the attempt is counted again afterwards
+        db.session.rollback()
+        job.attempts = attempts
+        error = 'Upload failed: {!r}'.format(e)[:200]
+        retry = True
+        current_app.logger.exception('Error uploading activity {} to Strava'.format(job.activity_id))
+
+    now = datetime.utcnow()
+    if error is None:
+        job.status = StravaUploadJob.DONE
+        job.last_error = None
+    elif retry and job.attempts < current_app.config['STRAVA_UPLOAD_MAX_ATTEMPTS']:
+        job.status = StravaUploadJob.PENDING
+        job.next_attempt_at = now + calc_backoff(job.attempts)
+        job.last_error = error
+    else:
+        job.status = StravaUploadJob.FAILED
+        job.last_error = error
+        current_app.logger.error('Giving up uploading activity {} to Strava: {}'.format(job.activity_id, error))
+    job.last_updated = now
+    db.session.commit()
+    return job.status
+
+
+def run_pending(limit: int = 10) -> int:
+    """
+    claims and processes a batch of due jobs
+    :param limit: the most jobs to process
+    :type limit: int
+    :return: the number of jobs processed
+    :rtype: int
+    """
+    jobs = claim_due_jobs(limit)
+    for job in jobs:
+        process_job(job)
+    return len(jobs)
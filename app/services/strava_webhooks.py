@@ -0,0 +1,188 @@
+import json
+from datetime import datetime
+from typing import List
+
+import requests
+from authlib.common.errors import AuthlibBaseError
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import db
+from app.models import StravaWebhookEvent, StravaAthlete
+from app.services import strava
+from app.services.strava_upload import calc_backoff
+
+
+def to_int(value):
+    """
+    converts an id or timestamp sent by Strava to an int
+    :param value: the value sent
+    :type value: int or str
+    :return: the value as an int, None if missing or not a number
+    :rtype: int
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def receive_event(data: dict) -> bool:
+    """
+    stores an event pushed to the webhook, to be processed later by the strava-worker.
+    An event Strava has already sent is ignored
+    :param data: the event's json
+    :type data: dict
+    :return: True if the event was stored, False if it's a duplicate
+    :rtype: bool
+    """
+    now = datetime.utcnow()
+    event = StravaWebhookEvent(subscription_id=str(data.get('subscription_id')),
+                               object_type=data.get('object_type'),
+                               object_id=to_int(data.get('object_id')),
+                               aspect_type=data.get('aspect_type'),
+                               owner_id=to_int(data.get('owner_id')),
+                               event_time=to_int(data.get('event_time')),
+                               payload=json.dumps(data),
+                               status=StravaWebhookEvent.PENDING,
+                               received=now,
+                               attempts=0,
+                               next_attempt_at=now)
+    db.session.add(event)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        current_app.logger.info('Ignoring duplicate Strava event {}'.format(data))
+        return False
+    return True
+
+
+def claim_pending_events(limit: int = 10) -> List[StravaWebhookEvent]:
+    """
+    claims up to limit events waiting to be processed that are due to be attempted, oldest first.
+    An event is only claimed if it is still pending when it is marked as running
+    so several workers can process the inbox without handling an event twice
+    :param limit: the most events to claim
+    :type limit: int
+    :return: the events claimed by this worker
+    :rtype: list of StravaWebhookEvent
+    """
+    pending_events = StravaWebhookEvent.query.filter(StravaWebhookEvent.status == StravaWebhookEvent.PENDING,
+                                                     StravaWebhookEvent.next_attempt_at <= datetime.utcnow()) \
+        .order_by(StravaWebhookEvent.id).limit(limit).all()
+
+    claimed = []
+    for event in pending_events:
+        updated = StravaWebhookEvent.query.filter_by(id=event.id, status=StravaWebhookEvent.PENDING) \
+            .update({StravaWebhookEvent.status: StravaWebhookEvent.RUNNING}, synchronize_session=False)
+        if updated:
+            claimed.append(event)
+    db.session.commit()
+    return claimed
+
+
+def handle_athlete_event(event: StravaWebhookEvent, data: dict) -> bool:
+    """
+    handles an athlete event, we only care about the athlete deauthorizing the app
+    :param event: the stored event
+    :type event: StravaWebhookEvent
+    :param data: the event's json
+    :type data: dict
+    :return: True if the event was handled
+    :rtype: bool
+    """
+    updates = data.get('updates')
+    if updates and updates.get('authorized') == 'false':
+        # athlete has deauthorized the app
+        if not strava.deauthorize_athlete(event.owner_id):
+            current_app.logger.error('Unable to deauthorize athlete')
+        return True
+
+    # return something about badly formed response from Strava
+    current_app.logger.error('Strava error deauthorizing athlete: {}'.format(data))
+    return False
+
+
+def handle_activity_event(event: StravaWebhookEvent, data: dict) -> bool:
+    """
+    keeps the athlete's activities in step with Strava, only the activity in the event is fetched
+    :param event: the stored event
+    :type event: StravaWebhookEvent
+    :param data: the event's json
+    :type data: dict
+    :return: True if the event was handled
+    :rtype: bool
+    """
+    if event.aspect_type == 'delete':
+        strava.delete_strava_activity(event.object_id)
+        return True
+
+    strava_athlete = StravaAthlete.query.filter_by(athlete_id=event.owner_id, is_active=1).first()
+    if strava_athlete is None:
+        current_app.logger.info('Ignoring Strava event for unknown or inactive athlete {}'.format(event.owner_id))
+        return True
+
+    if event.aspect_type in ('create', 'update'):
+        return strava.upsert_strava_activity(strava_athlete, event.object_id) is not None
+
+    current_app.logger.error('Unknown Strava activity event: {}'.format(data))
+    return False
+
+
+def process_event(event: StravaWebhookEvent) -> str:
+    """
+    processes a claimed event.
+    An event that fails because Strava is rate limiting or unavailable, the access token couldn't be refreshed
+    or the database had a problem is tried again with an exponential backoff until STRAVA_WEBHOOK_MAX_ATTEMPTS
+    is reached, an event that can't be handled, such as one for an activity Strava no longer has, fails straight away
+    :param event: the event
+    :type event: StravaWebhookEvent
+    :return: the status of the event afterwards
+    :rtype: str
+    """
+    data = json.loads(event.payload)
+    attempts = (event.attempts or 0) + 1
+    error = None
+    try:
+        if event.object_type == 'athlete':
+            handled = handle_athlete_event(event, data)
+        elif event.object_type == 'activity':
+            handled = handle_activity_event(event, data)
+        else:
+            current_app.logger.info('Ignoring Strava event {}'.format(data))
+            handled = True
+    except (requests.RequestException, AuthlibBaseError, SQLAlchemyError) as e:
+        db.session.rollback()
+        current_app.logger.exception('Failed to process Strava event {}'.format(event.id))
+        handled = False
+        error = 'Processing failed: {!r}'.format(e)[:200]
+
+    now = datetime.utcnow()
+    event.attempts = attempts
+    event.last_error = error
+    if handled:
+        event.status = StravaWebhookEvent.DONE
+        event.processed = now
+    elif error and attempts < current_app.config['STRAVA_WEBHOOK_MAX_ATTEMPTS']:
+        event.status = StravaWebhookEvent.PENDING
+        event.next_attempt_at = now + calc_backoff(attempts)
+    else:
+        event.status = StravaWebhookEvent.FAILED
+        event.processed = now
+    db.session.commit()
+    return event.status
+
+
+def run_pending(limit: int = 10) -> int:
+    """
+    claims and processes a batch of webhook events
+    :param limit: the most events to process
+    :type limit: int
+    :return: the number of events processed
+    :rtype: int
+    """
+    events = claim_pending_events(limit)
+    for event in events:
+        process_event(event)
+    return len(events)
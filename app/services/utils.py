@@ -2,12 +2,36 @@ import json
 import os
 import uuid
 from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, List
 
 import pytz
+from flask import current_app, stream_with_context, Response
 
 from app.services import aws
 
 
+# the most timezones whose lookup is remembered
+TIMEZONE_CACHE_SIZE = 512
+
+
+@lru_cache(maxsize=TIMEZONE_CACHE_SIZE)
+def get_timezone(user_tz='UTC'):
+    """
+    returns the timezone with the provided name, falling back to UTC if it isn't a valid timezone.
+    The result is remembered, including the fallback, so each name is only looked up once
+    :param user_tz: name of the timezone, e.g. Europe/London
+    :type user_tz: str
+    :return: the timezone
+    :rtype: tzinfo
+    """
+    try:
+        # check the timezone provided is valid
+        return pytz.timezone(user_tz)
+    except pytz.exceptions.UnknownTimeZoneError:
+        return pytz.utc
+
+
 def localize_local_time(user_datetime: datetime, user_tz='UTC'):
     """
     localises the provided time into the provided timezone
@@ -18,15 +42,7 @@ def localize_local_time(user_datetime: datetime, user_tz='UTC'):
     :return: the localized datetime
     :rtype: datetime
     """
-    local_tz = pytz.timezone('UTC')
-    try:
-        # check the timezone provided is valid
-        local_tz = pytz.timezone(user_tz)
-    except pytz.exceptions.UnknownTimeZoneError:
-        pass
-
-    local_dt = local_tz.localize(user_datetime)
-    return local_dt
+    return get_timezone(user_tz).localize(user_datetime)
 
 
 def get_utc_from_local_time(user_datetime: datetime, user_tz='UTC'):
@@ -39,16 +55,7 @@ def get_utc_from_local_time(user_datetime: datetime, user_tz='UTC'):
     :return: a datetime in UTC
     :rtype: Datetime
     """
-    local_tz = pytz.timezone('UTC')
-    try:
-        # check the timezone provided is valid
-        local_tz = pytz.timezone(user_tz)
-    except pytz.exceptions.UnknownTimeZoneError:
-        pass
-
-    local_dt = local_tz.localize(user_datetime)
-    utc_dt = local_dt.astimezone(pytz.utc)
-    return utc_dt
+    return get_timezone(user_tz).localize(user_datetime).astimezone(pytz.utc)
 
 
 def get_local_time_from_utc(user_datetime: datetime, user_tz='UTC'):
@@ -61,18 +68,50 @@ def get_local_time_from_utc(user_datetime: datetime, user_tz='UTC'):
     :return: a datetime in user's local time
     :rtype: Datetime
     """
-    local_tz = pytz.timezone('UTC')
-    try:
-        # check the timezone provided is valid
-        local_tz = pytz.timezone(user_tz)
-    except pytz.exceptions.UnknownTimeZoneError:
-        pass
+    return pytz.utc.localize(user_datetime).astimezone(get_timezone(user_tz))
+
+
+def localize_local_times(user_datetimes: Iterable[datetime], user_tz='UTC') -> List[datetime]:
+    """
+    localises all of the provided times into the provided timezone, which is only looked up once
+    :param user_datetimes: datetimes to localise
+    :type user_datetimes: iterable of datetime
+    :param user_tz: timezone to localize into
+    :type user_tz: str
+    :return: the localized datetimes in the same order
+    :rtype: list of datetime
+    """
+    localize = get_timezone(user_tz).localize
+    return [localize(user_datetime) for user_datetime in user_datetimes]
+
+
+def get_utc_from_local_times(user_datetimes: Iterable[datetime], user_tz='UTC') -> List[datetime]:
+    """
+    Converts datetimes from the user's TZ into UTC datetimes, the timezone is only looked up once
+    :param user_datetimes: the datetimes in the user's TZ
+    :type user_datetimes: iterable of datetime
+    :param user_tz: the user's Timezone
+    :type user_tz: str
+    :return: the datetimes in UTC in the same order
+    :rtype: list of datetime
+    """
+    localize = get_timezone(user_tz).localize
+    return [localize(user_datetime).astimezone(pytz.utc) for user_datetime in user_datetimes]
 
-    utc_tz = pytz.timezone('UTC')
-    utc_date = utc_tz.localize(user_datetime)
-    local_dt = utc_date.astimezone(local_tz)
 
-    return local_dt
+def get_local_times_from_utc(user_datetimes: Iterable[datetime], user_tz='UTC') -> List[datetime]:
+    """
+    Converts datetimes from UTC into the user's timezone, the timezone is only looked up once
+    :param user_datetimes: the datetimes in UTC
+    :type user_datetimes: iterable of datetime
+    :param user_tz: the user's Timezone
+    :type user_tz: str
+    :return: the datetimes in the user's local time in the same order
+    :rtype: list of datetime
+    """
+    local_tz = get_timezone(user_tz)
+    utc_localize = pytz.utc.localize
+    return [utc_localize(user_datetime).astimezone(local_tz) for user_datetime in user_datetimes]
 
 
 def get_iso_from_local_time(user_datetime: datetime):
@@ -137,4 +176,20 @@ def get_os_env(default, key):
     :return: the value of the environment variable if it exists, otherwise the provided default value
     :rtype:
     """
-    return os.getenv(key, default)
\ No newline at end of file
+    return os.getenv(key, default)
+
+
+def stream_template(template_name, **context):
+    """
+    renders a template as a stream so the page is sent to the browser as it is rendered
+    rather than being built up in memory first
+    :param template_name: the template to render
+    :type template_name: str
+    :param context: variables to make available inside the template
+    :type context: keyword arguments
+    :return: a streamed response
+    :rtype: Response
+    """
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    return Response(stream_with_context(template.stream(context)))
@@ -0,0 +1,120 @@
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Tuple
+
+import pytz
+
+from app.services import utils
+
+# the calendar of each timezone for the current day there
+MAX_CALENDARS = 1024
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def get_utc_midnight(user_tz: str, local_date: date) -> datetime:
+    """
+    returns the naive UTC time at which the local date starts in the timezone
+    :param user_tz: name of the timezone
+    :type user_tz: str
+    :param local_date: the date
+    :type local_date: date
+    :return: midnight at the start of the date, in UTC
+    :rtype: datetime
+    """
+    return utils.get_timezone(user_tz).localize(datetime.combine(local_date, time.min)) \
+        .astimezone(pytz.utc).replace(tzinfo=None)
+
+
+class WeekCalendar:
+    """
+    The weeks around a date in a timezone. Any week before or after it is found with date arithmetic
+    from the start of the date's week, so building a calendar is the only timezone work
+    """
+
+    def __init__(self, today: date, user_tz: str = 'UTC', starts: datetime = None, expires: datetime = None):
+        """
+        :param today: the date the calendar is for
+        :type today: date
+        :param user_tz: name of the timezone
+        :type user_tz: str
+        :param starts: the naive UTC time the date starts at in the timezone, None if it's always current
+        :type starts: datetime
+        :param expires: the naive UTC time the date ends at in the timezone, None if it's always current
+        :type expires: datetime
+        """
+        self.today = today
+        self.user_tz = user_tz
+        self.starts = starts
+        self.expires = expires
+        self.start_current_week = today - timedelta(days=today.weekday())
+
+    def start_week(self, week_offset: int = 0) -> date:
+        """
+        returns the Monday of the week week_offset weeks before the current week
+        :param week_offset: number of weeks before the current week
+        :type week_offset: int
+        :return: the date the week starts on
+        :rtype: date
+        """
+        return self.start_current_week - timedelta(days=7 * week_offset)
+
+    def bookends(self, week_offset: int = 0) -> Tuple[date, date, date]:
+        """
+        returns the day before the week, its first day and its last day, as charting.get_week_bookends does
+        :param week_offset: number of weeks before the current week
+        :type week_offset: int
+        :return: (start_date-1, start_date, end date)
+        :rtype: tuple of dates
+        """
+        start_week = self.start_week(week_offset)
+        return start_week - timedelta(days=1), start_week, start_week + timedelta(days=6)
+
+    def weeks_bookends(self, number_weeks: int = 12) -> Tuple[date, date, date]:
+        """
+        returns the window of number_weeks weeks ending with the current week,
+        as charting.get_12_week_bookends does for 12 weeks
+        :param number_weeks: how many weeks before the current week the window starts
+        :type number_weeks: int
+        :return: (start_historic_week_date_day_before, start_historic_week_date, start_current_week_date)
+        :rtype: tuple of dates
+        """
+        start_historic_week = self.start_week(number_weeks)
+        return start_historic_week - timedelta(days=1), start_historic_week, self.start_current_week
+
+    def is_current(self, now: datetime) -> bool:
+        """
+        :param now: the current naive UTC time
+        :type now: datetime
+        :return: True if it's still the calendar's date in its timezone
+        :rtype: bool
+        """
+        if self.starts is None or self.expires is None:
+            return True
+        return self.starts <= now < self.expires
+
+
+def get_calendar(user_tz: str = 'UTC', now: datetime = None) -> WeekCalendar:
+    """
+    returns the calendar for the current date in the timezone. A calendar is built once per timezone
+    and kept until midnight there, so most calls don't need to work with timezones at all
+    :param user_tz: name of the timezone
+    :type user_tz: str
+    :param now: the current naive UTC time, defaults to now
+    :type now: datetime
+    :return: the calendar
+    :rtype: WeekCalendar
+    """
+    now = now or datetime.utcnow()
+    calendar = _calendars.get(user_tz)
+    if calendar is not None and calendar.is_current(now):
+        return calendar
+
+    today = pytz.utc.localize(now).astimezone(utils.get_timezone(user_tz)).date()
+    calendar = WeekCalendar(today, user_tz, get_utc_midnight(user_tz, today),
+                            get_utc_midnight(user_tz, today + timedelta(days=1)))
+    with _calendars_lock:
+        if len(_calendars) >= MAX_CALENDARS:
+            _calendars.clear()
+        _calendars[user_tz] = calendar
+    return calendar
@@ -1,7 +1,6 @@
 from flask import render_template, flash, redirect, url_for
 from flask_login import current_user
 
-from app.models import User
 from app.services import utils
 from app.support import bp
 from app.support.forms import FeedbackForm
@@ -19,8 +18,7 @@ def contact_us():
 
     if current_user.is_authenticated:
         # can set the name and email on the form
-        u = User.query.filter_by(id=current_user.get_id()).first()
-        form.email.data = u.email
-        form.name.data = u.username
+        form.email.data = current_user.email
+        form.name.data = current_user.username
 
     return render_template('support/contact_us.html', title='Contact Us', form=form)
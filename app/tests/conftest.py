@@ -1,5 +1,8 @@
 import json
+import threading
+import time
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import flask
 import pytest
@@ -9,7 +12,8 @@ from flask_wtf.csrf import generate_csrf
 
 from app import create_app, db
 from app.models import User, RegularActivity, Goal, Inspiration, MyInspirationLikes
-from app.services import strava as ss
+from app.services import strava as ss, strava_rate_limit
+from app.services.strava_client import StravaClient
 
 # define some test data to be used in tests
 TEST_USER_USERNAME = 'test_user'
@@ -160,6 +164,10 @@ def init_database():
     """
     db.drop_all()
     db.create_all()
+    # the database is new so anything cached from the last test is stale
+    for cache_name in ('identity_cache', 'integration_cache'):
+        if cache_name in flask.current_app.extensions:
+            flask.current_app.extensions[cache_name].clear()
     user = User(username=TEST_USER_USERNAME, email=TEST_USER_EMAIL)
     user.set_password(TEST_USER_PASSWORD)
     db.session.add(user)
@@ -275,6 +283,142 @@ def add_inspiration():
                               user_id=u.id)
 
     db.session.add(inspiration)
+    db.session.flush()
     likes_inspiration = MyInspirationLikes(user_id=u.id, inspiration_id=inspiration.id)
     db.session.add(likes_inspiration)
     db.session.commit()
+
+
+class FakeStrava(ThreadingHTTPServer):
+    """
+    a local stand-in for the Strava API. Replies with the queued responses in order,
+    or 200 with an empty JSON object once they run out, and records each request it receives
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeStravaHandler)
+        self.responses = []
+        self.requests = []
+        self.connections = set()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def add_response(self, status=200, body=None, headers=None):
+        self.responses.append((status, body or {}, headers or {}))
+
+
+class FakeStravaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.server.requests.append((self.command, self.path, dict(self.headers), self.rfile.read(length)))
+        self.server.connections.add(self.client_address)
+        status, body, headers = self.server.responses.pop(0) if self.server.responses else (200, {}, {})
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = handle_request
+    do_POST = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='function')
+def fake_strava():
+    """
+    points the app's Strava client at a local fake Strava server, retries happen without waiting
+    """
+    server = FakeStrava()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    app = flask.current_app
+    previous_client = app.extensions.get('strava_client')
+    app.extensions['strava_client'] = StravaClient(server.url, timeout=(1, 2), sleep=lambda seconds: None,
+                                                   on_response=strava_rate_limit.record_response)
+
+    yield server
+
+    app.extensions['strava_client'].close()
+    app.extensions['strava_client'] = previous_client
+    server.shutdown()
+    server.server_close()
+
+
+class FakeSite(ThreadingHTTPServer):
+    """
+    a local web site serving the pages added to it, 404 for any other path.
+    Keeps count of the requests it receives and the most it has handled at once
+    """
+
+    def __init__(self, delay=0):
+        super().__init__(('127.0.0.1', 0), FakeSiteHandler)
+        self.pages = {}
+        self.delay = delay
+        self.requests = []
+        self.active = 0
+        self.most_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def add_page(self, path, html, status=200, content_type='text/html; charset=utf-8', headers=None):
+        self.pages[path] = (status, html, content_type, headers or {})
+        return self.url + path
+
+    def add_redirect(self, path, location):
+        return self.add_page(path, '', status=302, headers={'Location': location})
+
+
+class FakeSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            self.server.active += 1
+            self.server.most_active = max(self.server.most_active, self.server.active)
+        try:
+            time.sleep(self.server.delay)
+            status, html, content_type, headers = self.server.pages.get(self.path, (404, 'Not found', 'text/html', {}))
+            data = html.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='function')
+def fake_site():
+    """
+    a local web site, e.g. for the pages inspirations link to
+    """
+    server = FakeSite()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
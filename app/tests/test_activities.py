@@ -4,7 +4,11 @@ from datetime import datetime, timedelta
 
 from unittest.mock import patch
 
+import flask
+
+from app import db
 from app.models import User, Activity, RegularActivity
+from app.services import exercise_log
 from app.tests import conftest
 
 
@@ -421,3 +425,61 @@ def test_exercise_log(test_client_csrf, init_database, add_regular_activity, add
         assert response.status_code == 200
         assert "Regular Activity" in str(response.data)
         assert "23" in str(response.data)
+
+
+def add_logged_activities(user_id, number):
+    # all activities share a timestamp so paging has to use the id to break ties
+    timestamp = datetime(2020, 6, 18, 10, 30)
+    for i in range(number):
+        activity = Activity(type=1, title='Logged Activity {}'.format(i), duration=10 + i,
+                            timestamp=timestamp if i % 2 else timestamp - timedelta(days=i),
+                            user_id=user_id)
+        db.session.add(activity)
+    db.session.commit()
+
+
+def test_get_activities_page(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    add_logged_activities(u.id, 7)
+
+    seen = []
+    activities, cursor = exercise_log.get_activities_page(u.id, page_size=3)
+    seen.extend(activities)
+    while cursor:
+        activities, cursor = exercise_log.get_activities_page(u.id, cursor=cursor, page_size=3)
+        seen.extend(activities)
+
+    assert len(seen) == 7
+    assert len(set(activity.id for activity in seen)) == 7
+    expected = Activity.query.filter_by(user_id=u.id).order_by(Activity.timestamp.desc(), Activity.id).all()
+    assert [activity.id for activity in seen] == [activity.id for activity in expected]
+
+
+def test_get_activities_page_invalid_cursor(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    add_logged_activities(u.id, 2)
+
+    activities, cursor = exercise_log.get_activities_page(u.id, cursor='not a cursor', page_size=5)
+    assert len(activities) == 2
+    assert cursor is None
+
+
+def test_exercise_log_more(test_client_csrf, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    add_logged_activities(u.id, 30)
+    flask.current_app.config['ACTIVITY_LOG_PAGE_SIZE'] = 25
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+
+        response = test_client_csrf.get('/exercise_log/')
+        assert response.status_code == 200
+        assert str(response.data).count('delete_activity_link') == 25
+        assert 'load_more_link' in str(response.data)
+
+        _, cursor = exercise_log.get_activities_page(u.id, page_size=25)
+        response = test_client_csrf.get('/exercise_log/more', query_string={'cursor': cursor})
+        assert response.status_code == 200
+        assert str(response.data).count('delete_activity_link') == 5
+        assert response.headers['X-Next-Cursor'] == ''
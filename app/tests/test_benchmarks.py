@@ -0,0 +1,142 @@
+import json
+import os
+import random
+from datetime import datetime, date, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from app.models import User, Activity, Goal, DailyActivityRollup, StravaAthlete
+from app.services import charting, strava, strava_client, strava_import, utils
+from app.tests import conftest
+from config import app_config
+
+NUMBER_ACTIVITIES = 10000
+START_WEEK = date(2020, 6, 15)
+
+
+def make_activities(number, start_date, days):
+    random.seed(1)
+    activities = []
+    for i in range(number):
+        local_time = datetime(start_date.year, start_date.month, start_date.day, 7) + \
+            timedelta(days=random.randrange(days), minutes=random.randrange(600), microseconds=1)
+        activities.append(Activity(id=i, type=random.randint(1, 6), title='title', duration=random.randint(10, 90),
+                                   distance=random.randint(0, 20), timestamp=local_time,
+                                   iso_timestamp=local_time.isoformat() + '+00:00', local_date=local_time.date()))
+    return activities
+
+
+GOALS = [Goal(title='Frequency', frequency=5, frequency_activity_type=-1),
+         Goal(title='Duration', duration=300, duration_activity_type=4),
+         Goal(title='Distance', distance=50, distance_activity_type=3)]
+
+
+def test_benchmark_weekly_totals_10k_activities(benchmark):
+    # all of the activities fall in the week so every one of them is bucketed
+    activities = make_activities(NUMBER_ACTIVITIES, START_WEEK, 7)
+
+    totals = benchmark(charting.calc_weekly_totals, activities, START_WEEK)
+    assert totals[0] > 0
+
+
+def test_benchmark_goals_from_rollups(benchmark):
+    # the cost of a request using the rollups, a week is at most 7 x 6 cells whatever the history size
+    activities = make_activities(NUMBER_ACTIVITIES, START_WEEK, 7)
+    cells = {}
+    for activity in activities:
+        key = (charting.get_date_from_isotimestamp(activity.iso_timestamp, None), activity.type)
+        cell = cells.setdefault(key, DailyActivityRollup(local_date=key[0], type=key[1], count=0, duration=0,
+                                                         distance=0))
+        cell.count += 1
+        cell.duration += activity.duration
+        cell.distance += activity.distance
+    rollups = list(cells.values())
+    assert len(rollups) <= 42
+
+    percentages = benchmark(charting.compare_rollups_to_goals, GOALS, rollups, START_WEEK)
+    assert percentages == charting.compare_weekly_totals_to_goals(GOALS, activities, START_WEEK)
+
+
+TIMEZONES = ['America/Los_Angeles', 'Europe/London', 'Asia/Kolkata', 'not a timezone']
+
+
+def uncached_get_utc_from_local_time(user_datetime, user_tz='UTC'):
+    # how the conversion used to be done, looking up the timezones on every call
+    local_tz = pytz.timezone('UTC')
+    try:
+        local_tz = pytz.timezone(user_tz)
+    except pytz.exceptions.UnknownTimeZoneError:
+        pass
+    return local_tz.localize(user_datetime).astimezone(pytz.utc)
+
+
+def get_times_by_timezone():
+    times = [activity.timestamp for activity in make_activities(NUMBER_ACTIVITIES, START_WEEK, 7)]
+    return {tz: times[i::len(TIMEZONES)] for i, tz in enumerate(TIMEZONES)}
+
+
+def test_benchmark_timezone_uncached_10k(benchmark):
+    times_by_tz = get_times_by_timezone()
+
+    converted = benchmark(lambda: {tz: [uncached_get_utc_from_local_time(time, tz) for time in times]
+                                   for tz, times in times_by_tz.items()})
+    assert converted == {tz: utils.get_utc_from_local_times(times, tz) for tz, times in times_by_tz.items()}
+
+
+def test_benchmark_timezone_cached_10k(benchmark):
+    times_by_tz = get_times_by_timezone()
+
+    converted = benchmark(lambda: {tz: [utils.get_utc_from_local_time(time, tz) for time in times]
+                                   for tz, times in times_by_tz.items()})
+    assert converted == {tz: utils.get_utc_from_local_times(times, tz) for tz, times in times_by_tz.items()}
+
+
+def test_benchmark_timezone_many_10k(benchmark):
+    times_by_tz = get_times_by_timezone()
+
+    converted = benchmark(lambda: {tz: utils.get_utc_from_local_times(times, tz) for tz, times in times_by_tz.items()})
+    assert len(converted['not a timezone']) == NUMBER_ACTIVITIES / len(TIMEZONES)
+
+
+def test_benchmark_strava_settings_rebuilt(test_client, benchmark):
+    # how the token refresh used to find the Strava settings, building a new config object on every call
+    my_config = benchmark(lambda: app_config[os.getenv('FLASK_CONFIG', 'testing')]())
+    assert my_config.STRAVA_CLIENT_DOMAIN
+
+
+def test_benchmark_strava_settings_loaded_once(test_client, benchmark):
+    settings = benchmark(strava_client.get_settings)
+    assert settings.client_domain
+
+
+def test_benchmark_strava_upload(test_client, init_database, add_strava_athlete, add_activity, fake_strava, benchmark):
+    # the upload path with the token refreshed each time, Strava is stubbed by a local server
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activity_id = Activity.query.filter_by(user_id=u.id).first().id
+    expired_token = dict(json.loads(conftest.STRAVA_REFRESH_EXAMPLE), expires_at=0)
+
+    def upload():
+        StravaAthlete.query.filter_by(user_id=u.id).first().access_token_expires_at = 0
+        return strava.create_activity(activity_id)
+
+    with patch('app.services.strava.OAuth2Session') as mock_oauth:
+        mock_oauth.return_value.refresh_token.return_value = expired_token
+        assert benchmark(upload) == 200
+
+
+def test_benchmark_strava_import_5k_activities(test_client, init_database, add_strava_athlete, fake_strava,
+                                               benchmark):
+    # pages of 200 from the fake Strava server, each saved with a single insert
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    start = datetime(2010, 1, 1, 7)
+    activities = [{'id': i, 'name': 'Run', 'type': 'Run', 'elapsed_time': 1800, 'distance': 5000.0,
+                   'start_date': (start + timedelta(hours=i)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                   'start_date_local': (start + timedelta(hours=i)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                   'timezone': '(GMT+00:00) Europe/London'} for i in range(5000)]
+    for page in range(0, len(activities), strava_import.MAX_PAGE_SIZE):
+        fake_strava.add_response(200, activities[page:page + strava_import.MAX_PAGE_SIZE])
+    fake_strava.add_response(200, [])
+
+    result = benchmark.pedantic(strava_import.import_activities, args=(u.id,), rounds=1, iterations=1)
+    assert result.imported == 5000
@@ -3,7 +3,7 @@ from datetime import datetime, date
 import pytest
 
 from app.models import Activity, Goal
-from app.services import charting
+from app.services import charting, week_calendar
 
 
 def test_calc_start_week():
@@ -54,6 +54,11 @@ def test_calc_day_before_start_week_current_date():
     assert isinstance(start_week, date)
 
 
+def test_calc_day_before_start_week_user_tz():
+    calendar = week_calendar.get_calendar('Pacific/Kiritimati')
+    assert charting.get_start_week_date_before(None, 2, 'Pacific/Kiritimati') == calendar.bookends(2)[0]
+
+
 def test_calc_start_week_current_date():
     start_week = charting.get_start_week_date(None)
     assert start_week is not None
@@ -90,6 +95,11 @@ def test_get_week_bookends_offset():
     assert end_week.day == 14
 
 
+def test_get_local_today():
+    # 25 hours apart, so always on different dates
+    assert charting.get_local_today('Pacific/Kiritimati') > charting.get_local_today('Pacific/Pago_Pago')
+
+
 def test_get_date_from_isotimestamp():
     iso_date = '2020-06-18T21:58:33.302785-07:00'
 
@@ -106,6 +116,18 @@ def test_get_date_from_blank_isotimestamp():
     assert local_date.year == 2020
 
 
+def test_get_activity_local_date_stored():
+    activity = Activity(id=1, type=1, title='title', duration=25, local_date=date(2020, 6, 15),
+                        iso_timestamp='2020-06-16T21:58:33.302785-07:00')
+    # the stored local date is used over the iso timestamp
+    assert charting.get_activity_local_date(activity) == date(2020, 6, 15)
+
+
+def test_get_activity_local_date_not_stored():
+    activity = Activity(id=1, type=1, title='title', duration=25, iso_timestamp='2020-06-16T21:58:33.302785-07:00')
+    assert charting.get_activity_local_date(activity) == date(2020, 6, 16)
+
+
 def test_get_12_week_bookends():
     my_date = datetime(2020, 6, 17)
     start_date_day_before, start_historic_week, start_current_week = charting.get_12_week_bookends(my_date)
@@ -540,3 +562,37 @@ def test_compare_weekly_totals_to_goals_params(goals, activities, expected_perce
 
     percentages = charting.compare_weekly_totals_to_goals(goals, activities, start_week)
     assert percentages == expected_percentages
+
+
+def test_calc_daily_matrices():
+    start_week = date(2020, 6, 15)
+
+    activities = [Activity(id=1, type=1, title='title', duration=20,
+                           iso_timestamp='2020-06-16T04:58:33.302785+05:00'),
+                  Activity(id=2, type=4, title='title', distance=10, duration=15,
+                           iso_timestamp='2020-06-17T04:58:33.302785+05:00'),
+                  Activity(id=3, type=4, title='title', distance=2.5, duration=10,
+                           iso_timestamp='2020-06-17T19:58:33.302785+05:00'),
+                  Activity(id=4, type=3, title='title', duration=25,
+                           iso_timestamp='2020-06-22T04:58:33.302785+05:00')
+                  ]
+
+    counts, durations, distances = charting.calc_daily_matrices(activities, start_week)
+    assert counts[1] == [0, 1, 0, 0, 0, 0, 0]
+    assert counts[4] == [0, 0, 2, 0, 0, 0, 0]
+    assert counts[3] == [0, 0, 0, 0, 0, 0, 0]
+    assert durations[4] == [0, 0, 25, 0, 0, 0, 0]
+    assert distances[4] == [0, 0, 12.5, 0, 0, 0, 0]
+    assert distances[1] == [0, 0, 0, 0, 0, 0, 0]
+
+
+def test_calc_daily_matrices_matches_single_measure():
+    start_week = date(2020, 6, 15)
+    activities = [Activity(id=i, type=i % 6 + 1, title='title', duration=i, distance=i / 4,
+                           iso_timestamp='2020-06-{}T04:58:33.302785+05:00'.format(15 + i % 7))
+                  for i in range(1, 40)]
+
+    matrices = charting.calc_daily_matrices(activities, start_week)
+    assert matrices.duration == charting.calc_daily_duration_per_exercise_type(activities, start_week)
+    assert matrices.distance == charting.calc_daily_duration_per_exercise_type(activities, start_week,
+                                                                               sum_by='distance')
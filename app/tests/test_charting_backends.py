@@ -0,0 +1,80 @@
+from datetime import datetime, date
+from unittest.mock import patch
+
+import pytest
+
+from app.main import routes
+from app.models import User, Activity
+from app.services import rollup, charting
+from app.tests import conftest
+
+START_WEEK = date(2020, 6, 15)
+END_WEEK = date(2020, 6, 21)
+
+
+def save_week_of_activities(user_id):
+    activities = [
+        Activity(type=1, title='title', duration=25, timestamp=datetime(2020, 6, 15, 21, 0)),
+        Activity(type=2, title='title', duration=32, distance=3.25, timestamp=datetime(2020, 6, 17, 5, 0)),
+        Activity(type=2, title='title', duration=18, distance=0.1, timestamp=datetime(2020, 6, 17, 7, 0)),
+        Activity(type=2, title='title', duration=10, distance=0.2, timestamp=datetime(2020, 6, 17, 8, 0)),
+        Activity(type=3, title='title', duration=45, distance=12.75, timestamp=datetime(2020, 6, 21, 23, 0)),
+        # outside the week in the user's time zone
+        Activity(type=2, title='title', duration=10, timestamp=datetime(2020, 6, 14, 23, 30)),
+        Activity(type=2, title='title', duration=10, timestamp=datetime(2020, 6, 22, 1, 0)),
+    ]
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = user_id
+        current_user.return_value.get_id.return_value = user_id
+        for activity in activities:
+            activity.user_id = user_id
+            routes.save_completed_activity(activity, activity.timestamp, 'America/Los_Angeles')
+
+
+def test_query_daily_rows_groups_by_type_and_day(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_week_of_activities(u.id)
+
+    rows = sorted(charting.query_daily_rows(u.id, START_WEEK, END_WEEK))
+    assert [(activity_type, local_date, count, duration) for activity_type, local_date, count, duration, _ in rows] \
+        == [(1, date(2020, 6, 15), 1, 25), (2, date(2020, 6, 17), 3, 60), (3, date(2020, 6, 21), 1, 45)]
+    assert round(float(rows[1][4]), 2) == 3.55
+
+
+@pytest.mark.parametrize('sum_by', ['duration', 'distance'])
+def test_backends_give_same_chart_dataset(test_client, init_database, sum_by):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_week_of_activities(u.id)
+
+    activities = charting.query_activities(u.id, START_WEEK, END_WEEK)
+    expected = charting.get_chart_dataset(activities, START_WEEK, END_WEEK, sum_by)
+    assert charting.get_chart_dataset_sql(u.id, START_WEEK, END_WEEK, sum_by) == expected
+    for backend in ['rollup', 'sql', 'python']:
+        rows = rollup.get_daily_rows(u.id, START_WEEK, END_WEEK, backend)
+        assert charting.get_chart_dataset_from_rows(rows, START_WEEK, END_WEEK, sum_by) == expected
+
+
+def test_backends_give_same_weekly_totals(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_week_of_activities(u.id)
+
+    activities = charting.query_activities(u.id, START_WEEK, END_WEEK)
+    expected = charting.calc_weekly_totals(activities, START_WEEK, END_WEEK)
+    assert expected[2] == 130
+    assert charting.calc_weekly_totals_sql(u.id, START_WEEK) == expected
+    for backend in ['rollup', 'sql', 'python']:
+        rows = rollup.get_daily_rows(u.id, START_WEEK, END_WEEK, backend)
+        assert charting.calc_weekly_totals_from_rows(rows, START_WEEK, END_WEEK) == expected
+
+
+def test_exercise_log_with_sql_backend(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    test_client.application.config['CHART_AGGREGATION_BACKEND'] = 'sql'
+    try:
+        with patch('flask_login.utils._get_user') as current_user:
+            current_user.return_value.id = u.id
+            current_user.return_value.get_id.return_value = u.id
+            response = test_client.get('/exercise_log/')
+            assert response.status_code == 200
+    finally:
+        test_client.application.config['CHART_AGGREGATION_BACKEND'] = 'rollup'
@@ -0,0 +1,139 @@
+from unittest.mock import patch
+
+from app import db
+from app.models import User, Activity, RegularActivity, load_user
+from app.services import identity
+from app.services.cache import TTLCache
+from app.tests import conftest
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+
+    timer.now = 60
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_cache_drops_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_ttl_cache_delete():
+    cache = TTLCache()
+    cache.set('a', 1)
+    cache.delete('a')
+    cache.delete('missing')
+    assert cache.get('a', 'default') == 'default'
+
+
+def test_load_user_cached(test_client, init_database):
+    identity.get_cache().clear()
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+
+    snapshot = load_user(str(u.id))
+    assert (snapshot.id, snapshot.username, snapshot.email) == (u.id, u.username, u.email)
+    assert snapshot.get_id() == str(u.id)
+    assert snapshot.is_authenticated
+    assert snapshot.avatar(128) == u.avatar(128)
+
+    with patch('app.services.identity.User.query') as mock_query:
+        assert load_user(str(u.id)) is snapshot
+        assert mock_query.get.called is False
+
+
+def test_load_user_unknown(test_client, init_database):
+    assert load_user('-1') is None
+
+
+def test_invalidate_user(test_client, init_database):
+    identity.get_cache().clear()
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    load_user(str(u.id))
+
+    u.username = 'new_name'
+    db.session.commit()
+    assert load_user(str(u.id)).username == conftest.TEST_USER_USERNAME
+
+    identity.invalidate_user(u.id)
+    assert load_user(str(u.id)).username == 'new_name'
+
+
+def test_contact_us_uses_snapshot(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    snapshot = identity.get_user_snapshot(u.id)
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value = snapshot
+        with patch('app.services.identity.User.query') as mock_query:
+            response = test_client.get('/support/contact_us')
+            assert response.status_code == 200
+            assert mock_query.get.called is False
+    assert conftest.TEST_USER_EMAIL in response.data.decode()
+
+
+def test_record_timezone(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    snapshot = identity.get_user_snapshot(u.id)
+    assert identity.get_timezone_name(snapshot) == 'UTC'
+
+    assert identity.record_timezone(snapshot, 'fgfgfggf') is False
+    assert identity.record_timezone(snapshot, 'Europe/London') is True
+    # the caller invalidates the snapshot once it has committed
+    assert identity.get_user_snapshot(u.id) is snapshot
+    db.session.commit()
+    identity.invalidate_user(u.id)
+
+    snapshot = identity.get_user_snapshot(u.id)
+    assert snapshot.timezone == 'Europe/London'
+    assert identity.get_timezone_name(snapshot) == 'Europe/London'
+    # already stored so not written again
+    assert identity.record_timezone(snapshot, 'Europe/London') is False
+
+
+def test_log_activity_records_timezone(test_client, init_database, add_regular_activity):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    regular_activity = RegularActivity.query.filter_by(user_id=u.id).first()
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value = identity.get_user_snapshot(u.id)
+        response = test_client.get('/log_activity/{}?tz=Asia/Kolkata'.format(regular_activity.id))
+        assert response.status_code == 302
+
+        assert User.query.get(u.id).timezone == 'Asia/Kolkata'
+        current_user.return_value = identity.get_user_snapshot(u.id)
+        assert current_user.return_value.timezone == 'Asia/Kolkata'
+
+        # the snapshot is only dropped after the timezone is committed
+        with patch.object(db.session, 'commit', wraps=db.session.commit) as mock_commit:
+            with patch('app.services.identity.invalidate_user',
+                       side_effect=lambda user_id: mock_commit.assert_called_once()) as mock_invalidate:
+                response = test_client.get('/log_activity/{}?tz=Europe/London'.format(regular_activity.id))
+                assert response.status_code == 302
+        mock_invalidate.assert_called_once_with(u.id)
+        identity.invalidate_user(u.id)
+        assert identity.get_user_snapshot(u.id).timezone == 'Europe/London'
+        current_user.return_value = identity.get_user_snapshot(u.id)
+
+        # without the tz parameter the stored timezone is used
+        response = test_client.get('/log_activity/{}'.format(regular_activity.id))
+        assert response.status_code == 302
+        assert [activity.iso_timestamp[-6:] for activity in Activity.query.all()] == ['+05:30', '+01:00', '+01:00']
@@ -1,7 +1,13 @@
 
+from datetime import datetime, timedelta
 from unittest.mock import patch
 
-from app.models import User, Inspiration
+import flask
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.models import User, Inspiration, MyInspirationLikes
+from app.services import inspiration_feed, inspiration_likes
 from app.tests import conftest
 from app import db
 
@@ -242,6 +248,61 @@ def test_likes_inspiration_invalid_id(test_client_csrf, init_database, add_inspi
         assert response.status_code == 404
 
 
+def add_user_2():
+    user2 = User(username="USER_2", email="USER_2@email.com")
+    user2.set_password("PASSWORD")
+    db.session.add(user2)
+    db.session.commit()
+    return user2
+
+
+def test_likes_inspiration_twice(test_client, init_database, add_inspiration):
+    user2 = add_user_2()
+    inspiration = Inspiration.query.first()
+
+    assert inspiration_likes.like_inspiration(user2.id, inspiration.id) is True
+    assert inspiration_likes.like_inspiration(user2.id, inspiration.id) is False
+    assert inspiration_likes.like_inspiration(user2.id, 123) is None
+
+    assert Inspiration.query.get(inspiration.id).likes == 2
+    assert MyInspirationLikes.query.filter_by(user_id=user2.id, inspiration_id=inspiration.id).count() == 1
+
+
+def test_likes_inspiration_unique(test_client, init_database, add_inspiration):
+    user2 = add_user_2()
+    inspiration = Inspiration.query.first()
+    db.session.add(MyInspirationLikes(user_id=user2.id, inspiration_id=inspiration.id))
+    db.session.add(MyInspirationLikes(user_id=user2.id, inspiration_id=inspiration.id))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_likes_inspiration_buffered(test_client, init_database, add_inspiration, monkeypatch):
+    monkeypatch.setitem(flask.current_app.config, 'INSPIRATION_LIKE_COUNTER', 'buffered')
+    monkeypatch.setitem(flask.current_app.config, 'INSPIRATION_LIKE_FLUSH_SECONDS', 3600)
+    inspiration_likes.flush_likes()
+    inspiration = Inspiration.query.first()
+    inspiration_id = inspiration.id
+    users = []
+    for number in range(3):
+        user = User(username='user {}'.format(number), email='user{}@email.com'.format(number))
+        db.session.add(user)
+        users.append(user)
+    db.session.commit()
+
+    for user in users:
+        assert inspiration_likes.like_inspiration(user.id, inspiration_id) is True
+    # the likes are recorded but not yet counted
+    assert MyInspirationLikes.query.filter_by(inspiration_id=inspiration_id).count() == 4
+    db.session.expire_all()
+    assert Inspiration.query.get(inspiration_id).likes == 1
+
+    assert inspiration_likes.flush_likes() == 3
+    db.session.expire_all()
+    assert Inspiration.query.get(inspiration_id).likes == 4
+
+
 def test_inspires_list(test_client_csrf, init_database, add_inspiration):
     u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
 
@@ -280,3 +341,91 @@ def test_detailed_inspiration_invalid(test_client_csrf, init_database, add_inspi
 
         response = test_client_csrf.get('/inspires/detail_inspiration/{}'.format(123))
         assert response.status_code == 404
+
+
+def add_inspirations(user_id, likes_list):
+    inspirations = []
+    for position, likes in enumerate(likes_list):
+        inspiration = Inspiration(title='Inspiration {}'.format(position), workout_type=1, url='http://youtube.com',
+                                  duration=20, likes=likes, user_id=user_id,
+                                  last_updated=datetime(2020, 6, 1) + timedelta(days=position))
+        db.session.add(inspiration)
+        inspirations.append(inspiration)
+    db.session.commit()
+    return inspirations
+
+
+def test_inspiration_feed_newest_pages(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    add_inspirations(u.id, [1, 5, 3, 2, 4])
+
+    titles = []
+    cursor = None
+    while True:
+        page, cursor = inspiration_feed.get_feed_page(inspiration_feed.SORT_NEWEST, cursor, page_size=2)
+        titles.extend(inspiration.title for inspiration in page)
+        if cursor is None:
+            break
+
+    assert titles == ['Inspiration 4', 'Inspiration 3', 'Inspiration 2', 'Inspiration 1', 'Inspiration 0']
+
+
+def test_inspiration_feed_liked_pages(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    add_inspirations(u.id, [1, 5, 3, 3, 4])
+
+    page, cursor = inspiration_feed.get_feed_page(inspiration_feed.SORT_LIKED, page_size=3)
+    assert [inspiration.likes for inspiration in page] == [5, 4, 3]
+    page, cursor = inspiration_feed.get_feed_page(inspiration_feed.SORT_LIKED, cursor, page_size=3)
+    # ties on likes are newest first
+    assert [inspiration.title for inspiration in page] == ['Inspiration 2', 'Inspiration 0']
+    assert cursor is None
+
+
+def test_inspiration_feed_invalid_cursor(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    add_inspirations(u.id, [1, 2])
+
+    assert inspiration_feed.decode_cursor('rubbish', inspiration_feed.SORT_LIKED) is None
+    page, cursor = inspiration_feed.get_feed_page(inspiration_feed.SORT_NEWEST, 'rubbish', page_size=5)
+    assert len(page) == 2
+
+
+def test_inspires_list_pages(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    add_inspirations(u.id, [1] * 30)
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+
+        response = test_client.get('/inspires/inspires_list?sort=liked')
+        assert response.status_code == 200
+        assert response.data.count(b'id="detail_link"') == flask.current_app.config['INSPIRATION_PAGE_SIZE']
+        assert b'more_inspirations' in response.data
+
+
+def test_inspires_list_not_modified(test_client, init_database, add_inspiration):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+
+        response = test_client.get('/inspires/inspires_list')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert response.headers['Last-Modified']
+
+        response = test_client.get('/inspires/inspires_list', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # liking an inspiration changes the feed
+        inspiration = Inspiration.query.first()
+        inspiration.likes += 1
+        inspiration.last_updated = datetime.utcnow() + timedelta(seconds=1)
+        db.session.commit()
+
+        response = test_client.get('/inspires/inspires_list', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
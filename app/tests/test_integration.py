@@ -0,0 +1,89 @@
+from unittest.mock import patch
+
+import flask
+
+from app import db
+from app.models import User, StravaAthlete
+from app.services import integration, strava as ss
+from app.services.cache import TTLCache
+from app.tests import conftest
+
+
+def test_is_strava_connected(test_client, init_database, add_strava_athlete):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    assert integration.is_strava_connected(u.id) is True
+    # the id of the logged in user is a string
+    assert integration.is_strava_connected(str(u.id)) is True
+
+
+def test_is_strava_connected_not_athlete(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    assert integration.is_strava_connected(u.id) is False
+
+
+def test_is_strava_connected_is_cached(test_client, init_database, add_strava_athlete):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    assert integration.is_strava_connected(u.id) is True
+
+    with patch('app.services.integration.StravaAthlete') as mock_athlete:
+        assert integration.is_strava_connected(u.id) is True
+        assert mock_athlete.query.called is False
+
+
+def test_deauthorize_athlete_invalidates_status(test_client, init_database, add_strava_athlete):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    athlete = StravaAthlete.query.filter_by(user_id=u.id).first()
+    assert integration.is_strava_connected(u.id) is True
+
+    ss.deauthorize_athlete(athlete.athlete_id)
+    assert integration.is_strava_connected(u.id) is False
+
+
+def test_invalidate_strava(test_client, init_database, add_strava_athlete):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    assert integration.is_strava_connected(u.id) is True
+
+    StravaAthlete.query.filter_by(user_id=u.id).update({StravaAthlete.is_active: 0})
+    db.session.commit()
+    # still cached until it's invalidated
+    assert integration.is_strava_connected(u.id) is True
+
+    integration.invalidate_strava(u.id)
+    assert integration.is_strava_connected(u.id) is False
+
+
+def test_change_in_another_process_seen_after_ttl(test_client, init_database, add_strava_athlete, monkeypatch):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    now = [0]
+
+    def timer():
+        return now[0]
+
+    ttl = flask.current_app.config['INTEGRATION_CACHE_TTL']
+    monkeypatch.setitem(flask.current_app.extensions, 'integration_cache', TTLCache(ttl=ttl, timer=timer))
+    assert integration.is_strava_connected(u.id) is True
+
+    # another process, e.g. the strava-worker, deauthorizes the athlete and only clears its own cache
+    athlete = StravaAthlete.query.filter_by(user_id=u.id).first()
+    with patch('app.services.integration.get_cache', return_value=TTLCache(ttl=ttl, timer=timer)):
+        ss.deauthorize_athlete(athlete.athlete_id)
+
+    now[0] = ttl - 1
+    assert integration.is_strava_connected(u.id) is True
+    now[0] = ttl
+    assert integration.is_strava_connected(u.id) is False
+
+
+def test_user_page_uses_cached_status(test_client, init_database, add_strava_athlete):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+        response = test_client.get('/user')
+        assert response.status_code == 200
+        assert b'Strava' in response.data
+
+        with patch('app.services.integration.StravaAthlete') as mock_athlete:
+            response = test_client.get('/user')
+            assert response.status_code == 200
+            assert mock_athlete.query.called is False
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from app import db
+from app.models import User
+from app.services import last_seen
+from app.tests import conftest
+
+NOW = datetime(2020, 6, 16, 10, 0)
+
+
+@pytest.fixture(autouse=True)
+def forget_last_written():
+    last_seen._last_written.clear()
+    yield
+    last_seen._last_written.clear()
+
+
+def test_record_last_seen(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    u.last_seen = None
+    db.session.commit()
+
+    assert last_seen.record_last_seen(u.id, NOW)
+    assert User.query.get(u.id).last_seen == NOW
+
+
+def test_record_last_seen_coalesced(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    u.last_seen = None
+    db.session.commit()
+    last_seen.record_last_seen(u.id, NOW)
+
+    # within the interval nothing is written
+    with patch.object(db.session, 'commit') as mock_commit:
+        assert last_seen.record_last_seen(u.id, NOW + timedelta(minutes=1)) is False
+        assert mock_commit.called is False
+    assert User.query.get(u.id).last_seen == NOW
+
+    later = NOW + timedelta(seconds=test_client.application.config['LAST_SEEN_INTERVAL'])
+    assert last_seen.record_last_seen(u.id, later)
+    db.session.expire_all()
+    assert User.query.get(u.id).last_seen == later
+
+
+def test_record_last_seen_written_by_another_process(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    u.last_seen = NOW
+    db.session.commit()
+
+    # this process hasn't written it but the stored time is recent so it's left alone
+    last_seen.record_last_seen(u.id, NOW + timedelta(minutes=1))
+    db.session.expire_all()
+    assert User.query.get(u.id).last_seen == NOW
+
+
+def test_forgets_stale_users(test_client, init_database):
+    max_users = test_client.application.config['LAST_SEEN_MAX_USERS']
+    test_client.application.config['LAST_SEEN_MAX_USERS'] = 2
+    try:
+        last_seen.record_last_seen(1001, NOW)
+        last_seen.record_last_seen(1002, NOW)
+        last_seen.record_last_seen(1003, NOW + timedelta(days=1))
+        assert set(last_seen._last_written) == {1003}
+    finally:
+        test_client.application.config['LAST_SEEN_MAX_USERS'] = max_users
+
+
+def test_pages_write_last_seen_once(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+        with patch('app.services.last_seen.User.query') as mock_query:
+            for _ in range(3):
+                test_client.get('/about')
+            assert mock_query.filter.call_count == 1
@@ -112,11 +112,24 @@ def test_daily_activity_no_tz_present(test_client, init_database, add_regular_ac
     assert load_activity.iso_timestamp is not None
     assert activity.timestamp == load_activity.timestamp
     assert load_activity.local_timestamp == load_activity.timestamp  # timestampes are the same as none provided
+    assert load_activity.local_date == load_activity.timestamp.date()
 
     assert "Regular Activity" in repr(activity)
     assert "Regular Activity" in str(activity)
 
 
+def test_daily_activity_local_date(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    # 9pm on the 15th in Los Angeles is already the 16th in UTC
+    activity = Activity(type=1, title='title', duration=20, timestamp=datetime(2020, 6, 16, 4), user_id=u.id)
+    activity.set_local_time(datetime(2020, 6, 15, 21), 'America/Los_Angeles')
+    db.session.add(activity)
+    db.session.commit()
+
+    load_activity = Activity.query.filter_by(user_id=u.id).first()
+    assert load_activity.local_date == datetime(2020, 6, 15).date()
+
+
 def test_strava_athlete(test_client, init_database):
     # create a strava athlete
     u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
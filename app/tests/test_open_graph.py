@@ -0,0 +1,251 @@
+import ipaddress
+import socket
+from unittest.mock import patch
+from urllib.parse import urlparse
+
+import flask
+
+from app import db
+from app.models import User, Inspiration
+from app.services import open_graph
+from app.tests import conftest
+
+PAGE = """<html><head>
+<title>Workout</title>
+<meta property="og:image" content="/images/workout.jpg">
+<meta property="og:image:width" content="1280">
+<meta property="og:image:height" content="720">
+<meta property="og:description" content="A 30 minute full body workout">
+</head><body>Workout</body></html>"""
+
+
+def add_inspiration(url, title='Inspiration'):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    inspiration = Inspiration(title=title, workout_type=1, url=url, duration=20, likes=1, user_id=u.id)
+    db.session.add(inspiration)
+    db.session.commit()
+    return inspiration
+
+
+def test_parse_open_graph():
+    metadata = open_graph.parse_open_graph(PAGE, 'https://example.com/workouts/1')
+    assert metadata == open_graph.OpenGraph(image='https://example.com/images/workout.jpg', width=1280,
+                                            height=720, description='A 30 minute full body workout')
+
+
+def test_parse_open_graph_without_tags():
+    assert open_graph.parse_open_graph('<html><head><title>Nothing</title></head></html>') is None
+
+
+def test_parse_open_graph_long_values():
+    html = '<meta property="og:image" content="https://example.com/{}.jpg">' \
+           '<meta property="og:description" content="{}">'.format('a' * 300, 'b' * 300)
+    metadata = open_graph.parse_open_graph(html)
+    assert metadata.image is None
+    assert metadata.width is None
+    assert metadata.description == 'b' * open_graph.MAX_DESCRIPTION_LENGTH
+
+
+def test_run_pending(test_client, init_database, fake_site):
+    inspiration = add_inspiration(fake_site.add_page('/workout', PAGE))
+    missing = add_inspiration(fake_site.url + '/missing')
+
+    assert open_graph.run_pending() == 2
+
+    inspiration = Inspiration.query.get(inspiration.id)
+    assert inspiration.meta_og_image == fake_site.url + '/images/workout.jpg'
+    assert inspiration.meta_og_width == 1280
+    assert inspiration.meta_og_height == 720
+    assert inspiration.meta_og_description == 'A 30 minute full body workout'
+    assert inspiration.meta_og_fetched is not None
+    # not tried again even though the page wasn't there
+    missing = Inspiration.query.get(missing.id)
+    assert missing.meta_og_image is None
+    assert missing.meta_og_fetched is not None
+    assert open_graph.run_pending() == 0
+
+
+def test_fetcher_caches_by_url(test_client, init_database, fake_site):
+    url = fake_site.add_page('/workout', PAGE)
+    fetcher = open_graph.OpenGraphFetcher(allow_private_addresses=True)
+
+    assert fetcher.fetch_all([url, url]) == {url: fetcher.fetch(url)}
+    assert fetcher.fetch(url).description == 'A 30 minute full body workout'
+    assert fake_site.requests == ['/workout']
+    fetcher.close()
+
+
+def test_fetcher_limits_requests_per_host(test_client, init_database, fake_site):
+    fake_site.delay = 0.1
+    urls = [fake_site.add_page('/workout/{}'.format(number), PAGE) for number in range(6)]
+    fetcher = open_graph.OpenGraphFetcher(max_workers=6, per_host=2, allow_private_addresses=True)
+
+    metadata = fetcher.fetch_all(urls)
+    assert all(metadata[url] is not None for url in urls)
+    assert len(fake_site.requests) == 6
+    assert fake_site.most_active <= 2
+    # only the hosts being fetched from are kept
+    assert fetcher._host_limits == {}
+    fetcher.close()
+
+
+def test_fetcher_timeout(test_client, init_database, fake_site):
+    fake_site.delay = 0.5
+    url = fake_site.add_page('/slow', PAGE)
+    fetcher = open_graph.OpenGraphFetcher(timeout=(1, 0.1), allow_private_addresses=True)
+
+    assert fetcher.fetch(url) is None
+    fetcher.close()
+
+
+def test_fetcher_ignores_other_content(test_client, init_database, fake_site):
+    url = fake_site.add_page('/video.mp4', PAGE, content_type='video/mp4')
+    fetcher = open_graph.OpenGraphFetcher(allow_private_addresses=True)
+
+    assert fetcher.fetch(url) is None
+    assert fetcher.fetch('ftp://example.com/workout') is None
+    assert fetcher.fetch(None) is None
+    fetcher.close()
+
+
+def test_add_inspiration_does_not_fetch(test_client_csrf, init_database, fake_site):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    url = fake_site.add_page('/workout', PAGE)
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+        params = dict(title='My Inspiration', url=url, instructor='Bobby Chariot', description='Workout',
+                      why_inspires='Fun', duration=25, type='1', csrf_token=test_client_csrf.csrf_token)
+        response = test_client_csrf.post('/inspires/add_inspiration', data=params)
+        assert response.status_code == 302
+
+    assert fake_site.requests == []
+    assert open_graph.get_pending()[0].url == url
+
+
+def test_changing_url_fetches_again(test_client, init_database, fake_site):
+    inspiration = add_inspiration(fake_site.add_page('/workout', PAGE))
+    open_graph.run_pending()
+
+    inspiration = Inspiration.query.get(inspiration.id)
+    open_graph.reset_metadata(inspiration)
+    inspiration.url = fake_site.add_page('/other', PAGE.replace('full body', 'core'))
+    db.session.commit()
+
+    assert open_graph.run_pending() == 1
+    assert Inspiration.query.get(inspiration.id).meta_og_description == 'A 30 minute core workout'
+
+
+def test_og_worker_command(test_client, init_database, fake_site):
+    add_inspiration(fake_site.add_page('/workout', PAGE))
+
+    runner = flask.current_app.test_cli_runner()
+    result = runner.invoke(args=['og-worker', '--once'])
+    assert 'Fetched the previews of 1 inspirations' in result.output
+
+
+def test_fetcher_unknown_charset(test_client, init_database, fake_site):
+    inspiration = add_inspiration(fake_site.add_page('/workout', PAGE, content_type='text/html; charset=bogus'))
+
+    assert open_graph.run_pending() == 1
+    inspiration = Inspiration.query.get(inspiration.id)
+    assert inspiration.meta_og_description == 'A 30 minute full body workout'
+    assert inspiration.meta_og_fetched is not None
+
+
+def test_og_worker_carries_on_after_error(test_client, init_database, fake_site):
+    add_inspiration(fake_site.add_page('/workout', PAGE))
+
+    runner = flask.current_app.test_cli_runner()
+    with patch('app.services.open_graph.run_pending', side_effect=[LookupError('bogus'), 1, 0]) as mock_run:
+        with patch('app.cli.time.sleep') as mock_sleep:
+            mock_sleep.side_effect = [None, StopIteration]
+            result = runner.invoke(args=['og-worker', '--poll-interval', '0'])
+    assert mock_run.call_count == 3
+    assert 'Fetched the previews of 1 inspirations' in result.output
+
+
+def test_fetcher_only_fetches_public_addresses(test_client, init_database, fake_site):
+    url = fake_site.add_page('/workout', PAGE)
+    fetcher = open_graph.OpenGraphFetcher()
+
+    assert fetcher.fetch(url) is None
+    assert fetcher.fetch('http://169.254.169.254/latest/meta-data/') is None
+    assert fetcher.fetch('http://10.0.0.1/') is None
+    assert fake_site.requests == []
+    fetcher.close()
+
+
+def fake_dns(answers):
+    """ patches name resolution so each host in answers resolves to the addresses it lists in turn """
+    getaddrinfo = socket.getaddrinfo
+
+    def resolve(host, port, *args, **kwargs):
+        if host not in answers:
+            return getaddrinfo(host, port, *args, **kwargs)
+        address = answers[host].pop(0) if len(answers[host]) > 1 else answers[host][0]
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, port))]
+
+    return patch('socket.getaddrinfo', side_effect=resolve)
+
+
+def test_fetcher_rejects_dns_rebinding(test_client, init_database, fake_site):
+    fake_site.add_page('/workout', PAGE)
+    port = urlparse(fake_site.url).port
+    fetcher = open_graph.OpenGraphFetcher()
+
+    # public when the url is checked, then the fake site's loopback address when connecting
+    with fake_dns({'rebind.example.com': ['93.184.216.34', '127.0.0.1']}):
+        assert fetcher.fetch('http://rebind.example.com:{}/workout'.format(port)) is None
+    assert fake_site.requests == []
+    fetcher.close()
+
+
+def test_fetcher_connects_to_checked_address(test_client, init_database, fake_site):
+    fake_site.add_page('/workout', PAGE)
+    port = urlparse(fake_site.url).port
+    fetcher = open_graph.OpenGraphFetcher()
+
+    # the fake site stands in for a public address
+    with fake_dns({'workouts.example.com': ['127.0.0.1']}):
+        with patch('app.services.open_graph.ipaddress.ip_address', return_value=ipaddress.ip_address('8.8.8.8')):
+            metadata = fetcher.fetch('http://workouts.example.com:{}/workout'.format(port))
+    assert metadata.description == 'A 30 minute full body workout'
+    assert fake_site.requests == ['/workout']
+    fetcher.close()
+
+
+def test_is_public_host():
+    assert not open_graph.is_public_host('127.0.0.1', 80)
+    assert not open_graph.is_public_host('169.254.169.254', 80)
+    assert not open_graph.is_public_host('192.168.1.10', 443)
+    assert not open_graph.is_public_host('::1', 80)
+    assert not open_graph.is_public_host('::ffff:127.0.0.1', 80)
+    assert open_graph.is_public_host('93.184.216.34', 443)
+
+
+def test_fetcher_follows_redirects(test_client, init_database, fake_site):
+    fake_site.add_page('/workout', PAGE)
+    url = fake_site.add_redirect('/moved', '/workout')
+    fetcher = open_graph.OpenGraphFetcher(allow_private_addresses=True)
+
+    assert fetcher.fetch(url).description == 'A 30 minute full body workout'
+    assert fake_site.requests == ['/moved', '/workout']
+
+    loop = fake_site.add_redirect('/loop', '/loop')
+    assert fetcher.fetch(loop) is None
+    assert fake_site.requests.count('/loop') == fetcher.max_redirects + 1
+    fetcher.close()
+
+
+def test_fetcher_checks_redirects(test_client, init_database, fake_site):
+    url = fake_site.add_redirect('/moved', 'http://169.254.169.254/latest/meta-data/')
+    fetcher = open_graph.OpenGraphFetcher(allow_private_addresses=True)
+
+    with patch('app.services.open_graph.is_public_host') as mock_is_public_host:
+        fetcher.allow_private_addresses = False
+        mock_is_public_host.side_effect = lambda host, port: host != '169.254.169.254'
+        assert fetcher.fetch(url) is None
+    assert fake_site.requests == ['/moved']
+    fetcher.close()
@@ -0,0 +1,315 @@
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+import flask
+from flask_sqlalchemy import BaseQuery
+
+from app import db
+from app.main import routes
+from app.models import User, Activity, DailyActivityRollup, WeeklyActivityRollup
+from app.services import rollup, charting, week_calendar
+from app.tests import conftest
+
+
+def save_activity(user_id, activity_type, duration, local_time, tz='UTC', distance=None):
+    activity = Activity(type=activity_type, title='title', duration=duration, distance=distance,
+                        timestamp=local_time, user_id=user_id)
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = user_id
+        current_user.return_value.get_id.return_value = user_id
+        routes.save_completed_activity(activity, local_time, tz)
+    return activity
+
+
+def test_save_activity_creates_rollup(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_activity(u.id, 3, 20, datetime(2020, 6, 16, 8, 0), distance=5.5)
+    save_activity(u.id, 3, 30, datetime(2020, 6, 16, 18, 0), distance=4)
+
+    rollups = DailyActivityRollup.query.filter_by(user_id=u.id).all()
+    assert len(rollups) == 1
+    assert rollups[0].local_date == date(2020, 6, 16)
+    assert rollups[0].type == 3
+    assert rollups[0].count == 2
+    assert rollups[0].duration == 50
+    assert float(rollups[0].distance) == 9.5
+
+
+def test_save_activity_rollup_uses_local_date(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    # late evening in Los Angeles is the next day in UTC
+    save_activity(u.id, 1, 20, datetime(2020, 6, 16, 22, 0), tz='America/Los_Angeles')
+
+    rollup_row = DailyActivityRollup.query.filter_by(user_id=u.id).first()
+    assert rollup_row.local_date == date(2020, 6, 16)
+
+
+def test_delete_activity_updates_rollup(test_client_csrf, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activity = save_activity(u.id, 1, 20, datetime(2020, 6, 16, 8, 0))
+    save_activity(u.id, 1, 15, datetime(2020, 6, 16, 9, 0))
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+        response = test_client_csrf.get('/delete_activity/' + str(activity.id))
+        assert response.status_code == 302
+
+    rollup_row = DailyActivityRollup.query.filter_by(user_id=u.id).first()
+    assert rollup_row.count == 1
+    assert rollup_row.duration == 15
+
+
+def test_update_totals_row_created_concurrently(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_activity(u.id, 3, 20, datetime(2020, 6, 16, 8, 0), distance=5.5)
+    keys = {'user_id': u.id, 'local_date': date(2020, 6, 16), 'type': 3}
+
+    # another writer creates the row between this writer's update finding nothing and its insert
+    update = BaseQuery.update
+    calls = []
+
+    def update_after_insert(query, values, synchronize_session='evaluate'):
+        calls.append(values)
+        if len(calls) == 1:
+            return 0
+        return update(query, values, synchronize_session=synchronize_session)
+
+    with patch.object(BaseQuery, 'update', autospec=True, side_effect=update_after_insert):
+        rollup.update_totals(DailyActivityRollup, keys, 1, 30, Decimal('4'), datetime(2020, 6, 16, 18, 0))
+    db.session.commit()
+
+    assert len(calls) == 2
+    daily = DailyActivityRollup.query.filter_by(**keys).one()
+    assert (daily.count, daily.duration, daily.distance) == (2, 50, Decimal('9.5'))
+
+
+def test_rebuild_rollups(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    for day in range(15, 18):
+        activity = Activity(type=4, title='title', duration=day, distance=2, timestamp=datetime(2020, 6, day, 7),
+                            user_id=u.id)
+        activity.set_local_time(None, 'UTC')
+        db.session.add(activity)
+    db.session.commit()
+    assert DailyActivityRollup.query.count() == 0
+
+    assert rollup.rebuild_rollups() == 3
+    rollups = rollup.get_rollups(u.id, date(2020, 6, 15), date(2020, 6, 21))
+    assert sorted((r.local_date.day, r.count, r.duration) for r in rollups) == [(15, 1, 15), (16, 1, 16),
+                                                                               (17, 1, 17)]
+
+
+def test_rebuild_rollups_without_local_date(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    # saved before the local date was stored, one with the iso timestamp of the user's local time
+    legacy = Activity(type=4, title='title', duration=10, distance=1, timestamp=datetime(2020, 6, 15, 23),
+                      user_id=u.id, iso_timestamp='2020-06-16T00:30:00+01:30')
+    older = Activity(type=4, title='title', duration=20, timestamp=datetime(2020, 6, 16, 7), user_id=u.id)
+    current = Activity(type=4, title='title', duration=30, distance=2, timestamp=datetime(2020, 6, 16, 8),
+                       user_id=u.id)
+    current.set_local_time(None, 'UTC')
+    db.session.add_all([legacy, older, current])
+    db.session.commit()
+
+    assert rollup.rebuild_rollups(u.id) == 1
+    assert DailyActivityRollup.query.filter(DailyActivityRollup.local_date.is_(None)).count() == 0
+    daily = DailyActivityRollup.query.filter_by(user_id=u.id).one()
+    assert (daily.local_date, daily.count, daily.duration, float(daily.distance)) == (date(2020, 6, 16), 3, 60, 3)
+    weekly = WeeklyActivityRollup.query.filter_by(user_id=u.id).one()
+    assert (weekly.week_start, weekly.count, weekly.duration) == (date(2020, 6, 15), 3, 60)
+
+
+def test_backfill_rollups_command(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activity = Activity(type=1, title='title', duration=20, timestamp=datetime(2020, 6, 16, 7), user_id=u.id)
+    activity.set_local_time(None, 'UTC')
+    db.session.add(activity)
+    db.session.commit()
+
+    user_id = u.id
+
+    runner = flask.current_app.test_cli_runner()
+    result = runner.invoke(args=['backfill-rollups', '--user-id', str(user_id)])
+    assert 'Wrote 1 daily activity rollups' in result.output
+    assert DailyActivityRollup.query.filter_by(user_id=user_id).count() == 1
+
+
+def test_chart_dataset_from_rollups_matches_activities(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_activity(u.id, 1, 25, datetime(2020, 6, 15, 21, 0), tz='America/Los_Angeles')
+    save_activity(u.id, 2, 32, datetime(2020, 6, 17, 5, 0), tz='America/Los_Angeles', distance=3.25)
+    save_activity(u.id, 2, 10, datetime(2020, 6, 21, 23, 0), tz='Asia/Kolkata', distance=1)
+    save_activity(u.id, 2, 10, datetime(2020, 6, 22, 1, 0))
+
+    start_week = date(2020, 6, 15)
+    end_week = date(2020, 6, 21)
+    activities = Activity.query.filter_by(user_id=u.id).all()
+    rollups = rollup.get_rollups(u.id, start_week, end_week)
+
+    for sum_by in ['duration', 'distance']:
+        assert charting.get_chart_dataset_from_rollups(rollups, start_week, sum_by) == \
+            charting.get_chart_dataset(activities, start_week, end_week, sum_by)
+    assert charting.calc_weekly_totals_from_rollups(rollups, start_week) == \
+        charting.calc_weekly_totals(activities, start_week, end_week)
+
+
+def test_save_activity_updates_weekly_rollup(test_client_csrf, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_activity(u.id, 2, 20, datetime(2020, 6, 15, 8, 0), distance=2.5)
+    activity = save_activity(u.id, 2, 30, datetime(2020, 6, 21, 18, 0), distance=4)
+    # Sunday evening in Los Angeles is Monday in UTC, but still the same week for the user
+    save_activity(u.id, 2, 10, datetime(2020, 6, 21, 22, 0), tz='America/Los_Angeles')
+    save_activity(u.id, 2, 5, datetime(2020, 6, 22, 8, 0))
+
+    rollups = rollup.get_weekly_rollups(u.id, date(2020, 6, 15), date(2020, 6, 22))
+    assert sorted((r.week_start, r.count, r.duration, float(r.distance)) for r in rollups) == \
+        [(date(2020, 6, 15), 3, 60, 6.5), (date(2020, 6, 22), 1, 5, 0)]
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+        response = test_client_csrf.get('/delete_activity/' + str(activity.id))
+        assert response.status_code == 302
+
+    weekly_rollup = WeeklyActivityRollup.query.filter_by(user_id=u.id, week_start=date(2020, 6, 15)).first()
+    assert weekly_rollup.count == 2
+    assert weekly_rollup.duration == 30
+    assert float(weekly_rollup.distance) == 2.5
+
+
+def test_rebuild_weekly_rollups(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_activity(u.id, 1, 20, datetime(2020, 6, 16, 8, 0), distance=1.25)
+    save_activity(u.id, 1, 25, datetime(2020, 6, 18, 8, 0), distance=2)
+    save_activity(u.id, 3, 40, datetime(2020, 6, 23, 8, 0))
+    expected = sorted((r.week_start, r.type, r.count, r.duration, float(r.distance))
+                      for r in WeeklyActivityRollup.query.filter_by(user_id=u.id).all())
+
+    assert rollup.rebuild_rollups(u.id) == 3
+    rebuilt = sorted((r.week_start, r.type, r.count, r.duration, float(r.distance))
+                     for r in WeeklyActivityRollup.query.filter_by(user_id=u.id).all())
+    assert rebuilt == expected == [(date(2020, 6, 15), 1, 2, 45, 3.25), (date(2020, 6, 22), 3, 1, 40, 0)]
+
+
+def test_calc_weekly_trend(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_activity(u.id, 1, 20, datetime(2020, 6, 2, 8, 0), distance=1.1)
+    save_activity(u.id, 1, 25, datetime(2020, 6, 18, 8, 0), distance=2.2)
+    save_activity(u.id, 4, 40, datetime(2020, 6, 18, 9, 0))
+    # before the trend starts
+    save_activity(u.id, 1, 15, datetime(2020, 5, 31, 8, 0))
+
+    rollups = rollup.get_weekly_rollups(u.id, date(2020, 6, 1), date(2020, 6, 15))
+    assert charting.calc_weekly_trend(rollups, date(2020, 6, 1), 3)[1] == [20, 0, 25]
+    assert charting.calc_weekly_trend(rollups, date(2020, 6, 1), 3, 'distance')[1] == [1.1, 0, 2.2]
+    assert charting.build_chart_dataset(charting.calc_weekly_trend(rollups, date(2020, 6, 1), 3)) == \
+        [{'label': 'Workout', 'backgroundColor': charting.ACTIVITY_COLOR_LOOKUP[1], 'data': [20, 0, 25]},
+         {'label': 'Run', 'backgroundColor': charting.ACTIVITY_COLOR_LOOKUP[4], 'data': [0, 0, 40]}]
+
+
+def test_chart_trend_api(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    calendar = week_calendar.get_calendar('UTC')
+    this_week = datetime.combine(calendar.start_week(0), datetime.min.time())
+    save_activity(u.id, 2, 30, this_week)
+    save_activity(u.id, 2, 20, this_week - timedelta(days=14))
+    save_activity(u.id, 2, 10, this_week - timedelta(days=35))
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+        current_user.return_value.timezone = 'UTC'
+        response = test_client.get('/api/chart/trend/duration?weeks=4')
+        assert response.status_code == 200
+        trend = response.get_json()
+        assert trend['weeks'][0] == calendar.start_week(3).isoformat()
+        assert trend['weeks'][-1] == calendar.start_week(0).isoformat()
+        assert trend['datasets'] == [{'label': 'Yoga', 'backgroundColor': charting.ACTIVITY_COLOR_LOOKUP[2],
+                                      'data': [0, 20, 0, 30]}]
+
+        response = test_client.get('/api/chart/trend/duration')
+        assert len(response.get_json()['datasets'][0]['data']) == 12
+
+        assert test_client.get('/api/chart/trend/calories').status_code == 404
+        assert test_client.get('/api/chart/trend/duration?weeks=0').status_code == 404
+
+
+def test_chart_week_api(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    calendar = week_calendar.get_calendar('UTC')
+    last_week = datetime.combine(calendar.start_week(1), datetime.min.time())
+    save_activity(u.id, 2, 30, last_week + timedelta(hours=8), distance=4)
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+        current_user.return_value.timezone = 'UTC'
+        response = test_client.get('/api/chart/week/1/distance')
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        assert response.headers['Last-Modified']
+        week = response.get_json()
+        assert week['start_week'] == calendar.start_week(1).strftime("%b %d")
+        assert week['datasets'] == [{'label': 'Yoga', 'backgroundColor': charting.ACTIVITY_COLOR_LOOKUP[2],
+                                     'data': [4.0, 0, 0, 0, 0, 0, 0]}]
+        assert week['previous']['chart'] == '/api/chart/week/2/distance'
+        assert week['next']['page'] == '/exercise_log/0/distance'
+        assert week['pages']['duration'] == '/exercise_log/1/duration'
+
+        etag = response.headers['ETag']
+        response = test_client.get('/api/chart/week/1/distance', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        # a different week or measure has its own tag
+        assert test_client.get('/api/chart/week/0/distance', headers={'If-None-Match': etag}).status_code == 200
+        assert test_client.get('/api/chart/week/1/duration', headers={'If-None-Match': etag}).status_code == 200
+
+        # logging an activity in the week changes it
+        save_activity(u.id, 2, 20, last_week + timedelta(days=2, hours=8), distance=3)
+        response = test_client.get('/api/chart/week/1/distance', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.get_json()['datasets'][0]['data'] == [4.0, 0, 3.0, 0, 0, 0, 0]
+
+        assert test_client.get('/api/chart/week/13/distance').get_json()['previous'] is None
+        assert test_client.get('/api/chart/week/0/distance').get_json()['next'] is None
+        assert test_client.get('/api/chart/week/14/distance').status_code == 404
+        assert test_client.get('/api/chart/week/1/calories').status_code == 404
+
+
+def test_week_version_changes_within_a_second(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    week_start = date(2020, 6, 15)
+    same_second = datetime(2020, 6, 20, 12, 0, 0)
+    with patch('app.services.rollup.datetime') as mock_datetime:
+        mock_datetime.utcnow.return_value = same_second
+        save_activity(u.id, 2, 30, datetime(2020, 6, 16, 8, 0))
+        version = rollup.get_week_version(u.id, week_start)
+        save_activity(u.id, 2, 20, datetime(2020, 6, 17, 8, 0))
+        next_version = rollup.get_week_version(u.id, week_start)
+
+    # the same types and last updated time, only the change counter tells them apart
+    assert version == (1, 1, same_second)
+    assert next_version == (1, 2, same_second)
+    assert rollup.get_week_etag(u.id, week_start, 'duration', version) != \
+        rollup.get_week_etag(u.id, week_start, 'duration', next_version)
+
+    # rebuilding carries the counter on
+    rollup.rebuild_rollups(u.id)
+    assert rollup.get_week_version(u.id, week_start)[1] == 3
+    assert rollup.get_week_version(u.id, date(2020, 6, 22)) == (0, 0, None)
+
+
+def test_exercise_log_embeds_chart_json(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    save_activity(u.id, 2, 30, datetime.combine(week_calendar.get_calendar('UTC').start_week(0),
+                                                datetime.min.time()) + timedelta(hours=8))
+
+    with patch('flask_login.utils._get_user') as current_user:
+        current_user.return_value.id = u.id
+        current_user.return_value.get_id.return_value = u.id
+        current_user.return_value.timezone = 'UTC'
+        response = test_client.get('/exercise_log/')
+        assert response.status_code == 200
+        assert '"label": "Yoga"' in response.get_data(as_text=True)
+        assert 'data-chart-url="/api/chart/week/1/duration"' in response.get_data(as_text=True)
@@ -1,19 +1,29 @@
 import json
 import os
+import threading
+import time
 from unittest.mock import Mock, patch
 from datetime import datetime, timedelta
 
+import pytest
 from requests import Response
 
 import flask
 
 from app import db
 from app.api import strava as strava_api
-from app.models import User, StravaAthlete, Activity
+from app.models import User, StravaAthlete, Activity, StravaUploadJob, StravaEvent
 from app.services import strava as ss
 from app.tests import conftest
 from app.main import routes
-from app.services import utils
+from app.services import utils, strava_webhooks
+
+
+@pytest.fixture(autouse=True)
+def stop_patches():
+    """ stops the patches started in a test so they don't leak into the next one """
+    yield
+    patch.stopall()
 
 
 def test_strava_athlete_create(test_client, init_database):
@@ -83,7 +93,11 @@ def test_save_completed_activity_strava_integration_on(test_client_csrf, init_da
             assert load_activity.title == 'title'
             assert load_activity.duration == 20
 
-            assert mock_strava.called
+            # uploaded by the strava-worker rather than during the request
+            assert mock_strava.called is False
+            job = StravaUploadJob.query.filter_by(activity_id=load_activity.id).first()
+            assert job.status == StravaUploadJob.PENDING
+            assert job.user_id == u.id
 
 
 def test_save_completed_activity_strava_integration_off(test_client_csrf, init_database, activate_strava_sync, add_strava_athlete):
@@ -115,6 +129,7 @@ def test_save_completed_activity_strava_integration_off(test_client_csrf, init_d
             assert load_activity.duration == 20
 
             assert mock_strava.called is False
+            assert StravaUploadJob.query.count() == 0
 
 
 def test_save_completed_activity_not_strava_athlete(test_client_csrf, init_database, activate_strava_sync):
@@ -144,6 +159,7 @@ def test_save_completed_activity_not_strava_athlete(test_client_csrf, init_datab
             assert load_activity.duration == 20
 
             assert mock_strava.called is False
+            assert StravaUploadJob.query.count() == 0
 
 
 def test_construct_strava_activity_data_no_distance(test_client, init_database):
@@ -209,6 +225,8 @@ def test_refresh_access_token(test_client, init_database):
         authorize_details = json.loads(conftest.STRAVA_RESPONSE_EXAMPLE)
         scope = 'activity:write'
         strava_athlete = ss.create_strava_athlete(authorize_details, u.id, scope)
+        # the token has expired so must be refreshed
+        strava_athlete.access_token_expires_at = int((datetime.utcnow() - timedelta(hours=1)).timestamp())
 
         db.session.add(strava_athlete)
         db.session.commit()
@@ -230,6 +248,7 @@ def test_refresh_access_token_none(test_client, init_database):
         authorize_details = json.loads(conftest.STRAVA_RESPONSE_EXAMPLE)
         scope = 'activity:write'
         strava_athlete = ss.create_strava_athlete(authorize_details, u.id, scope)
+        strava_athlete.access_token_expires_at = int((datetime.utcnow() - timedelta(hours=1)).timestamp())
 
         db.session.add(strava_athlete)
         db.session.commit()
@@ -242,6 +261,89 @@ def test_refresh_access_token_none(test_client, init_database):
         assert new_token is None
 
 
+def test_refresh_access_token_still_valid(test_client, init_database, add_strava_athlete):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    counters = ss.get_token_counters()
+
+    with patch('app.services.strava.OAuth2Session') as mock_oauth:
+        # the token in the example expires in 8 hours
+        assert ss.refresh_access_token(u.id) == 'd188074a'
+        assert ss.refresh_access_token(u.id) == 'd188074a'
+        assert mock_oauth.called is False
+
+    assert ss.get_token_counters()['hits'] == counters['hits'] + 2
+    assert ss.get_token_counters()['refreshes'] == counters['refreshes']
+
+
+def test_refresh_access_token_within_margin(test_client, init_database, add_strava_athlete):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    strava_athlete = StravaAthlete.query.filter_by(user_id=u.id).first()
+    # expires before the safety margin is up
+    strava_athlete.access_token_expires_at = int(datetime.utcnow().timestamp()) + \
+        flask.current_app.config['STRAVA_TOKEN_EXPIRY_MARGIN'] // 2
+    db.session.commit()
+    counters = ss.get_token_counters()
+
+    with patch('app.services.strava.OAuth2Session') as mock_oauth:
+        new_tokens = json.loads(conftest.STRAVA_REFRESH_EXAMPLE)
+        mock_oauth.return_value = Mock()
+        mock_oauth.return_value.refresh_token.return_value = new_tokens
+        assert ss.refresh_access_token(u.id) == new_tokens['access_token']
+        assert mock_oauth.return_value.refresh_token.call_count == 1
+
+    assert ss.get_token_counters()['refreshes'] == counters['refreshes'] + 1
+    assert StravaAthlete.query.filter_by(user_id=u.id).first().access_token == new_tokens['access_token']
+
+
+def test_token_lock_per_athlete(test_client):
+    with ss.token_lock(1):
+        with ss.token_lock(2):
+            assert ss._token_locks[1][0] is not ss._token_locks[2][0]
+        assert 2 not in ss._token_locks
+        assert ss._token_locks[1][1] == 1
+    assert ss._token_locks == {}
+
+
+def test_token_lock_shared_while_waiting(test_client):
+    acquired = threading.Event()
+
+    def refresh():
+        with ss.token_lock(1):
+            acquired.set()
+
+    with ss.token_lock(1):
+        thread = threading.Thread(target=refresh)
+        thread.start()
+        # the waiting thread shares the lock rather than making its own
+        for _ in range(100):
+            if ss._token_locks[1][1] == 2:
+                break
+            time.sleep(0.01)
+        assert ss._token_locks[1][1] == 2
+        assert not acquired.is_set()
+    thread.join(1)
+    assert acquired.is_set()
+    assert ss._token_locks == {}
+
+
+def test_refresh_access_token_rereads_athlete(test_client, init_database, add_strava_athlete):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    athlete = StravaAthlete.query.filter_by(user_id=u.id).first()
+    athlete.access_token_expires_at = 0
+    db.session.commit()
+    athlete = StravaAthlete.query.filter_by(user_id=u.id).first()
+
+    # another process refreshes the token after this one read the expired one
+    with db.engine.begin() as connection:
+        connection.execute(StravaAthlete.__table__.update().where(StravaAthlete.athlete_id == athlete.athlete_id)
+                           .values(access_token='fresh', access_token_expires_at=conftest.EXPIRES_AT_SECS))
+
+    with patch('app.services.strava.is_access_token_valid', side_effect=[False, True]):
+        with patch('app.services.strava.OAuth2Session') as mock_oauth:
+            assert ss.refresh_access_token(u.id) == 'fresh'
+            mock_oauth.assert_not_called()
+
+
 def test_create_activity(test_client, init_database, add_strava_athlete, add_activity):
     u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
     a = Activity.query.filter_by(user_id=u.id).first()
@@ -251,7 +353,7 @@ def test_create_activity(test_client, init_database, add_strava_athlete, add_act
     mock_oauth.return_value.refresh_token = "token"
 
     # then mock the requests call to Strava
-    mock_requests_patched = patch('app.services.strava.requests.post')
+    mock_requests_patched = patch('app.services.strava_client.StravaClient.post')
     mock_requests = mock_requests_patched.start()
     mock_requests.return_value.status_code = 200
 
@@ -268,7 +370,7 @@ def test_create_activity_failed_token(test_client, init_database, add_strava_ath
     mock_oauth.return_value = None
 
     # then mock the requests call to Strava
-    mock_requests_patched = patch('app.services.strava.requests.post')
+    mock_requests_patched = patch('app.services.strava_client.StravaClient.post')
     mock_requests = mock_requests_patched.start()
     mock_requests.return_value.status_code = 200
 
@@ -285,7 +387,7 @@ def test_create_activity_invalid_id(test_client, init_database, add_strava_athle
     mock_oauth.return_value.refresh_token = "token"
 
     # then mock the requests call to Strava
-    mock_requests_patched = patch('app.services.strava.requests.post')
+    mock_requests_patched = patch('app.services.strava_client.StravaClient.post')
     mock_requests = mock_requests_patched.start()
     mock_requests.return_value.status_code = 200
 
@@ -330,6 +432,11 @@ def test_deauthorize_athlete_view(test_client, init_database, add_strava_athlete
 
     assert response.status_code == 200
 
+    # acknowledged straight away and processed by the strava-worker
+    athlete = StravaAthlete.query.filter_by(user_id=user.id).first()
+    assert athlete.is_active == 1
+    assert strava_webhooks.run_pending() == 1
+
     athlete = StravaAthlete.query.filter_by(user_id=user.id).first()
     assert athlete.is_active == 0
 
@@ -539,7 +646,7 @@ def test_user_strava_deauthorize(test_client, init_database, add_strava_athlete)
     mock_oauth.return_value.refresh_token = "token"
 
     # then mock the requests call to Strava
-    mock_requests_patched = patch('app.services.strava.requests.post')
+    mock_requests_patched = patch('app.services.strava_client.StravaClient.post')
     mock_requests = mock_requests_patched.start()
     mock_requests.return_value.status_code = 200
 
@@ -561,7 +668,7 @@ def test_user_strava_deauthorize_fail(test_client, init_database, add_strava_ath
     mock_oauth.return_value.refresh_token = "token"
 
     # then mock the requests call to Strava
-    mock_requests_patched = patch('app.services.strava.requests.post')
+    mock_requests_patched = patch('app.services.strava_client.StravaClient.post')
     mock_requests = mock_requests_patched.start()
     mock_requests.return_value.status_code = 400
 
@@ -678,7 +785,7 @@ def test_strava_turn_integration_off(test_client_csrf, init_database, add_strava
     athlete = StravaAthlete.query.filter_by(user_id=u.id).first()
 
     assert athlete.is_active == 1
-    with patch('app.services.strava.requests.post') as mock_requests:
+    with patch('app.services.strava_client.StravaClient.post') as mock_requests:
         mock_requests.return_value.status_code = 200
         with patch('app.services.strava.OAuth2Session') as mock_oauth:
             new_tokens = json.loads(conftest.STRAVA_REFRESH_EXAMPLE)
@@ -704,7 +811,7 @@ def test_strava_turn_integration_off_already_off(test_client_csrf, init_database
     db.session.commit()
 
     assert athlete.is_active == 0
-    with patch('app.services.strava.requests.post') as mock_requests:
+    with patch('app.services.strava_client.StravaClient.post') as mock_requests:
         mock_requests.return_value.status_code = 200
         with patch('app.services.strava.OAuth2Session') as mock_oauth:
             new_tokens = json.loads(conftest.STRAVA_REFRESH_EXAMPLE)
@@ -748,7 +855,7 @@ def test_strava_turn_integration_off_bad_strava(test_client_csrf, init_database,
 
     assert athlete.is_active == 1
 
-    with patch('app.services.strava.requests.post') as mock_requests:
+    with patch('app.services.strava_client.StravaClient.post') as mock_requests:
         successful_response = Mock(Response)
         successful_response.status_code = 401
         successful_response.json.return_value = {'hello': 'world'}
@@ -768,3 +875,138 @@ def test_strava_turn_integration_off_bad_strava(test_client_csrf, init_database,
                 athlete = StravaAthlete.query.filter_by(user_id=u.id).first()
                 assert athlete.is_active == 1
                 # should be an error in the log
+
+
+def set_event_durability(durability):
+    previous = flask.current_app.config['STRAVA_EVENT_DURABILITY']
+    flask.current_app.config['STRAVA_EVENT_DURABILITY'] = durability
+    return previous
+
+
+def test_log_strava_event_transaction(test_client, init_database):
+    previous = set_event_durability('transaction')
+    try:
+        ss.log_strava_event(123456, 'Activity')
+        # written with the rest of the unit of work
+        db.session.rollback()
+        assert StravaEvent.query.count() == 0
+
+        ss.log_strava_event(123456, 'Activity')
+        db.session.commit()
+        assert StravaEvent.query.count() == 1
+    finally:
+        set_event_durability(previous)
+
+
+def test_log_strava_event_commit(test_client, init_database):
+    previous = set_event_durability('commit')
+    try:
+        ss.log_strava_event(123456, 'Activity')
+        db.session.rollback()
+        assert StravaEvent.query.count() == 1
+    finally:
+        set_event_durability(previous)
+
+
+def test_log_strava_event_buffered(test_client, init_database):
+    patch('app.services.strava.start_event_flusher').start()
+    previous = set_event_durability('buffered')
+    buffer_size = flask.current_app.config['STRAVA_EVENT_BUFFER_SIZE']
+    flask.current_app.config['STRAVA_EVENT_BUFFER_SIZE'] = 3
+    try:
+        ss.flush_strava_events()
+        ss.log_strava_event(1, 'Activity')
+        ss.log_strava_event(2, 'Activity')
+        assert StravaEvent.query.count() == 0
+
+        # the third event fills the buffer and all three are written
+        ss.log_strava_event(3, 'Deauthorize')
+        assert sorted(event.athlete_id for event in StravaEvent.query.all()) == [1, 2, 3]
+
+        ss.log_strava_event(4, 'Activity')
+        assert ss.flush_strava_events() == 1
+        assert ss.flush_strava_events() == 0
+        assert StravaEvent.query.count() == 4
+    finally:
+        flask.current_app.config['STRAVA_EVENT_BUFFER_SIZE'] = buffer_size
+        set_event_durability(previous)
+
+
+def test_log_strava_event_buffer_full(test_client, init_database):
+    patch('app.services.strava.start_event_flusher').start()
+    previous = set_event_durability('buffered')
+    buffer_limit = flask.current_app.config['STRAVA_EVENT_BUFFER_LIMIT']
+    flask.current_app.config['STRAVA_EVENT_BUFFER_LIMIT'] = 2
+    try:
+        ss.flush_strava_events()
+        with patch.object(flask.current_app.logger, 'warning') as mock_warning:
+            for athlete_id in range(1, 5):
+                ss.log_strava_event(athlete_id, 'Activity')
+            mock_warning.assert_called_once_with('The Strava event buffer is full, dropping the oldest events')
+
+            # the oldest events are the ones dropped
+            assert ss.flush_strava_events() == 2
+            mock_warning.assert_called_with('Dropped 2 Strava events as the buffer was full')
+        assert sorted(event.athlete_id for event in StravaEvent.query.all()) == [3, 4]
+    finally:
+        flask.current_app.config['STRAVA_EVENT_BUFFER_LIMIT'] = buffer_limit
+        set_event_durability(previous)
+
+
+def test_flush_strava_events_failure_keeps_events(test_client, init_database):
+    patch('app.services.strava.start_event_flusher').start()
+    previous = set_event_durability('buffered')
+    try:
+        ss.flush_strava_events()
+        ss.log_strava_event(1, 'Activity')
+        with patch.object(db.engine, 'begin', side_effect=ss.SQLAlchemyError('down')):
+            assert ss.flush_strava_events() == 0
+        assert ss.flush_strava_events() == 1
+        assert StravaEvent.query.count() == 1
+    finally:
+        set_event_durability(previous)
+
+
+def test_event_flusher_writes_without_more_events(test_client, init_database):
+    patch('app.services.strava.start_event_flusher').start()
+    previous = set_event_durability('buffered')
+    try:
+        ss.flush_strava_events()
+        ss.log_strava_event(1, 'Activity')
+        assert StravaEvent.query.count() == 0
+
+        # run one pass of the flusher thread's loop
+        with patch('app.services.strava.time.sleep', side_effect=[None, StopIteration]) as mock_sleep:
+            with pytest.raises(StopIteration):
+                ss.run_event_flusher(flask.current_app._get_current_object())
+        mock_sleep.assert_called_with(flask.current_app.config['STRAVA_EVENT_FLUSH_SECONDS'])
+        assert StravaEvent.query.count() == 1
+    finally:
+        set_event_durability(previous)
+
+
+def test_start_event_flusher(test_client, init_database):
+    app = flask.current_app._get_current_object()
+    mock_thread = patch('app.services.strava.threading.Thread').start()
+    mock_register = patch('app.services.strava.atexit.register').start()
+    patch.object(ss, '_event_flusher', [None]).start()
+
+    ss.start_event_flusher(app)
+    ss.start_event_flusher(app)
+    mock_thread.assert_called_once_with(target=ss.run_event_flusher, args=(app,), name='strava-event-flusher',
+                                        daemon=True)
+    mock_thread.return_value.start.assert_called_once()
+    mock_register.assert_called_once_with(ss.flush_event_buffer, app)
+
+    # a flusher that died is replaced but the exit flush is only registered once
+    mock_thread.return_value.is_alive.return_value = False
+    ss.start_event_flusher(app)
+    assert mock_thread.call_count == 2
+    mock_register.assert_called_once()
+
+
+def test_deauthorize_athlete_single_commit(test_client, init_database, add_strava_athlete):
+    with patch.object(db.session, 'commit', wraps=db.session.commit) as mock_commit:
+        assert ss.deauthorize_athlete(123456)
+        assert mock_commit.call_count == 1
+    assert StravaEvent.query.filter_by(athlete_id=123456, action='Deauthorize').count() == 1
@@ -0,0 +1,150 @@
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from app.models import User, Activity
+from app.services import strava as ss
+from app.services import strava_client
+from app.services.strava_client import StravaClient
+from app.tests import conftest
+
+
+def test_client_reuses_connection(test_client, fake_strava):
+    client = strava_client.get_client()
+    for _ in range(3):
+        assert client.get('/api/v3/athlete').status_code == 200
+
+    assert len(fake_strava.requests) == 3
+    # keep-alive, all the calls went over one connection
+    assert len(fake_strava.connections) == 1
+
+
+def test_client_retries_server_errors(test_client, fake_strava):
+    fake_strava.add_response(503)
+    fake_strava.add_response(502)
+    fake_strava.add_response(201, {'id': 1})
+
+    response = strava_client.get_client().get('/api/v3/activities/1')
+    assert response.status_code == 201
+    assert len(fake_strava.requests) == 3
+
+
+def test_client_does_not_retry_post_server_errors(test_client, fake_strava):
+    # Strava may have created the activity before failing
+    fake_strava.add_response(503)
+    fake_strava.add_response(201, {'id': 1})
+
+    response = strava_client.get_client().post('/api/v3/activities', data={'name': 'title'})
+    assert response.status_code == 503
+    assert len(fake_strava.requests) == 1
+
+    fake_strava.add_response(503)
+    response = strava_client.get_client().post('/api/v3/activities', idempotent=True)
+    assert response.status_code == 201
+
+
+def test_client_retries_post_connect_errors(test_client):
+    client = StravaClient('http://127.0.0.1:1', timeout=(0.5, 0.5), sleep=Mock())
+    with pytest.raises(requests.ConnectionError) as e:
+        client.post('/api/v3/activities')
+    assert client.sleep.call_count == client.max_retries
+    assert strava_client.is_connect_error(e.value)
+    assert not strava_client.may_have_reached_strava(e.value)
+
+
+def test_may_have_reached_strava():
+    post = requests.Request('POST', 'https://www.strava.com/api/v3/activities').prepare()
+    get = requests.Request('GET', 'https://www.strava.com/api/v3/activities/1').prepare()
+    assert strava_client.may_have_reached_strava(requests.ReadTimeout('timed out', request=post))
+    assert not strava_client.may_have_reached_strava(requests.ReadTimeout('timed out', request=get))
+    assert not strava_client.may_have_reached_strava(requests.ConnectTimeout('timed out', request=post))
+
+
+def test_client_gives_up_after_max_retries(test_client, fake_strava):
+    for _ in range(5):
+        fake_strava.add_response(500)
+
+    response = strava_client.get_client().get('/api/v3/activities/1')
+    assert response.status_code == 500
+    assert len(fake_strava.requests) == 3
+
+
+def test_client_does_not_retry_client_errors(test_client, fake_strava):
+    fake_strava.add_response(401, {'message': 'Authorization Error'})
+
+    assert strava_client.get_client().post('/api/v3/activities').status_code == 401
+    assert len(fake_strava.requests) == 1
+
+
+def test_client_does_not_wait_for_daily_rate_limit(test_client, fake_strava):
+    fake_strava.add_response(429, headers={'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '10,30000'})
+
+    assert strava_client.get_client().post('/api/v3/activities').status_code == 429
+    assert len(fake_strava.requests) == 1
+
+
+def test_get_retry_delay():
+    client = StravaClient('https://www.strava.com', backoff_factor=0.5, max_backoff=10)
+    assert client.get_retry_delay(None, 0) == 0.5
+    assert client.get_retry_delay(None, 2) == 2
+
+    response = Mock(requests.Response)
+    response.status_code = 429
+    response.headers = {'Retry-After': '3'}
+    assert client.get_retry_delay(response, 0) == 3
+
+    # waiting for the 15 minute window to reset is longer than the maximum backoff
+    response.headers = {'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '600,1000'}
+    with patch('app.services.strava_client.time.time') as mock_time:
+        mock_time.return_value = 15 * 60 * 1000 - 5
+        assert client.get_retry_delay(response, 0) == 5
+        mock_time.return_value = 15 * 60 * 1000 + 60
+        assert client.get_retry_delay(response, 0) is None
+
+
+def test_parse_rate_limit():
+    assert strava_client.parse_rate_limit('600,30000') == (600, 30000)
+    assert strava_client.parse_rate_limit(None) is None
+    assert strava_client.parse_rate_limit('600') is None
+
+
+def test_client_raises_connection_error_after_retries(test_client):
+    client = StravaClient('http://127.0.0.1:1', timeout=(0.5, 0.5), sleep=lambda seconds: None)
+    with pytest.raises(requests.ConnectionError):
+        client.get('/api/v3/athlete')
+
+
+def test_create_activity_with_fake_strava(test_client, init_database, add_strava_athlete, add_activity,
+                                          fake_strava):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    a = Activity.query.filter_by(user_id=u.id).first()
+    fake_strava.add_response(429, headers={'Retry-After': '1'})
+    fake_strava.add_response(201, {'id': 99})
+
+    assert ss.create_activity(a.id) == 201
+    method, path, headers, _ = fake_strava.requests[-1]
+    assert (method, path) == ('POST', '/api/v3/activities')
+    assert headers['Authorization'] == 'Bearer d188074a'
+
+
+def test_settings_loaded_once(test_client):
+    settings = strava_client.get_settings()
+    assert settings.api_url == test_client.application.config['STRAVA_API_URL']
+    assert settings.token_expiry_margin == test_client.application.config['STRAVA_TOKEN_EXPIRY_MARGIN']
+    with pytest.raises(AttributeError):
+        settings.client_id = 'changed'
+
+
+def test_refresh_access_token_without_flask_config(test_client, init_database, add_strava_athlete, monkeypatch):
+    """ the running app's settings are used rather than the FLASK_CONFIG environment variable """
+    monkeypatch.delenv('FLASK_CONFIG', raising=False)
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    strava_athlete = ss.StravaAthlete.query.filter_by(user_id=u.id).first()
+    strava_athlete.access_token_expires_at = 0
+
+    with patch('app.services.strava.OAuth2Session') as mock_oauth:
+        mock_oauth.return_value.refresh_token.return_value = json.loads(conftest.STRAVA_REFRESH_EXAMPLE)
+        assert ss.refresh_access_token(u.id) == 'e188074a'
+        assert mock_oauth.call_args[0][0] == strava_client.get_settings().client_id
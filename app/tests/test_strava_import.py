@@ -0,0 +1,190 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import flask
+import pytest
+import requests
+
+from app import db
+from app.models import User, Activity, StravaImport, DailyActivityRollup
+from app.services import strava_import
+from app.tests import conftest
+
+
+def strava_activities(number, start=datetime(2019, 1, 1, 7), first_id=1000):
+    activities = []
+    for i in range(number):
+        start_date = start + timedelta(days=i)
+        activities.append({'id': first_id + i, 'name': 'Run {}'.format(i), 'type': 'Run', 'elapsed_time': 1800,
+                           'distance': 5000.0, 'start_date': start_date.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                           'start_date_local': start_date.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                           'timezone': '(GMT+00:00) Europe/London'})
+    return activities
+
+
+@pytest.fixture(scope='function')
+def small_batches():
+    batch_size = flask.current_app.config['STRAVA_IMPORT_BATCH_SIZE']
+    flask.current_app.config['STRAVA_IMPORT_BATCH_SIZE'] = 2
+    yield
+    flask.current_app.config['STRAVA_IMPORT_BATCH_SIZE'] = batch_size
+
+
+def test_get_epoch():
+    assert strava_import.get_epoch('1970-01-02T00:00:00Z') == 86400
+
+
+def test_import_activities(test_client, init_database, add_strava_athlete, fake_strava, small_batches):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activities = strava_activities(3)
+    fake_strava.add_response(200, activities[:2])
+    fake_strava.add_response(200, activities[2:])
+    fake_strava.add_response(200, [])
+
+    result = strava_import.import_activities(u.id)
+    assert result.status == StravaImport.DONE
+    assert result.imported == 3
+    assert result.after == strava_import.get_epoch(activities[2]['start_date'])
+
+    # paged through with the after cursor
+    paths = [path for _, path, _, _ in fake_strava.requests]
+    assert paths[0] == '/api/v3/athlete/activities?after=0&per_page=2'
+    assert paths[1] == '/api/v3/athlete/activities?after={}&per_page=2'.format(
+        strava_import.get_epoch(activities[1]['start_date']))
+
+    imported = Activity.query.filter_by(user_id=u.id).order_by(Activity.timestamp).all()
+    assert [activity.strava_activity_id for activity in imported] == [1000, 1001, 1002]
+    assert imported[0].type == 4
+    assert imported[0].duration == 30
+    assert float(imported[0].distance) == 5
+    assert imported[0].local_date == datetime(2019, 1, 1).date()
+    assert DailyActivityRollup.query.filter_by(user_id=u.id).count() == 3
+
+
+def test_import_resumes_from_checkpoint(test_client, init_database, add_strava_athlete, fake_strava,
+                                        small_batches):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activities = strava_activities(4)
+    fake_strava.add_response(200, activities[:2])
+    fake_strava.add_response(401, {'message': 'Authorization Error'})
+
+    result = strava_import.import_activities(u.id)
+    assert result.status == StravaImport.FAILED
+    assert result.imported == 2
+
+    fake_strava.add_response(200, activities[2:])
+    fake_strava.add_response(200, [])
+    result = strava_import.import_activities(u.id)
+    assert result.status == StravaImport.DONE
+    assert result.imported == 4
+    assert fake_strava.requests[2][1].startswith('/api/v3/athlete/activities?after={}&'.format(
+        strava_import.get_epoch(activities[1]['start_date'])))
+    assert Activity.query.filter_by(user_id=u.id).count() == 4
+
+
+def test_import_skips_imported_and_links_uploaded(test_client, init_database, add_strava_athlete, fake_strava):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activities = strava_activities(3)
+    # already imported by a webhook event
+    imported = Activity(user_id=u.id, type=4, title='Run 0', duration=30, strava_activity_id=1000,
+                        timestamp=datetime(2019, 1, 1, 7))
+    # logged in LogMyExercise and uploaded before the Strava id was kept
+    uploaded = Activity(user_id=u.id, type=4, title='My run', duration=30, timestamp=datetime(2019, 1, 2, 7))
+    for activity in [imported, uploaded]:
+        activity.set_local_time(None, 'UTC')
+    db.session.add_all([imported, uploaded])
+    db.session.commit()
+    fake_strava.add_response(200, activities)
+    fake_strava.add_response(200, [])
+
+    assert strava_import.import_activities(u.id).imported == 1
+    assert Activity.query.filter_by(user_id=u.id).count() == 3
+    assert Activity.query.get(uploaded.id).strava_activity_id == 1001
+
+
+def test_import_links_uploaded_with_microseconds(test_client, init_database, add_strava_athlete, fake_strava):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    # logged in LogMyExercise at a time with microseconds, Strava's start time is to the second
+    uploaded = Activity(user_id=u.id, type=4, title='My run', duration=30,
+                        timestamp=datetime(2019, 1, 3, 7, 0, 0, 654321))
+    uploaded.set_local_time(None, 'UTC')
+    db.session.add(uploaded)
+    db.session.commit()
+    fake_strava.add_response(200, strava_activities(3))
+    fake_strava.add_response(200, [])
+
+    assert strava_import.import_activities(u.id).imported == 2
+    assert Activity.query.filter_by(user_id=u.id).count() == 3
+    assert Activity.query.get(uploaded.id).strava_activity_id == 1002
+
+
+def test_strava_import_command(test_client, init_database, add_strava_athlete, fake_strava):
+    user_id = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first().id
+    fake_strava.add_response(200, strava_activities(2))
+    fake_strava.add_response(200, [])
+
+    runner = flask.current_app.test_cli_runner()
+    result = runner.invoke(args=['strava-import', str(user_id)])
+    assert 'Strava import done, 2 activities imported' in result.output
+
+    # nothing new since the checkpoint
+    fake_strava.add_response(200, [])
+    result = runner.invoke(args=['strava-import', str(user_id)])
+    assert 'Strava import done, 2 activities imported' in result.output
+    assert Activity.query.filter_by(user_id=user_id).count() == 2
+
+
+def test_run_pending_imports(test_client, init_database, add_strava_athlete, fake_strava):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    strava_import.queue_import(u.id)
+    db.session.commit()
+    fake_strava.add_response(200, strava_activities(1))
+    fake_strava.add_response(200, [])
+
+    assert strava_import.run_pending() == 1
+    assert strava_import.run_pending() == 0
+    assert StravaImport.query.get(u.id).status == StravaImport.DONE
+
+
+def test_run_pending_import_not_connected(test_client, init_database, fake_strava):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    strava_import.queue_import(u.id)
+    db.session.commit()
+
+    assert strava_import.run_pending() == 0
+    assert StravaImport.query.get(u.id).status == StravaImport.FAILED
+    assert fake_strava.requests == []
+
+
+def test_import_interrupted_by_strava(test_client, init_database, add_strava_athlete, fake_strava, small_batches):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activities = strava_activities(3)
+
+    with patch('app.services.strava_import.fetch_activities_page') as mock_fetch:
+        mock_fetch.side_effect = [activities[:2], requests.ConnectionError('strava is down')]
+        result = strava_import.import_activities(u.id)
+    assert result.status == StravaImport.PENDING
+    assert result.imported == 2
+    assert 'strava is down' in result.last_error
+    assert result.next_attempt_at > datetime.utcnow()
+    assert Activity.query.filter_by(user_id=u.id).count() == 2
+
+
+def test_running_import_not_claimed_until_stale(test_client, init_database, add_strava_athlete, fake_strava):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    user_id = u.id
+    assert strava_import.claim_import(user_id).status == StravaImport.RUNNING
+    assert strava_import.claim_import(user_id) is None
+    assert strava_import.run_pending() == 0
+
+    runner = flask.current_app.test_cli_runner()
+    result = runner.invoke(args=['strava-import', str(user_id)])
+    assert 'The Strava import is already running' in result.output
+
+    # the worker running the import died
+    timeout = flask.current_app.config['STRAVA_IMPORT_RUNNING_TIMEOUT_SECONDS']
+    StravaImport.query.get(user_id).last_updated = datetime.utcnow() - timedelta(seconds=timeout + 1)
+    db.session.commit()
+    fake_strava.add_response(200, [])
+    assert strava_import.run_pending() == 1
+    assert StravaImport.query.get(user_id).status == StravaImport.DONE
@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+
+import flask
+from requests import Response
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import User, Activity, StravaUploadJob, StravaRateLimit
+from app.services import strava_rate_limit, strava_upload
+from app.services.strava_client import StravaClient
+from app.tests import conftest
+
+NOW = datetime(2020, 6, 16, 10, 20, 30)
+
+
+def strava_response(usage, limit='600,30000', status_code=200):
+    response = Mock(Response)
+    response.status_code = status_code
+    response.headers = {'X-RateLimit-Limit': limit, 'X-RateLimit-Usage': usage}
+    return response
+
+
+def test_get_window_start():
+    assert strava_rate_limit.get_window_start(NOW) == datetime(2020, 6, 16, 10, 15)
+    assert strava_rate_limit.get_window_start(datetime(2020, 6, 16, 10, 0)) == datetime(2020, 6, 16, 10, 0)
+
+
+def test_record_response(test_client, init_database):
+    assert strava_rate_limit.get_budget(NOW) is None
+    assert strava_rate_limit.record_response(strava_response('100,2000'), NOW)
+    assert strava_rate_limit.record_response(strava_response('120,2020'), NOW)
+
+    assert StravaRateLimit.query.count() == 1
+    budget = strava_rate_limit.get_budget(NOW)
+    assert budget['short_usage'] == 120
+    assert budget['short_remaining'] == 480
+    assert budget['long_remaining'] == 27980
+
+
+def test_record_response_without_headers(test_client, init_database):
+    response = Mock(Response)
+    response.headers = {}
+    assert strava_rate_limit.record_response(response, NOW) is False
+    assert StravaRateLimit.query.count() == 0
+
+
+def test_budget_resets(test_client, init_database):
+    strava_rate_limit.record_response(strava_response('600,2000'), NOW)
+
+    next_window = strava_rate_limit.get_budget(NOW + timedelta(minutes=10))
+    assert next_window['short_usage'] == 0
+    assert next_window['long_usage'] == 2000
+
+    next_day = strava_rate_limit.get_budget(NOW + timedelta(days=1))
+    assert next_day['long_usage'] == 0
+
+
+def test_defer_until(test_client, init_database):
+    assert strava_rate_limit.defer_until(NOW) is None
+
+    strava_rate_limit.record_response(strava_response('500,2000'), NOW)
+    assert strava_rate_limit.defer_until(NOW) is None
+
+    # within the reserve of the 15 minute limit
+    strava_rate_limit.record_response(strava_response('545,2000'), NOW)
+    assert strava_rate_limit.defer_until(NOW) == datetime(2020, 6, 16, 10, 30)
+
+    # within the reserve of the daily limit
+    strava_rate_limit.record_response(strava_response('10,29000'), NOW)
+    assert strava_rate_limit.defer_until(NOW) == datetime(2020, 6, 17)
+
+
+def test_client_records_usage(test_client, init_database, fake_strava):
+    fake_strava.add_response(200, headers={'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '7,70'})
+    client = StravaClient(fake_strava.url, on_response=strava_rate_limit.record_response)
+    client.get('/api/v3/athlete')
+    client.close()
+
+    assert strava_rate_limit.get_budget()['long_usage'] == 70
+
+
+def test_upload_done_when_usage_cannot_be_recorded(test_client, init_database, add_strava_athlete, fake_strava):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activity = Activity(type=1, title='title', duration=20, timestamp=datetime(2020, 6, 16, 8), user_id=u.id)
+    activity.set_local_time(None, 'UTC')
+    db.session.add(activity)
+    db.session.flush()
+    job = strava_upload.enqueue_upload(activity)
+    db.session.commit()
+    strava_rate_limit._last_recorded[0] = None
+    fake_strava.add_response(201, {'id': 99},
+                             headers={'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '7,70'})
+
+    # the upload's session holds SQLite's write lock so the usage can't be written on another connection
+    with patch.object(db.engine, 'begin', side_effect=OperationalError('UPDATE', {}, 'database is locked')):
+        assert strava_upload.process_job(job) == StravaUploadJob.DONE
+
+    assert Activity.query.get(activity.id).strava_activity_id == 99
+    assert len(fake_strava.requests) == 1
+    assert strava_rate_limit.get_budget() is None
+    # the next response records it
+    assert strava_rate_limit._last_recorded[0] is None
+
+
+def test_upload_deferred_when_budget_low(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activity = Activity(type=1, title='title', duration=20, timestamp=datetime(2020, 6, 16, 8), user_id=u.id)
+    activity.set_local_time(None, 'UTC')
+    db.session.add(activity)
+    db.session.flush()
+    job = strava_upload.enqueue_upload(activity)
+    db.session.commit()
+    strava_rate_limit.record_response(strava_response('599,2000'))
+
+    with patch('app.services.strava.create_activity') as mock_strava:
+        assert strava_upload.run_pending() == 1
+        assert mock_strava.called is False
+
+    assert job.status == StravaUploadJob.PENDING
+    assert job.attempts == 0
+    assert job.next_attempt_at > datetime.utcnow()
+
+
+def test_strava_metrics(test_client, init_database):
+    flask.current_app.config['METRICS_TOKEN'] = 'secret'
+    try:
+        strava_rate_limit.record_response(strava_response('100,2000'))
+
+        response = test_client.get('/api/metrics/strava', headers={'Authorization': 'Bearer secret'})
+        assert response.status_code == 200
+        assert response.json['rate_limit']['short_usage'] == 100
+        assert response.json['uploads_deferred_until'] is None
+        assert 'hits' in response.json['access_tokens']
+
+        assert test_client.get('/api/metrics/strava', headers={'Authorization': 'Bearer wrong'}).status_code == 404
+        # the token isn't accepted in the url
+        assert test_client.get('/api/metrics/strava?token=secret').status_code == 404
+    finally:
+        flask.current_app.config['METRICS_TOKEN'] = None
+
+
+def test_strava_metrics_disabled(test_client, init_database):
+    assert test_client.get('/api/metrics/strava').status_code == 404
+
+
+def test_record_response_leaves_session_alone(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    activity = Activity(type=1, title='uncommitted', duration=20, timestamp=NOW, user_id=u.id)
+    db.session.add(activity)
+
+    assert strava_rate_limit.record_response(strava_response('100,2000'), NOW)
+    db.session.rollback()
+
+    assert Activity.query.filter_by(title='uncommitted').count() == 0
+    assert strava_rate_limit.get_budget(NOW)['short_usage'] == 100
+
+
+def test_record_response_spaced_out(test_client, init_database):
+    flask.current_app.config['STRAVA_RATE_LIMIT_RECORD_SECONDS'] = 5
+    strava_rate_limit._last_recorded[0] = None
+    try:
+        assert strava_rate_limit.record_response(strava_response('100,2000'), NOW)
+        assert not strava_rate_limit.record_response(strava_response('101,2001'), NOW + timedelta(seconds=1))
+        assert strava_rate_limit.get_budget(NOW)['short_usage'] == 100
+        # always written when close to the limit or rate limited
+        assert strava_rate_limit.record_response(strava_response('590,2002'), NOW + timedelta(seconds=2))
+        assert strava_rate_limit.record_response(strava_response('591,2003', status_code=429),
+                                                 NOW + timedelta(seconds=3))
+        assert strava_rate_limit.record_response(strava_response('120,2020'), NOW + timedelta(seconds=10))
+        assert strava_rate_limit.get_budget(NOW)['short_usage'] == 120
+    finally:
+        flask.current_app.config['STRAVA_RATE_LIMIT_RECORD_SECONDS'] = 0
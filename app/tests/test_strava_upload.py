@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import flask
+import requests
+
+from app import db
+from app.models import User, Activity, StravaUploadJob
+from app.services import strava_upload
+from app.tests import conftest
+
+
+def queue_activity(user_id):
+    activity = Activity(type=1, title='title', duration=20, timestamp=datetime(2020, 6, 16, 8), user_id=user_id)
+    activity.set_local_time(None, 'UTC')
+    db.session.add(activity)
+    db.session.flush()
+    job = strava_upload.enqueue_upload(activity)
+    db.session.commit()
+    return job.id
+
+
+def test_run_pending_uploads_activity(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    job_id = queue_activity(u.id)
+
+    with patch('app.services.strava.create_activity') as mock_strava:
+        mock_strava.return_value = 201
+        assert strava_upload.run_pending() == 1
+        assert mock_strava.call_count == 1
+
+    job = StravaUploadJob.query.get(job_id)
+    assert job.status == StravaUploadJob.DONE
+    assert job.attempts == 1
+    assert strava_upload.run_pending() == 0
+
+
+def test_run_pending_retries_with_backoff(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    job_id = queue_activity(u.id)
+
+    with patch('app.services.strava.create_activity') as mock_strava:
+        mock_strava.side_effect = requests.ConnectionError('strava is down')
+        before = datetime.utcnow()
+        assert strava_upload.run_pending() == 1
+
+        job = StravaUploadJob.query.get(job_id)
+        assert job.status == StravaUploadJob.PENDING
+        assert 'strava is down' in job.last_error
+        assert job.next_attempt_at >= before + timedelta(seconds=flask.current_app.config['STRAVA_UPLOAD_BACKOFF_SECONDS'])
+
+        # not due yet
+        assert strava_upload.run_pending() == 0
+        assert mock_strava.call_count == 1
+
+
+def test_calc_backoff_doubles_up_to_maximum(test_client):
+    base = flask.current_app.config['STRAVA_UPLOAD_BACKOFF_SECONDS']
+    maximum = flask.current_app.config['STRAVA_UPLOAD_MAX_BACKOFF_SECONDS']
+    assert strava_upload.calc_backoff(1) == timedelta(seconds=base)
+    assert strava_upload.calc_backoff(2) == timedelta(seconds=base * 2)
+    assert strava_upload.calc_backoff(20) == timedelta(seconds=maximum)
+
+
+def test_process_job_gives_up_after_max_attempts(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    job = StravaUploadJob.query.get(queue_activity(u.id))
+    job.attempts = flask.current_app.config['STRAVA_UPLOAD_MAX_ATTEMPTS'] - 1
+
+    with patch('app.services.strava.create_activity') as mock_strava:
+        mock_strava.return_value = 503
+        assert strava_upload.process_job(job) == StravaUploadJob.FAILED
+    assert job.last_error == 'Strava status code 503'
+
+
+def test_process_job_client_error_not_retried(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    job = StravaUploadJob.query.get(queue_activity(u.id))
+
+    with patch('app.services.strava.create_activity') as mock_strava:
+        mock_strava.return_value = 400
+        assert strava_upload.process_job(job) == StravaUploadJob.FAILED
+
+
+def test_claimed_job_not_claimed_again(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    queue_activity(u.id)
+
+    assert len(strava_upload.claim_due_jobs()) == 1
+    assert strava_upload.claim_due_jobs() == []
+
+
+def test_strava_worker_command(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    job_id = queue_activity(u.id)
+
+    runner = flask.current_app.test_cli_runner()
+    with patch('app.services.strava.create_activity') as mock_strava:
+        mock_strava.return_value = 201
+        result = runner.invoke(args=['strava-worker', '--once'])
+    assert 'Processed 1 Strava uploads' in result.output
+    assert StravaUploadJob.query.get(job_id).status == StravaUploadJob.DONE
+
+
+def test_stale_running_job_failed(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    job_id = queue_activity(u.id)
+    assert len(strava_upload.claim_due_jobs()) == 1
+
+    # a job still running within the timeout is left alone
+    assert strava_upload.claim_due_jobs() == []
+    assert StravaUploadJob.query.get(job_id).status == StravaUploadJob.RUNNING
+
+    # the worker running the job died, perhaps after Strava created the activity
+    timeout = flask.current_app.config['STRAVA_UPLOAD_RUNNING_TIMEOUT_SECONDS']
+    job = StravaUploadJob.query.get(job_id)
+    job.last_updated = datetime.utcnow() - timedelta(seconds=timeout + 1)
+    db.session.commit()
+
+    with patch('app.services.strava.create_activity') as mock_strava:
+        assert strava_upload.run_pending() == 0
+        assert mock_strava.called is False
+    job = StravaUploadJob.query.get(job_id)
+    assert job.status == StravaUploadJob.FAILED
+    assert job.last_error.startswith('Upload interrupted')
+
+
+def test_process_job_other_error_retried(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    job_id = queue_activity(u.id)
+
+    with patch('app.services.strava.create_activity') as mock_strava:
+        mock_strava.side_effect = KeyError('id')
+        assert strava_upload.run_pending() == 1
+
+    job = StravaUploadJob.query.get(job_id)
+    assert job.status == StravaUploadJob.PENDING
+    assert job.attempts == 1
+    assert "KeyError('id')" in job.last_error
+
+
+def test_strava_worker_carries_on_after_error(test_client, init_database):
+    runner = flask.current_app.test_cli_runner()
+    with patch('app.services.strava_webhooks.run_pending') as mock_webhooks:
+        mock_webhooks.side_effect = RuntimeError('bad event')
+        result = runner.invoke(args=['strava-worker', '--once'])
+    assert result.exit_code == 0
+
+
+def test_process_job_read_timeout_not_retried(test_client, init_database):
+    u = User.query.filter_by(username=conftest.TEST_USER_USERNAME).first()
+    job = StravaUploadJob.query.get(queue_activity(u.id))
+    post = requests.Request('POST', 'https://www.strava.com/api/v3/activities').prepare()
+
+    with patch('app.services.strava.create_activity') as mock_strava:
+        mock_strava.side_effect = requests.ReadTimeout('read timed out', request=post)
+        assert strava_upload.process_job(job) == StravaUploadJob.FAILED
+    assert 'read timed out' in job.last_error
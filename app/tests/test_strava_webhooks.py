@@ -0,0 +1,222 @@
+import json
+from datetime import datetime, date, timedelta
+from unittest.mock import patch
+
+import flask
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import StravaAthlete, StravaWebhookEvent, Activity, DailyActivityRollup
+from app.services import strava, strava_webhooks
+
+
+@pytest.fixture(autouse=True)
+def subscription_id(monkeypatch):
+    monkeypatch.setenv('STRAVA_SUBSCRIPTION_ID', '1234')
+
+
+def deauthorize_event(athlete_id, event_time=1592300000):
+    return {'object_type': 'athlete',
+            'object_id': athlete_id,
+            'aspect_type': 'update',
+            'updates': {'authorized': 'false'},
+            'owner_id': athlete_id,
+            'subscription_id': 1234,
+            'event_time': event_time}
+
+
+def test_callback_stores_event(test_client, init_database, add_strava_athlete):
+    with patch('app.services.strava.deauthorize_athlete') as mock_deauthorize:
+        response = test_client.post('/api/strava/callback', json=deauthorize_event(123456))
+        assert response.status_code == 200
+        assert mock_deauthorize.called is False
+
+    event = StravaWebhookEvent.query.first()
+    assert event.status == StravaWebhookEvent.PENDING
+    assert event.object_type == 'athlete'
+    assert event.owner_id == 123456
+    assert json.loads(event.payload)['updates'] == {'authorized': 'false'}
+
+
+def test_callback_ignores_retried_event(test_client, init_database, add_strava_athlete):
+    for _ in range(3):
+        response = test_client.post('/api/strava/callback', json=deauthorize_event(123456))
+        assert response.status_code == 200
+
+    assert StravaWebhookEvent.query.count() == 1
+
+    # a different event for the same athlete is stored
+    test_client.post('/api/strava/callback', json=deauthorize_event(123456, event_time=1592300001))
+    assert StravaWebhookEvent.query.count() == 2
+
+
+def test_callback_invalid_subscription_not_stored(test_client, init_database):
+    event = dict(deauthorize_event(123456), subscription_id=4321)
+    assert test_client.post('/api/strava/callback', json=event).status_code == 200
+    assert StravaWebhookEvent.query.count() == 0
+
+
+def test_run_pending_processes_each_event_once(test_client, init_database, add_strava_athlete):
+    strava_webhooks.receive_event(deauthorize_event(123456))
+
+    with patch('app.services.strava.deauthorize_athlete') as mock_deauthorize:
+        mock_deauthorize.return_value = True
+        assert strava_webhooks.run_pending() == 1
+        assert strava_webhooks.run_pending() == 0
+        mock_deauthorize.assert_called_once_with(123456)
+
+    assert StravaWebhookEvent.query.first().status == StravaWebhookEvent.DONE
+
+
+def test_process_event_bad_updates(test_client, init_database, add_strava_athlete):
+    strava_webhooks.receive_event(dict(deauthorize_event(123456), updates={'authorized': 'hfghg'}))
+    event = strava_webhooks.claim_pending_events()[0]
+
+    assert strava_webhooks.process_event(event) == StravaWebhookEvent.FAILED
+    assert StravaAthlete.query.filter_by(athlete_id=123456).first().is_active == 1
+
+
+def test_process_event_error_retried(test_client, init_database, add_strava_athlete):
+    strava_webhooks.receive_event(deauthorize_event(123456))
+    event = strava_webhooks.claim_pending_events()[0]
+
+    with patch('app.services.strava.deauthorize_athlete') as mock_deauthorize:
+        mock_deauthorize.side_effect = OperationalError('UPDATE', {}, Exception('database went away'))
+        before = datetime.utcnow()
+        assert strava_webhooks.process_event(event) == StravaWebhookEvent.PENDING
+        assert event.attempts == 1
+        assert 'database went away' in event.last_error
+        assert event.next_attempt_at >= before + timedelta(
+            seconds=flask.current_app.config['STRAVA_UPLOAD_BACKOFF_SECONDS'])
+        # not due yet
+        assert strava_webhooks.claim_pending_events() == []
+
+        event.attempts = flask.current_app.config['STRAVA_WEBHOOK_MAX_ATTEMPTS'] - 1
+        event.next_attempt_at = before
+        db.session.commit()
+        event = strava_webhooks.claim_pending_events()[0]
+        assert strava_webhooks.process_event(event) == StravaWebhookEvent.FAILED
+
+
+def test_strava_worker_processes_events(test_client, init_database, add_strava_athlete):
+    strava_webhooks.receive_event(deauthorize_event(123456))
+
+    runner = flask.current_app.test_cli_runner()
+    result = runner.invoke(args=['strava-worker', '--once'])
+    assert 'Processed 1 Strava webhook events' in result.output
+    assert StravaAthlete.query.filter_by(athlete_id=123456).first().is_active == 0
+
+
+STRAVA_ACTIVITY = {'id': 987654321012, 'name': 'Morning Ride', 'description': 'along the river', 'type': 'Ride',
+                   'elapsed_time': 3660, 'distance': 20125.5, 'start_date': '2020-06-17T05:30:00Z',
+                   'start_date_local': '2020-06-16T22:30:00Z', 'timezone': '(GMT-08:00) America/Los_Angeles'}
+
+
+def activity_event(aspect_type, strava_activity_id=STRAVA_ACTIVITY['id'], event_time=1592300000):
+    return {'object_type': 'activity',
+            'object_id': strava_activity_id,
+            'aspect_type': aspect_type,
+            'updates': {},
+            'owner_id': 123456,
+            'subscription_id': 1234,
+            'event_time': event_time}
+
+
+def test_activity_create_event(test_client, init_database, add_strava_athlete, fake_strava):
+    fake_strava.add_response(200, STRAVA_ACTIVITY)
+    strava_webhooks.receive_event(activity_event('create'))
+
+    assert strava_webhooks.run_pending() == 1
+    method, path, _, _ = fake_strava.requests[-1]
+    assert (method, path) == ('GET', '/api/v3/activities/987654321012')
+
+    activity = Activity.query.filter_by(strava_activity_id=987654321012).first()
+    assert activity.user_id == StravaAthlete.query.filter_by(athlete_id=123456).first().user_id
+    assert activity.type == 3
+    assert activity.title == 'Morning Ride'
+    assert activity.duration == 61
+    assert float(activity.distance) == 20.13
+    assert activity.timestamp == datetime(2020, 6, 17, 5, 30)
+    assert activity.local_date == date(2020, 6, 16)
+
+    rollup_row = DailyActivityRollup.query.filter_by(user_id=activity.user_id).first()
+    assert (rollup_row.local_date, rollup_row.count, rollup_row.duration) == (date(2020, 6, 16), 1, 61)
+
+
+def test_activity_update_event(test_client, init_database, add_strava_athlete, fake_strava):
+    fake_strava.add_response(200, STRAVA_ACTIVITY)
+    fake_strava.add_response(200, dict(STRAVA_ACTIVITY, name='Evening Ride', type='Kitesurf',
+                                       start_date='2020-06-18T05:30:00Z', start_date_local='2020-06-17T22:30:00Z'))
+    strava_webhooks.receive_event(activity_event('create'))
+    strava_webhooks.receive_event(activity_event('update', event_time=1592300100))
+
+    assert strava_webhooks.run_pending() == 2
+    activities = Activity.query.filter_by(strava_activity_id=987654321012).all()
+    assert len(activities) == 1
+    assert activities[0].title == 'Evening Ride'
+    assert activities[0].type == 1
+
+    # moved from one day to the next
+    rollups = DailyActivityRollup.query.filter_by(user_id=activities[0].user_id).all()
+    assert sorted((r.local_date, r.count) for r in rollups) == [(date(2020, 6, 16), 0), (date(2020, 6, 17), 1)]
+
+
+def test_activity_delete_event(test_client, init_database, add_strava_athlete, fake_strava):
+    fake_strava.add_response(200, STRAVA_ACTIVITY)
+    strava_webhooks.receive_event(activity_event('create'))
+    strava_webhooks.receive_event(activity_event('delete', event_time=1592300100))
+
+    assert strava_webhooks.run_pending() == 2
+    assert Activity.query.filter_by(strava_activity_id=987654321012).first() is None
+    assert len(fake_strava.requests) == 1
+    assert DailyActivityRollup.query.first().count == 0
+
+
+def test_activity_event_fetch_failed(test_client, init_database, add_strava_athlete, fake_strava):
+    fake_strava.add_response(404, {'message': 'Record Not Found'})
+    strava_webhooks.receive_event(activity_event('create'))
+    event = strava_webhooks.claim_pending_events()[0]
+
+    assert strava_webhooks.process_event(event) == StravaWebhookEvent.FAILED
+    assert Activity.query.count() == 0
+
+
+def test_activity_event_unknown_athlete(test_client, init_database, fake_strava):
+    strava_webhooks.receive_event(activity_event('create'))
+
+    assert strava_webhooks.run_pending() == 1
+    assert fake_strava.requests == []
+    assert Activity.query.count() == 0
+
+
+def test_uploaded_activity_not_imported_twice(test_client, init_database, add_strava_athlete, add_activity,
+                                              fake_strava):
+    activity = Activity.query.first()
+    fake_strava.add_response(201, {'id': STRAVA_ACTIVITY['id']})
+    fake_strava.add_response(200, STRAVA_ACTIVITY)
+
+    assert strava.create_activity(activity.id) == 201
+    assert activity.strava_activity_id == STRAVA_ACTIVITY['id']
+
+    strava_webhooks.receive_event(activity_event('create'))
+    assert strava_webhooks.run_pending() == 1
+    assert Activity.query.count() == 1
+
+
+def test_activity_event_strava_unavailable(test_client, init_database, add_strava_athlete, fake_strava):
+    for _ in range(3):
+        fake_strava.add_response(503)
+    strava_webhooks.receive_event(activity_event('create'))
+    event = strava_webhooks.claim_pending_events()[0]
+
+    assert strava_webhooks.process_event(event) == StravaWebhookEvent.PENDING
+    assert 'HTTPError' in event.last_error
+
+    # Strava is back
+    fake_strava.add_response(200, STRAVA_ACTIVITY)
+    event.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+    assert strava_webhooks.run_pending() == 1
+    assert StravaWebhookEvent.query.get(event.id).status == StravaWebhookEvent.DONE
+    assert Activity.query.filter_by(strava_activity_id=987654321012).count() == 1
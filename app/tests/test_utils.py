@@ -67,6 +67,30 @@ def test_get_utc_from_local_time_badtz():
     assert my_date_utc.tzinfo == pytz.utc
 
 
+def test_get_timezone_is_cached():
+    utils.get_timezone.cache_clear()
+    assert utils.get_timezone('America/Los_Angeles') is pytz.timezone('America/Los_Angeles')
+    assert utils.get_timezone('fgfgfggf') is pytz.utc
+    assert utils.get_timezone('fgfgfggf') is pytz.utc
+    assert utils.get_timezone(None) is pytz.utc
+    # the unknown timezone is only looked up once
+    assert utils.get_timezone.cache_info().hits == 1
+    assert utils.get_timezone.cache_info().currsize == 3
+
+
+def test_convert_many_times():
+    my_dates = [datetime(2020, 6, 18, hour, 58, 33) for hour in range(0, 24, 5)] + [datetime(2020, 12, 18, 1)]
+
+    assert utils.localize_local_times(my_dates, 'America/Los_Angeles') == \
+        [utils.localize_local_time(my_date, 'America/Los_Angeles') for my_date in my_dates]
+    assert utils.get_utc_from_local_times(my_dates, 'America/Los_Angeles') == \
+        [utils.get_utc_from_local_time(my_date, 'America/Los_Angeles') for my_date in my_dates]
+    assert utils.get_local_times_from_utc(my_dates, 'America/Los_Angeles') == \
+        [utils.get_local_time_from_utc(my_date, 'America/Los_Angeles') for my_date in my_dates]
+    assert [my_date.tzinfo for my_date in utils.get_local_times_from_utc(my_dates[-1:], 'fgfgfggf')] == [pytz.utc]
+    assert utils.localize_local_times([], 'Europe/London') == []
+
+
 def test_generate_random_filename_from_email():
     email = "bobby@chariot.net"
     assert "bobby" in utils.generate_random_filename_from_email(email)
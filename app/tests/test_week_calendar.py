@@ -0,0 +1,50 @@
+from datetime import datetime, date
+from unittest.mock import patch
+
+from app.services import charting, week_calendar
+
+
+def test_calendar_bookends():
+    calendar = week_calendar.WeekCalendar(date(2020, 6, 18))
+
+    for week_offset in range(-2, 60):
+        assert calendar.bookends(week_offset) == charting.get_week_bookends(date(2020, 6, 18), week_offset)
+    assert calendar.bookends(0) == (date(2020, 6, 14), date(2020, 6, 15), date(2020, 6, 21))
+
+
+def test_calendar_12_weeks():
+    calendar = week_calendar.WeekCalendar(date(2021, 1, 3))
+
+    assert calendar.weeks_bookends(12) == charting.get_12_week_bookends(date(2021, 1, 3))
+    assert calendar.weeks_bookends(4) == (date(2020, 11, 29), date(2020, 11, 30), date(2020, 12, 28))
+
+
+def test_get_calendar_uses_local_date():
+    # 9pm on Sunday in Los Angeles is Monday in UTC
+    now = datetime(2020, 6, 22, 4)
+    assert week_calendar.get_calendar('America/Los_Angeles', now).today == date(2020, 6, 21)
+    assert week_calendar.get_calendar('America/Los_Angeles', now).bookends(0)[1] == date(2020, 6, 15)
+    assert week_calendar.get_calendar('UTC', now).bookends(0)[1] == date(2020, 6, 22)
+
+
+def test_get_calendar_kept_for_the_day():
+    calendar = week_calendar.get_calendar('Asia/Kolkata', datetime(2020, 6, 17, 18, 29))
+    assert calendar.today == date(2020, 6, 17)
+
+    with patch('app.services.week_calendar.utils.get_timezone') as get_timezone:
+        assert week_calendar.get_calendar('Asia/Kolkata', datetime(2020, 6, 16, 18, 30)) is calendar
+        assert get_timezone.called is False
+
+    # midnight in Kolkata
+    next_calendar = week_calendar.get_calendar('Asia/Kolkata', datetime(2020, 6, 17, 18, 30))
+    assert next_calendar.today == date(2020, 6, 18)
+    # a time before the calendar's day builds the calendar for that day
+    assert week_calendar.get_calendar('Asia/Kolkata', datetime(2020, 6, 1)).today == date(2020, 6, 1)
+
+
+def test_charting_uses_calendar():
+    calendar = week_calendar.get_calendar('Europe/London')
+
+    assert charting.get_local_today('Europe/London') == calendar.today
+    assert charting.get_week_bookends(None, 3, 'Europe/London') == calendar.bookends(3)
+    assert charting.get_12_week_bookends(None, 'Europe/London') == calendar.weeks_bookends(12)
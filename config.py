@@ -18,9 +18,97 @@ class Config(object):
     STRAVA_CLIENT_SECRET = os.environ.get('STRAVA_CLIENT_SECRET') or ''
     STRAVA_CLIENT_DOMAIN = os.environ.get('STRAVA_CLIENT_DOMAIN') or 'http://www.strava.com'
 
+    # the Strava API and the pooled client used to call it
+    STRAVA_API_URL = os.environ.get('STRAVA_API_URL') or 'https://www.strava.com'
+    STRAVA_CONNECT_TIMEOUT = float(os.environ.get('STRAVA_CONNECT_TIMEOUT') or 3.05)
+    STRAVA_READ_TIMEOUT = float(os.environ.get('STRAVA_READ_TIMEOUT') or 10)
+    STRAVA_MAX_RETRIES = int(os.environ.get('STRAVA_MAX_RETRIES') or 2)
+    STRAVA_POOL_SIZE = int(os.environ.get('STRAVA_POOL_SIZE') or 10)
+
+    # how the log of calls to Strava is written: 'commit' each event straight away, 'transaction' with the
+    # rest of the request's changes, or 'buffered' in memory and inserted in batches, losing the
+    # unwritten events if the process dies
+    STRAVA_EVENT_DURABILITY = os.environ.get('STRAVA_EVENT_DURABILITY') or 'transaction'
+    STRAVA_EVENT_BUFFER_SIZE = int(os.environ.get('STRAVA_EVENT_BUFFER_SIZE') or 100)
+    STRAVA_EVENT_FLUSH_SECONDS = int(os.environ.get('STRAVA_EVENT_FLUSH_SECONDS') or 10)
+    STRAVA_EVENT_BUFFER_LIMIT = int(os.environ.get('STRAVA_EVENT_BUFFER_LIMIT') or 10000)
+
+    # activities fetched from Strava and inserted at a time when importing a user's history
+    STRAVA_IMPORT_BATCH_SIZE = int(os.environ.get('STRAVA_IMPORT_BATCH_SIZE') or 200)
+    # an import interrupted by Strava or the database carries on after this many seconds, one still running
+    # after STRAVA_IMPORT_RUNNING_TIMEOUT_SECONDS without progress is assumed to belong to a worker that died
+    STRAVA_IMPORT_RETRY_SECONDS = int(os.environ.get('STRAVA_IMPORT_RETRY_SECONDS') or 900)
+    STRAVA_IMPORT_RUNNING_TIMEOUT_SECONDS = int(os.environ.get('STRAVA_IMPORT_RUNNING_TIMEOUT_SECONDS') or 900)
+
+    # fraction of each Strava rate limit kept for calls made while a user waits, queued uploads are put off
+    STRAVA_RATE_LIMIT_RESERVE = float(os.environ.get('STRAVA_RATE_LIMIT_RESERVE') or 0.1)
+    # each process writes the usage from Strava's responses at most this often, unless the limits are nearly used up
+    STRAVA_RATE_LIMIT_RECORD_SECONDS = float(os.environ.get('STRAVA_RATE_LIMIT_RECORD_SECONDS') or 5)
+
+    # token required to read the /api/metrics endpoints, they are disabled if not set
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
     # toggles saving exercises to strava
     CALL_STRAVA_API = os.environ.get('CALL_STRAVA_API') or False
 
+    # access tokens are refreshed this many seconds before they expire
+    STRAVA_TOKEN_EXPIRY_MARGIN = int(os.environ.get('STRAVA_TOKEN_EXPIRY_MARGIN') or 300)
+
+    # retries of the strava-worker when an upload fails, the delay doubles with each attempt
+    STRAVA_UPLOAD_MAX_ATTEMPTS = int(os.environ.get('STRAVA_UPLOAD_MAX_ATTEMPTS') or 6)
+    STRAVA_UPLOAD_BACKOFF_SECONDS = int(os.environ.get('STRAVA_UPLOAD_BACKOFF_SECONDS') or 30)
+    STRAVA_UPLOAD_MAX_BACKOFF_SECONDS = int(os.environ.get('STRAVA_UPLOAD_MAX_BACKOFF_SECONDS') or 3600)
+    # an upload still running after this many seconds is assumed to belong to a worker that died and is failed,
+    # as the worker may have created the activity on Strava before it died
+    STRAVA_UPLOAD_RUNNING_TIMEOUT_SECONDS = int(os.environ.get('STRAVA_UPLOAD_RUNNING_TIMEOUT_SECONDS') or 900)
+    # webhook events that fail while Strava or the database is having problems are retried with the same backoff
+    STRAVA_WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('STRAVA_WEBHOOK_MAX_ATTEMPTS') or 6)
+
+    # the logged in user is cached for this many seconds rather than loaded on every request
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL') or 300)
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE') or 1024)
+
+    # whether a user is connected to Strava is cached for this many seconds. Each process has its own cache and
+    # only the process making a change drops its entry, e.g. when the strava-worker handles a deauthorization,
+    # so the other processes can use the old status for up to this long
+    INTEGRATION_CACHE_TTL = int(os.environ.get('INTEGRATION_CACHE_TTL') or 30)
+    INTEGRATION_CACHE_SIZE = int(os.environ.get('INTEGRATION_CACHE_SIZE') or 1024)
+
+    # seconds between writes of a user's last seen time, and the most users whose last write is remembered
+    LAST_SEEN_INTERVAL = int(os.environ.get('LAST_SEEN_INTERVAL') or 300)
+    LAST_SEEN_MAX_USERS = int(os.environ.get('LAST_SEEN_MAX_USERS') or 10000)
+
+    # number of activities shown per page of the exercise log
+    ACTIVITY_LOG_PAGE_SIZE = int(os.environ.get('ACTIVITY_LOG_PAGE_SIZE') or 25)
+    # number of inspirations shown per page of the feed
+    INSPIRATION_PAGE_SIZE = int(os.environ.get('INSPIRATION_PAGE_SIZE') or 24)
+    # how likes are added to an inspiration's counter: 'immediate' along with the like, or 'buffered'
+    # in memory and added in batches, for popular inspirations, losing the unwritten likes if the process dies
+    INSPIRATION_LIKE_COUNTER = os.environ.get('INSPIRATION_LIKE_COUNTER') or 'immediate'
+    INSPIRATION_LIKE_BUFFER_SIZE = int(os.environ.get('INSPIRATION_LIKE_BUFFER_SIZE') or 100)
+    INSPIRATION_LIKE_FLUSH_SECONDS = int(os.environ.get('INSPIRATION_LIKE_FLUSH_SECONDS') or 10)
+
+    # the og-worker fetches the Open Graph preview of each inspiration's url, at most OG_MAX_WORKERS
+    # pages at once and OG_PER_HOST_LIMIT from the same site, reading no more than OG_MAX_BYTES of a page
+    OG_MAX_WORKERS = int(os.environ.get('OG_MAX_WORKERS') or 4)
+    OG_PER_HOST_LIMIT = int(os.environ.get('OG_PER_HOST_LIMIT') or 2)
+    OG_CONNECT_TIMEOUT = float(os.environ.get('OG_CONNECT_TIMEOUT') or 3.05)
+    OG_READ_TIMEOUT = float(os.environ.get('OG_READ_TIMEOUT') or 5)
+    OG_MAX_BYTES = int(os.environ.get('OG_MAX_BYTES') or 512 * 1024)
+    # pages are only fetched from public addresses so an inspiration's url can't reach the instance metadata
+    # or other internal hosts, allowing private addresses is only meant for testing
+    OG_ALLOW_PRIVATE_ADDRESSES = bool(os.environ.get('OG_ALLOW_PRIVATE_ADDRESSES'))
+    OG_MAX_REDIRECTS = int(os.environ.get('OG_MAX_REDIRECTS') or 3)
+    # previews already parsed are kept for this many seconds, by url
+    OG_CACHE_TTL = int(os.environ.get('OG_CACHE_TTL') or 86400)
+    OG_CACHE_SIZE = int(os.environ.get('OG_CACHE_SIZE') or 1024)
+
+    # where the weekly chart and goal totals are summed: 'rollup' (precomputed daily rollups),
+    # 'sql' (GROUP BY in the database) or 'python' (load the activities and sum them)
+    CHART_AGGREGATION_BACKEND = os.environ.get('CHART_AGGREGATION_BACKEND') or 'rollup'
+    # the most weeks the trend chart can be asked for
+    CHART_TREND_MAX_WEEKS = int(os.environ.get('CHART_TREND_MAX_WEEKS') or 104)
+
     # staticmethod
     def init_app(app):
         pass
@@ -35,6 +123,9 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     CALL_STRAVA_API = False
     TESTING = True
+    STRAVA_RATE_LIMIT_RECORD_SECONDS = 0
+    # the fake sites the tests fetch pages from are on localhost
+    OG_ALLOW_PRIVATE_ADDRESSES = True
     LIVESERVER_PORT = 8943
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'test_app.db')
 